@@ -0,0 +1,283 @@
+# -*- coding: us-ascii -*-
+"""SQLite index of the entries of a FoamArchive."""
+import os
+import re
+import logging
+import sqlite3
+import threading
+from os import path
+
+from PyFoamSMHI.contrib.Snapshot import fileHash
+from PyFoamSMHI.contrib.CasePack import CasePack, SUFFIX as PACK_SUFFIX
+
+log = logging.getLogger(__name__)
+
+INDEX_FILE = ".archiveIndex.sqlite"
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS entries (
+        dir TEXT,
+        file TEXT,
+        size INTEGER,
+        checksum TEXT,
+        compression TEXT,
+        PRIMARY KEY (dir, file)
+    )""",
+    """CREATE TABLE IF NOT EXISTS cases (
+        dir TEXT PRIMARY KEY,
+        wspeed REAL,
+        wdir REAL,
+        z0 REAL
+    )"""
+]
+
+CASE_EXP = re.compile(r"wspeed_([-+.\deE]+)_wdir_([-+.\deE]+)$")
+
+
+def isArchived(fileName):
+    """True for files that are archive entries, not temporary or backup
+    files"""
+    return ".bak" not in fileName and "~" not in fileName and \
+        "#" not in fileName and not fileName.startswith(".")
+
+
+def compression(fileName):
+    if fileName.endswith(".gz"):
+        return "gzip"
+    if fileName.endswith(".fa"):
+        return "array"
+    return "none"
+
+
+def caseKey(dirName):
+    """Wind speed and direction of a case from its directory name
+    @return: (wspeed, wdir), or (None, None) if not a case directory"""
+    match = CASE_EXP.match(dirName)
+    if match is None:
+        return None, None
+    try:
+        return float(match.group(1)), float(match.group(2))
+    except ValueError:
+        return None, None
+
+
+class ArchiveIndex:
+    """Index of the files of an archive, kept in the archive directory
+
+    Each file in a directory of the archive is recorded with its size,
+    checksum and compression, and each directory with the case key, i.e.
+    wind speed, direction and roughness. Membership and listing queries
+    are answered from the index instead of scanning the archive. A
+    connection is opened for each operation, so that the index can be
+    used from several threads and processes."""
+
+    def __init__(self, archivePath):
+        """@param archivePath: the archive directory"""
+        self.archivePath = archivePath
+        self.path = path.join(archivePath, INDEX_FILE)
+        self.lock = threading.Lock()
+        isNew = not path.exists(self.path)
+        self.execute(SCHEMA)
+        if isNew:
+            self.rebuild()
+
+    def execute(self, statements, fetch=False):
+        """Execute a list of statements or (statement, parameters)
+        @param fetch: if True, rows of the last statement are returned"""
+        with self.lock:
+            con = sqlite3.connect(self.path, timeout=60)
+            try:
+                cur = con.cursor()
+                for statement in statements:
+                    if isinstance(statement, tuple):
+                        cur.execute(*statement)
+                    else:
+                        cur.execute(statement)
+                rows = cur.fetchall() if fetch else None
+                con.commit()
+            finally:
+                con.close()
+        return rows
+
+    def pack(self, dirName):
+        """CasePack of a directory, files of a case in pack mode are kept
+        in <dirName>.pack in the root of the archive"""
+        return CasePack(path.join(self.archivePath, dirName + PACK_SUFFIX))
+
+    def fileInfo(self, dirName, fileName, checksum=None):
+        """Size and checksum of an archived file, in its directory or in
+        the pack of the directory
+        @param checksum: optional, computed from the file if not given"""
+        filePath = path.join(self.archivePath, dirName, fileName)
+        if dirName != "" and not path.exists(filePath):
+            pack = self.pack(dirName)
+            if pack.exists() and pack.has(fileName):
+                offset, length, packChecksum = pack.entry(fileName)
+                return length, checksum or packChecksum
+        if checksum is None:
+            checksum = fileHash(filePath)
+        return os.path.getsize(filePath), checksum
+
+    def fileHash(self, dirName, fileName):
+        """Content hash computed from the data of an archived file"""
+        filePath = path.join(self.archivePath, dirName, fileName)
+        if dirName != "" and not path.exists(filePath):
+            return self.pack(dirName).hash(fileName)
+        return fileHash(filePath)
+
+    def entryStatements(self, dirName, fileName, checksum=None):
+        """Statements adding or replacing the entry of an archived file
+        @param checksum: optional, computed from the file if not given"""
+        size, checksum = self.fileInfo(dirName, fileName, checksum)
+        statements = [(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+            (dirName, fileName, size, checksum, compression(fileName))
+        )]
+        wspeed, wdir = caseKey(dirName)
+        statements.append((
+            "INSERT OR IGNORE INTO cases (dir, wspeed, wdir) "
+            "VALUES (?, ?, ?)", (dirName, wspeed, wdir)
+        ))
+        return statements
+
+    def addEntry(self, dirName, fileName, checksum=None):
+        """Add or replace the entry of a file written to the archive
+        @param dirName: directory in the archive, "" for the root"""
+        self.execute(self.entryStatements(dirName, fileName, checksum))
+
+    def removeEntry(self, dirName, fileName):
+        self.execute([(
+            "DELETE FROM entries WHERE dir=? AND file=?", (dirName, fileName)
+        )])
+
+    def removeDir(self, dirName):
+        self.execute([
+            ("DELETE FROM entries WHERE dir=?", (dirName,)),
+            ("DELETE FROM cases WHERE dir=?", (dirName,))
+        ])
+
+    def setCaseKey(self, dirName, wspeed, wdir, z0=None):
+        self.execute([(
+            "INSERT OR REPLACE INTO cases VALUES (?, ?, ?, ?)",
+            (dirName, wspeed, wdir, z0)
+        )])
+
+    def caseKey(self, dirName):
+        """@return: (wspeed, wdir, z0) of a directory, None if unknown"""
+        rows = self.execute([(
+            "SELECT wspeed, wdir, z0 FROM cases WHERE dir=?", (dirName,)
+        )], fetch=True)
+        if len(rows) == 0:
+            return None
+        return rows[0]
+
+    def hasDir(self, dirName):
+        return len(self.execute([(
+            "SELECT 1 FROM cases WHERE dir=? LIMIT 1", (dirName,)
+        )], fetch=True)) > 0
+
+    def hasFile(self, dirName, fileName):
+        return len(self.execute([(
+            "SELECT 1 FROM entries WHERE dir=? AND file=?",
+            (dirName, fileName)
+        )], fetch=True)) > 0
+
+    def dirs(self):
+        """Directories in the archive"""
+        return [r[0] for r in self.execute([
+            "SELECT dir FROM cases WHERE dir != '' ORDER BY dir"
+        ], fetch=True)]
+
+    def files(self, dirName=None, prefix=None):
+        """Entries of the archive
+        @param dirName: optional, only the files of this directory
+        @param prefix: optional, only files with prefix in the name
+        @return: list of (dir, file, size, checksum, compression)"""
+        query = "SELECT dir, file, size, checksum, compression FROM entries"
+        params = []
+        if dirName is not None:
+            query += " WHERE dir=?"
+            params.append(dirName)
+        query += " ORDER BY dir, file"
+        rows = self.execute([(query, tuple(params))], fetch=True)
+        if prefix is not None:
+            rows = [r for r in rows if prefix in r[1]]
+        return rows
+
+    def scan(self):
+        """Files in the archive, as {(dir, file): size}, where dir is ""
+        for files in the root of the archive"""
+        found = {}
+        for f in os.listdir(self.archivePath):
+            filePath = path.join(self.archivePath, f)
+            if not isArchived(f) or not path.isfile(filePath):
+                continue
+            if f.endswith(PACK_SUFFIX):
+                d = f[:-len(PACK_SUFFIX)]
+                for name, entry in self.pack(d).entries().items():
+                    found[(d, name)] = entry[1]
+            # metadata of directories is kept in .meta files in the root
+            elif not f.endswith(".meta"):
+                found[("", f)] = os.path.getsize(filePath)
+        for d in os.listdir(self.archivePath):
+            dirPath = path.join(self.archivePath, d)
+            if not path.isdir(dirPath):
+                continue
+            for f in os.listdir(dirPath):
+                filePath = path.join(dirPath, f)
+                if isArchived(f) and path.isfile(filePath):
+                    found[(d, f)] = os.path.getsize(filePath)
+        return found
+
+    def rebuild(self):
+        """Rebuild the index from the files in the archive, keeping the
+        case keys of directories still in the archive"""
+        log.info("Building index of archive %s" % self.archivePath)
+        found = self.scan()
+        statements = ["DELETE FROM entries"]
+        dirs = set()
+        for (d, f) in sorted(found.keys()):
+            statements += self.entryStatements(d, f)
+            dirs.add(d)
+        for f in os.listdir(self.archivePath):
+            if path.isdir(path.join(self.archivePath, f)):
+                d = f
+            elif isArchived(f) and f.endswith(PACK_SUFFIX):
+                d = f[:-len(PACK_SUFFIX)]
+            else:
+                continue
+            if d not in dirs:
+                dirs.add(d)
+                wspeed, wdir = caseKey(d)
+                statements.append((
+                    "INSERT OR IGNORE INTO cases (dir, wspeed, wdir) "
+                    "VALUES (?, ?, ?)", (d, wspeed, wdir)
+                ))
+        keys = self.execute(["SELECT dir FROM cases"], fetch=True)
+        for (d,) in keys:
+            if d not in dirs:
+                statements.append(("DELETE FROM cases WHERE dir=?", (d,)))
+        self.execute(statements)
+        return len(found)
+
+    def verify(self, checksums=False):
+        """Compare the index with the files in the archive
+        @param checksums: if True, also compare the checksums
+        @return: list of (dir, file, problem)"""
+        found = self.scan()
+        problems = []
+        indexed = {}
+        for d, f, size, checksum, comp in self.files():
+            indexed[(d, f)] = (size, checksum)
+        for key in sorted(indexed.keys()):
+            if key not in found:
+                problems.append(key + ("missing",))
+            elif found[key] != indexed[key][0]:
+                problems.append(key + ("size",))
+            elif checksums and self.fileHash(key[0], key[1]) != \
+                    indexed[key][1]:
+                problems.append(key + ("checksum",))
+        for key in sorted(found.keys()):
+            if key not in indexed:
+                problems.append(key + ("unindexed",))
+        return problems
@@ -0,0 +1,233 @@
+# -*- coding: us-ascii -*-
+"""Registry of boundary condition templates for wind cases."""
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+# physical type of the north, east, south and west patches per sector
+SECTOR_PATCH_TYPES = {
+    'N': {'north': 'inlet', 'east': 'side',
+          'south': 'outlet', 'west': 'side'},
+    'NE': {'north': 'inlet', 'east': 'inlet',
+           'south': 'outlet', 'west': 'outlet'},
+    'E': {'north': 'side', 'east': 'inlet',
+          'south': 'side', 'west': 'outlet'},
+    'SE': {'north': 'outlet', 'east': 'inlet',
+           'south': 'inlet', 'west': 'outlet'},
+    'S': {'north': 'outlet', 'east': 'side',
+          'south': 'inlet', 'west': 'side'},
+    'SW': {'north': 'outlet', 'east': 'outlet',
+           'south': 'inlet', 'west': 'inlet'},
+    'W': {'north': 'side', 'east': 'outlet',
+          'south': 'side', 'west': 'inlet'},
+    'NW': {'north': 'inlet', 'east': 'outlet',
+           'south': 'outlet', 'west': 'inlet'},
+}
+
+DEFAULT_BC = "   type zeroGradient;"
+
+# boundary condition per field and physical type of patch
+BC_TEMPLATES = {
+    "U": {
+        "wall": """\
+                type            uniformFixedValue;
+                uniformValue    (0 0 0);
+                value           uniform (0 0 0);""",
+
+        "inlet": """
+                type            atmBoundaryLayerInletVelocity;
+                #include        "include/ABLConditions\"""",
+
+        "outlet": """\
+                type            inletOutlet;
+                inletValue      uniform (0 0 0);
+                value           $internalField;""",
+
+        "side": "   type zeroGradient;"
+    },
+    "p": {
+        "wall": "type zeroGradient;",
+
+        "inlet": "type zeroGradient;",
+
+        "outlet": """\
+                type            uniformFixedValue;
+                uniformValue    constant $pressure;""",
+
+        "side": "   type zeroGradient;"
+    },
+    "epsilon": {
+        "wall": """\
+                type            epsilonWallFunction;
+                Cmu             0.09;
+                kappa           0.4;
+                E               9.8;
+                value           $internalField;""",
+
+        "inlet": """\
+                type            atmBoundaryLayerInletEpsilon;
+                #include        "include/ABLConditions\"""",
+
+        "outlet": """\
+                type            inletOutlet;
+                inletValue      uniform $turbulentEpsilon;
+                value           $internalField;""",
+
+        "side": "   type zeroGradient;"
+    },
+    "k": {
+        "wall": """\
+                type            kqRWallFunction;
+                value           uniform 0.0;""",
+
+        "inlet": """\
+                type            atmBoundaryLayerInletK;
+                #include        "include/ABLConditions\"""",
+
+        "outlet": """\
+                type            inletOutlet;
+                inletValue      uniform $turbulentKE;
+                value           $internalField;""",
+
+        "side": "   type zeroGradient;"
+    },
+    "nut": {
+        "wall": """\
+                type            nutkAtmRoughWallFunction;
+                z0              uniform 0.001;
+                value           uniform 0.0;""",
+
+        "inlet": """\
+                type            calculated;
+                value           uniform 0;""",
+
+        "outlet": """\
+                type            calculated;
+                value           uniform 0;""",
+
+        "side": "   type zeroGradient;"
+    },
+    # concentration fields, registered for all spec_* fields
+    "scalar": {
+        "wall": DEFAULT_BC,
+        "inlet": DEFAULT_BC,
+        "outlet": DEFAULT_BC,
+        "side": DEFAULT_BC
+    },
+    # "nuTilda": {
+    #     "wall": "type calculated;",
+    #     "inlet": "type calculated;",
+    #     "outlet": "type calculated;",
+    #     "side": "type calculated;",
+    # },
+    # "R": {
+    #     "wall": """\
+    #     type            kqRWallFunction;
+    #     value           uniform 0.0;""",
+    #     "inlet": "type calculated;",
+    #     "outlet": "type calculated;",
+    #     "side": "type calculated;"
+    # },
+}
+
+# fields with names starting with a prefix use the templates of a field
+FIELD_PREFIXES = {"spec_": "scalar"}
+
+_patchSets = {}
+_lock = threading.Lock()
+
+
+def registerField(fieldName, templates):
+    """Add or replace the templates of a field
+    @param templates: dict with boundary condition per physical type"""
+    with _lock:
+        BC_TEMPLATES[fieldName] = templates
+        _patchSets.clear()
+
+
+def registerPrefix(prefix, fieldName):
+    """Use the templates of fieldName for fields starting with prefix"""
+    with _lock:
+        FIELD_PREFIXES[prefix] = fieldName
+        _patchSets.clear()
+
+
+def templateName(fieldName):
+    """Name of the templates used for a field"""
+    if fieldName.endswith(".gz"):
+        fieldName = fieldName[:-3]
+    for prefix, name in FIELD_PREFIXES.items():
+        if fieldName.startswith(prefix):
+            return name
+    return fieldName
+
+
+def sectorSymbol(wdir):
+    """Sector (N, NE, E, ...) of a wind direction
+    @return: the sector, None if the direction is outside 0-360"""
+    if wdir == 0 or wdir == 360:
+        return 'N'
+    elif 0 < wdir < 90:
+        return 'NE'
+    elif wdir == 90:
+        return 'E'
+    elif 90 < wdir < 180:
+        return 'SE'
+    elif wdir == 180:
+        return 'S'
+    elif 180 < wdir < 270:
+        return 'SW'
+    elif wdir == 270:
+        return 'W'
+    elif 270 < wdir < 360:
+        return 'NW'
+    return None
+
+
+def bcTemplate(fieldName, physType):
+    """Boundary condition of a field for a patch of a physical type
+    @return: the boundary condition, None if not implemented for physType"""
+    if physType == "symmetryPlane":
+        return "symmetryPlane"
+    name = templateName(fieldName)
+    if name not in BC_TEMPLATES:
+        log.warning(
+            "Did not find bc rules for field: " + name +
+            ", using default zeroGradient"
+        )
+        return DEFAULT_BC
+    return BC_TEMPLATES[name].get(physType)
+
+
+def patchSet(patchTypes, fieldName):
+    """Boundary conditions of patches of a field, memoized
+    @param patchTypes: dict with physical type per patch
+    @return: dict with boundary condition per patch"""
+    name = templateName(fieldName)
+    key = (tuple(sorted(patchTypes.items())), name)
+    with _lock:
+        bcTypes = _patchSets.get(key)
+    if bcTypes is None:
+        bcTypes = {}
+        for patch, physType in patchTypes.items():
+            # a missing field is warned for only once
+            if name not in BC_TEMPLATES and len(bcTypes) > 0 and \
+                    physType != "symmetryPlane":
+                bcTypes[patch] = DEFAULT_BC
+                continue
+            bcTypes[patch] = bcTemplate(fieldName, physType)
+            if bcTypes[patch] is None:
+                raise KeyError(
+                    "Handling of boundary condition: " +
+                    physType + " not implemented"
+                )
+        with _lock:
+            _patchSets[key] = bcTypes
+    return bcTypes
+
+
+def sectorPatchSet(sector, fieldName):
+    """Boundary conditions of the north, east, south and west patches of
+    a field for a wind sector, memoized"""
+    return patchSet(SECTOR_PATCH_TYPES[sector], fieldName)
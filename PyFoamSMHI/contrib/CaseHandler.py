@@ -1,11 +1,39 @@
 import sys
-import re
 import os
+import glob
 import logging
-from os import path, popen4
+import shutil
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from os import path
 from PyFoam.RunDictionary.ParsedParameterFile import ParsedParameterFile
-from PyFoam.RunDictionary.ParameterFile import ParameterFile
 from PyFoam.RunDictionary.SolutionDirectory import SolutionDirectory
+from PyFoamSMHI.contrib.FieldFile import FieldFile
+from PyFoamSMHI.contrib.Snapshot import Snapshot, linkTree
+from PyFoamSMHI.contrib.DirCache import DirCache
+from PyFoamSMHI.contrib import (
+    BcTemplates, MeshBoundary, DirRemover, Execution
+)
+
+
+def timeDirs(dirPath, cache=None):
+    """Time directories in a directory, sorted by time
+    @param cache: optional DirCache to keep the list in
+    @return: list of (time, name)"""
+    def compute():
+        times = []
+        for f in os.listdir(dirPath):
+            try:
+                t = float(f)
+            except ValueError:
+                continue
+            if path.isdir(path.join(dirPath, f)):
+                times.append((t, f))
+        return sorted(times)
+
+    if cache is None:
+        return compute()
+    return cache.get([dirPath], "timeDirs", compute)
 
 
 class CaseHandler(SolutionDirectory):
@@ -13,48 +41,145 @@ class CaseHandler(SolutionDirectory):
     def __init__(self, dirPath):
         self.logger = logging.getLogger('BcModifier')
         self.machinesFile = None
+        # listings of the case, used by reread, getFields and clearResults
+        self.dirCache = DirCache()
         SolutionDirectory.__init__(self, dirPath)
 
+    def reread(self, force=False):
+        """Rescan the case, only if the case directory or the first
+        processor directory has been modified since the last scan"""
+        if force:
+            self.invalidate(self.name)
+        dirs = [self.name, path.join(self.name, "processor0")]
+        self.dirCache.get(
+            dirs, "reread", lambda: SolutionDirectory.reread(self, True)
+        )
+
+    def invalidate(self, dirPath=None):
+        """Drop cached listings of the case, e.g. after running a solver
+        that writes to existing directories
+        @param dirPath: optional, only listings of this directory or below"""
+        self.dirCache.invalidate(dirPath)
+
     def clearResults(self, after=None, before=None):
         """remove all time-directories after/before a certain time. If no time is
-        set all times except the initial time are removed"""
-        self.reread()
+        set all times except the initial time are removed
+        The directories are moved out of the case at once and removed in
+        background threads, see DirRemover"""
+        times = timeDirs(self.name, self.dirCache)
+        if len(times) == 0:
+            return
 
         if before is None:
-            mintime = float(self.first)
+            mintime = times[0][0]
         else:
             mintime = float(before)
 
         if after is None:
-            maxtime = float(self.first)
+            maxtime = times[0][0]
         else:
             maxtime = float(after)
 
-        for f in self.times:
-            if float(f) < mintime or float(f) > maxtime:
-                self.execute("rm -r " + path.join(self.name, f))
+        DirRemover.removeStale(self.name)
+        for t, f in times:
+            if t < mintime or t > maxtime:
+                DirRemover.remove(path.join(self.name, f))
 
         self.reread()
 
+    def isDecomposed(self, nprocs=None):
+        """Test if the case has a decomposed mesh
+        @param nprocs: optional, number of processor directories required"""
+        procDirs = [
+            d for d in glob.glob(path.join(self.name, "processor*"))
+            if path.exists(path.join(d, "constant", "polyMesh"))
+        ]
+        if len(procDirs) == 0:
+            return False
+        if nprocs is not None and len(procDirs) != int(nprocs):
+            return False
+        return True
+
+    def clearProcessorResults(self):
+        """remove all time-directories except the initial time from the
+        processor directories, keeping the decomposed mesh"""
+        initialTime = path.basename(self.initialDir())
+        for procDir in glob.glob(path.join(self.name, "processor*")):
+            DirRemover.removeStale(procDir)
+            for t, f in timeDirs(procDir):
+                if f != initialTime:
+                    DirRemover.remove(path.join(procDir, f))
+
+    def stageResults(self, stagingPath, keepDecomposition=False,
+                     extraDirs=[]):
+        """Move the latest results out of the case into a staging case,
+        so that the case can be used for the next run while the staged
+        results are reconstructed and archived.
+        The staging case refers to system and constant of the case by
+        symbolic links.
+        @param stagingPath: path of the staging case to create
+        @param keepDecomposition: if True, only the latest time is moved
+        from the processor directories, otherwise the whole processor
+        directories are moved
+        @param extraDirs: names of other directories to move, e.g. probes"""
+        if path.exists(stagingPath):
+            shutil.rmtree(stagingPath)
+        os.makedirs(stagingPath)
+        for d in [self.systemDir(), self.constantDir()]:
+            os.symlink(d, path.join(stagingPath, path.basename(d)))
+
+        initialTime = path.basename(self.initialDir())
+        procDirs = glob.glob(path.join(self.name, "processor*"))
+        if len(procDirs) == 0:
+            self.reread()
+            latest = self.getLast()
+            if latest != initialTime:
+                os.rename(
+                    path.join(self.name, latest),
+                    path.join(stagingPath, latest)
+                )
+        for procDir in procDirs:
+            stagedProcDir = path.join(stagingPath, path.basename(procDir))
+            if not keepDecomposition:
+                os.rename(procDir, stagedProcDir)
+                continue
+            os.mkdir(stagedProcDir)
+            os.symlink(
+                path.join(procDir, "constant"),
+                path.join(stagedProcDir, "constant")
+            )
+            latest = timeDirs(procDir)[-1][1]
+            if latest != initialTime:
+                os.rename(
+                    path.join(procDir, latest),
+                    path.join(stagedProcDir, latest)
+                )
+
+        for d in extraDirs:
+            if path.exists(path.join(self.name, d)):
+                os.rename(
+                    path.join(self.name, d), path.join(stagingPath, d)
+                )
+        self.reread()
+
     def execute(self, cmd):
-        """Execute the command cmd
-        Currently no error-handling is done
+        """Execute the command cmd, recording its metrics, see Execution
         @return: A list with all the output-lines of the execution"""
-        rein, raus = popen4(cmd)
-        tmp = raus.readlines()
-        return tmp
+        return Execution.run(cmd)
+
+    def removeProcessorDirs(self):
+        """remove the processor directories, i.e. the decomposed mesh and
+        results, in the background"""
+        for procDir in glob.glob(path.join(self.name, "processor*")):
+            DirRemover.remove(procDir)
 
     def backUpInitialFields(self):
+        """Update the snapshot of the initial fields, see Snapshot"""
         bgPath = path.join(self.name, "backUpInitialFields")
-        if not path.exists(bgPath):
-            os.mkdir(bgPath)
-        self.execute(
-            "cp " +
-            path.join(self.initialDir(), "*[^.ba]") +
-            " " + bgPath + "/"
-        )
+        Snapshot(bgPath).take(self.initialDir())
 
     def restoreInitialFields(self):
+        """Restore the initial fields that have changed since the backup"""
         bgPath = path.join(self.name, "backUpInitialFields")
         if not os.path.exists(bgPath):
             print(
@@ -64,20 +189,53 @@ class CaseHandler(SolutionDirectory):
             sys.exit(1)
         else:
             try:
-                # self.execute("rm -r "+self.initialDir())
-                if not os.path.exists(self.initialDir()):
-                    self.execute("mkdir "+self.initialDir())
-                self.execute(
-                    "cp " + path.join(bgPath, "*") +
-                    " " + self.initialDir() + "/"
+                restored = Snapshot(bgPath).restore(self.initialDir())
+                self.logger.debug(
+                    "Restored initial fields: " + " ".join(restored)
                 )
-
-                # self.execute("cp "+path.join(bgPath,"boundary")+" "+path.join(case.constantDir(),"polyMesh","boundary"))
-            except:
+            except (IOError, OSError) as e:
                 print(
-                    "Warning: could not restore initial fields, skipping"
+                    "Warning: could not restore initial fields, skipping: " +
+                    str(e)
                 )
 
+    def createWorkingCopy(self, copyPath):
+        """Creates a copy of the case that can be run independently
+        Only the system, constant, initial time and
+        initial field backup directories are copied. The mesh is
+        not modified during a sweep and is hard linked instead.
+        @param copyPath: path of the case directory to create"""
+        if path.exists(copyPath):
+            self.logger.error(
+                "Cannot create working copy, " +
+                copyPath + " already exists"
+            )
+            sys.exit(1)
+        os.mkdir(copyPath)
+        dirs = [self.systemDir(), self.constantDir(), self.initialDir()]
+        for d in dirs:
+            if d == self.constantDir():
+                ignore = shutil.ignore_patterns("polyMesh")
+            else:
+                ignore = None
+            shutil.copytree(
+                d, path.join(copyPath, path.basename(d)), symlinks=True,
+                ignore=ignore
+            )
+        meshDir = path.join(self.constantDir(), "polyMesh")
+        if path.isdir(meshDir):
+            linkTree(
+                meshDir,
+                path.join(copyPath, path.basename(self.constantDir()),
+                          "polyMesh")
+            )
+        bgPath = path.join(self.name, "backUpInitialFields")
+        if path.exists(bgPath):
+            # snapshot files are never modified in place
+            Snapshot(bgPath).link(
+                path.join(copyPath, path.basename(bgPath))
+            )
+
     def createMachinesFile(self, serversCPUsDict):
         machinesPath = path.join(self.name, "machines")
         try:
@@ -93,8 +251,9 @@ class CaseHandler(SolutionDirectory):
         self.machinesFile = machinesPath
 
     def getFields(self, time):
+        """Names of the fields in a time directory, cached until the
+        directory is modified"""
         timePath = path.join(self.name, str(time))
-        fields = os.listdir(timePath)
 
         def isGood(f):
             if ".bak" in f:
@@ -105,235 +264,105 @@ class CaseHandler(SolutionDirectory):
                 return False
             return True
 
-        fields = [
-            f for f in fields if isGood(f) and
-            path.isfile(path.join(timePath, f))
-        ]
-        return fields
-
-    def modWindDir(self, time, newDir):
-
-        boundaryPhysTypes = {
-            'dirNBnorth': 'inlet', 'dirNBeast': 'side',
-            'dirNBsouth': 'outlet', 'dirNBwest': 'side',
-            'dirNEBnorth': 'inlet', 'dirNEBeast': 'inlet',
-            'dirNEBsouth': 'outlet', 'dirNEBwest': 'outlet',
-            'dirEBnorth': 'side', 'dirEBeast': 'inlet',
-            'dirEBsouth': 'side', 'dirEBwest': 'outlet',
-            'dirSEBnorth': 'outlet', 'dirSEBeast': 'inlet',
-            'dirSEBsouth': 'inlet', 'dirSEBwest': 'outlet',
-            'dirSBnorth': 'outlet', 'dirSBeast': 'side',
-            'dirSBsouth': 'inlet', 'dirSBwest': 'side',
-            'dirSWBnorth': 'outlet', 'dirSWBeast': 'outlet',
-            'dirSWBsouth': 'inlet', 'dirSWBwest': 'inlet',
-            'dirWBnorth': 'side', 'dirWBeast': 'outlet',
-            'dirWBsouth': 'side', 'dirWBwest': 'inlet',
-            'dirNWBnorth': 'inlet', 'dirNWBeast': 'outlet',
-            'dirNWBsouth': 'outlet', 'dirNWBwest': 'inlet',
-        }
-
-        dirSymbol = "-"
-        if newDir == 0 or newDir == 360:
-            dirSymbol = 'N'
-        elif newDir > 0 and newDir < 90:
-            dirSymbol = 'NE'
-        elif newDir == 90:
-            dirSymbol = 'E'
-        elif newDir > 90 and newDir < 180:
-            dirSymbol = 'SE'
-        elif newDir == 180:
-            dirSymbol = 'S'
-        elif newDir > 180 and newDir < 270:
-            dirSymbol = 'SW'
-        elif newDir == 270:
-            dirSymbol = 'W'
-        elif newDir > 270 and newDir < 360:
-            dirSymbol = 'NW'
-
-        if dirSymbol == '-':
-            print("Error: Given new directory is out of range 0-360 degrees")
-            sys.exit(1)
+        def compute():
+            return [
+                f for f in os.listdir(timePath) if isGood(f) and
+                path.isfile(path.join(timePath, f))
+            ]
+
+        return list(self.dirCache.get([timePath], "fields", compute))
+
+    def modWindDir(self, time, newDir, nthreads=None):
+        """Set the boundary conditions of the lateral patches of all fields
+        to inlet, outlet or side for a wind direction
+        The role of each patch is taken from its face normals and the flow
+        vector. If the mesh cannot be read, the north, east, south and west
+        patches are set from the sector of the direction.
+        @param time: time directory with the fields to modify
+        @param newDir: wind direction in degrees
+        @param nthreads: optional, number of fields modified in parallel,
+        default is the number of CPUs"""
+        meshDir = path.join(self.constantDir(), "polyMesh")
+        try:
+            patchTypes = MeshBoundary.patchRoles(meshDir, newDir)
+        except (IOError, OSError, ValueError) as e:
+            sector = BcTemplates.sectorSymbol(newDir % 360)
+            self.logger.warning(
+                "Could not classify patches from mesh (%s), " % str(e) +
+                "using sector " + sector
+            )
+            patchTypes = BcTemplates.SECTOR_PATCH_TYPES[sector]
 
-        fields = self.getFields(time)
-        for field in fields:
+        fieldBcTypes = {}
+        for field in self.getFields(time):
             fieldPath = path.join(self.name, str(time), field)
-            for boundary in ['north', 'east', 'south', 'west']:
-                key = 'dir' + dirSymbol + 'B' + boundary
-                boundaryPhysType = boundaryPhysTypes[key]
-                if ".gz" in field:
-                    fieldDef = self.physTypeToFieldType(
-                        boundaryPhysType, field[: -3]
-                    )
-                else:
-                    fieldDef = self.physTypeToFieldType(
-                        boundaryPhysType, field
-                    )
-                self.modFieldBcType(fieldPath, boundary, fieldDef)
+            try:
+                fieldBcTypes[fieldPath] = BcTemplates.patchSet(
+                    patchTypes, field
+                )
+            except KeyError as e:
+                self.logger.error(e.args[0])
+                sys.exit(1)
+        self.modFieldsBcTypes(fieldBcTypes, nthreads=nthreads)
 
     def physTypeToFieldType(self, physType, fieldName):
-        if physType == "symmetryPlane":
-            return "symmetryPlane"
-        if "spec_" in fieldName:
-            fieldName = "scalar"
-
-        fields = {
-            "U": {
-                "wall": """\
-                type            uniformFixedValue;
-                uniformValue    (0 0 0);
-                value           uniform (0 0 0);""",
-
-                "inlet": """
-                type            atmBoundaryLayerInletVelocity;
-                #include        "include/ABLConditions\"""",
-
-                "outlet": """\
-                type            inletOutlet;
-                inletValue      uniform (0 0 0);
-                value           $internalField;""",
-
-                "side": "   type zeroGradient;"
-            },
-            "p": {
-                "wall": "type zeroGradient;",
-
-                "inlet": "type zeroGradient;",
-
-                "outlet": """\
-                type            uniformFixedValue;
-                uniformValue    constant $pressure;""",
-
-                "side": "   type zeroGradient;"
-            },
-            "epsilon": {
-                "wall": """\
-                type            epsilonWallFunction;
-                Cmu             0.09;
-                kappa           0.4;
-                E               9.8;
-                value           $internalField;""",
-
-                "inlet": """\
-                type            atmBoundaryLayerInletEpsilon;
-                #include        "include/ABLConditions\"""",
-
-                "outlet": """\
-                type            inletOutlet;
-                inletValue      uniform $turbulentEpsilon;
-                value           $internalField;""",
-
-                "side": "   type zeroGradient;"
-            },
-            "k": {
-                "wall": """\
-                type            kqRWallFunction;
-                value           uniform 0.0;""",
-
-                "inlet": """\
-                type            atmBoundaryLayerInletK;
-                #include        "include/ABLConditions\"""",
-
-                "outlet": """\
-                type            inletOutlet;
-                inletValue      uniform $turbulentKE;
-                value           $internalField;""",
-
-                "side": "   type zeroGradient;"
-            },
-            "nut": {
-                "wall": """\
-                type            nutkAtmRoughWallFunction;
-                z0              uniform 0.001;
-                value           uniform 0.0;""",
-
-                "inlet": """\
-                type            calculated;
-                value           uniform 0;""",
-
-                "outlet": """\
-                type            calculated;
-                value           uniform 0;""",
-
-                "side": "   type zeroGradient;"
-            },
-        }
-        # "scalar": {
-        #     "wall": "zeroGradient",
-        #     "inlet": "typeuniformFixedValue",
-        #     "outlet": "inletOutlet",
-        #     "side": "type zeroGradient;"
-        # }
-
-        # "nuTilda": {
-        #     "wall": "type calculated;",
-        #     "inlet": "type calculated;",
-        #     "outlet": "type calculated;",
-        #     "side": "type calculated;",
-        # },
-        # "R": {
-        #     "wall": """\
-        #     type            kqRWallFunction;
-        #     value           uniform 0.0;""",
-        #     "inlet": "type calculated;",
-        #     "outlet": "type calculated;",
-        #     "side": "type calculated;"
-        # },
-
-        if fieldName not in fields.keys():
-            self.logger.warning(
-                "Did not find bc rules for field: " + fieldName +
-                ", using default zeroGradient"
-            )
-            return "   type zeroGradient;"
-
-        if physType not in fields[fieldName].keys():
+        bcType = BcTemplates.bcTemplate(fieldName, physType)
+        if bcType is None:
             self.logger.error(
                 "Handling of boundary condition: " +
                 physType + " not implemented")
             sys.exit(1)
-
-        return fields[fieldName][physType]
+        return bcType
 
     def readFieldBcType(self, fieldPath, patch):
-        file = ParameterFile(fieldPath)
-        file.readFile()
-        exp = re.compile(
-            "(" + patch + r"\s*?\n\s*?\{.*?type)(\s*?)(.*?)(;.*?\})",
-            re.DOTALL
-        )
-
-        bcMatch = exp.search(file.content)
-
-        if bcMatch is None:
-            self.logger.debug(
-                "Could not find patch: " + patch + " in file: " + file.name
-            )
-        try:
-            patchType = bcMatch.group(3)
-        except:
+        patchType = FieldFile(fieldPath).readBcType(patch)
+        if patchType is None:
             self.logger.error(
                 "Could not get patch type from file: " +
-                file.name + " check the file!"
+                fieldPath + " check the file!"
             )
             sys.exit(1)
-        return patchType.strip()
+        return patchType
 
     def modFieldBcType(self, fieldPath, patch, newBcType):
-        file = ParameterFile(fieldPath)
-        file.readFile()
-        exp = re.compile(patch + r".*?\{(.*?)\}", re.DOTALL)
-        file.readFile()
-        [newStr, num] = exp.subn(
-            "%s\n  {\n%s\n  }\n" % (patch, newBcType),
-            file.content
-        )
-
-        if num == 0:
-            self.logger.error(
-                "Patch: " + patch + "not found in " +
-                file.name + " could not modify bc"
+        self.modFieldsBcTypes({fieldPath: {patch: newBcType}}, nthreads=1)
+
+    def modFieldBcTypes(self, fieldPath, bcTypes):
+        """Modify the boundary conditions of several patches of a field,
+        rewriting only the boundaryField of the file
+        @param bcTypes: dict with the new boundary condition per patch
+        @return: list of patches not found in the field"""
+        return FieldFile(fieldPath).setBcTypes(bcTypes)
+
+    def modFieldsBcTypes(self, fieldBcTypes, nthreads=None):
+        """Modify the boundary conditions of several fields in parallel
+        @param fieldBcTypes: dict with field path as key and a dict with
+        the new boundary condition per patch as value
+        @param nthreads: optional, number of threads, default is the
+        number of CPUs"""
+        if nthreads is None:
+            nthreads = multiprocessing.cpu_count()
+        nthreads = max(1, min(int(nthreads), len(fieldBcTypes)))
+
+        def modify(fieldPath):
+            return fieldPath, self.modFieldBcTypes(
+                fieldPath, fieldBcTypes[fieldPath]
             )
-            sys.exit(1)
+
+        if nthreads == 1:
+            results = [modify(fieldPath) for fieldPath in fieldBcTypes]
         else:
-            file.content = newStr
-            file.writeFile()
+            pool = ThreadPool(nthreads)
+            try:
+                results = pool.map(modify, fieldBcTypes.keys())
+            finally:
+                pool.close()
+                pool.join()
+
+        for fieldPath, missing in results:
+            if len(missing) > 0:
+                self.logger.error(
+                    "Patch: " + ", ".join(missing) + " not found in " +
+                    fieldPath + " could not modify bc"
+                )
+                sys.exit(1)
@@ -0,0 +1,345 @@
+# -*- coding: us-ascii -*-
+"""Single-file containers of the archived files of a case.
+
+A pack is a file of appended entries, e.g. the fields of a case, followed
+by an index and a trailer. The index is json with the offset, length and
+content hash of each entry, and the trailer holds the magic string and
+the offset and length of the index. Entries are added by appending the
+data, a new index and a new trailer, so that the pack is never modified
+in place. Replaced and removed entries and old indices are left in the
+file until it is repacked. If appending is interrupted, the last complete
+trailer is found by searching back from the end of the file."""
+import os
+import json
+import struct
+import hashlib
+import logging
+import threading
+from os import path
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from PyFoamSMHI.contrib.FieldFile import copyBytes
+
+log = logging.getLogger(__name__)
+
+MAGIC = b"FOAMPAK1"
+TRAILER = struct.Struct("<8sQQ")
+SUFFIX = ".pack"
+CHUNK_SIZE = 1024 * 1024
+
+# packs are appended to by one thread at a time, and one process at a
+# time if fcntl is available
+_locks = {}
+_locksLock = threading.Lock()
+
+
+def packLock(packPath):
+    key = path.realpath(packPath)
+    with _locksLock:
+        if key not in _locks:
+            _locks[key] = threading.Lock()
+        return _locks[key]
+
+
+class Section:
+    """Read-only file object of an entry of a pack"""
+
+    def __init__(self, fid, offset, length):
+        self.fid = fid
+        self.offset = offset
+        self.length = length
+        self.pos = 0
+        self.name = fid.name
+
+    def read(self, size=-1):
+        left = self.length - self.pos
+        if size is None or size < 0 or size > left:
+            size = left
+        self.fid.seek(self.offset + self.pos)
+        data = self.fid.read(size)
+        self.pos += len(data)
+        return data
+
+    def readline(self, size=-1):
+        self.fid.seek(self.offset + self.pos)
+        left = self.length - self.pos
+        if size is None or size < 0 or size > left:
+            size = left
+        data = self.fid.readline(size)
+        self.pos += len(data)
+        return data
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                break
+            yield line
+
+    def seek(self, pos, whence=0):
+        if whence == 1:
+            pos += self.pos
+        elif whence == 2:
+            pos += self.length
+        self.pos = max(0, min(pos, self.length))
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        self.fid.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+        return False
+
+
+class CasePack:
+    """A pack file, see the module documentation"""
+
+    def __init__(self, packPath):
+        self.path = packPath
+        self.cachedState = None
+        self.cachedEntries = None
+        self.indexSize = 0
+
+    def exists(self):
+        return path.exists(self.path)
+
+    def findTrailer(self, fid, size):
+        """Offset and length of the index of the last complete trailer"""
+        end = size
+        while end >= TRAILER.size:
+            start = max(0, end - CHUNK_SIZE)
+            fid.seek(start)
+            data = fid.read(end - start)
+            pos = data.rfind(MAGIC)
+            while pos != -1:
+                trailerPos = start + pos
+                if trailerPos + TRAILER.size <= size:
+                    fid.seek(trailerPos)
+                    magic, offset, length = TRAILER.unpack(
+                        fid.read(TRAILER.size)
+                    )
+                    if offset + length == trailerPos:
+                        return offset, length
+                pos = data.rfind(MAGIC, 0, pos)
+            if start == 0:
+                break
+            # a magic string may span two chunks
+            end = start + len(MAGIC) - 1
+        return None
+
+    def entries(self):
+        """Entries of the pack
+        @return: dict with (offset, length, checksum) per name"""
+        if not self.exists():
+            return {}
+        st = os.stat(self.path)
+        state = (st.st_size, st.st_mtime, st.st_ino)
+        if state == self.cachedState:
+            return self.cachedEntries
+        fid = open(self.path, "rb")
+        try:
+            found = self.findTrailer(fid, st.st_size)
+            if found is None:
+                raise ValueError("No index found in pack: " + self.path)
+            offset, length = found
+            if offset + length + TRAILER.size != st.st_size:
+                log.warning(
+                    "Incomplete data at end of pack %s, ignored" % self.path
+                )
+            fid.seek(offset)
+            entries = dict(
+                (name, tuple(entry)) for name, entry in
+                json.loads(fid.read(length).decode("latin-1")).items()
+            )
+        finally:
+            fid.close()
+        self.cachedState = state
+        self.cachedEntries = entries
+        self.indexSize = length + TRAILER.size
+        return entries
+
+    def names(self):
+        return sorted(self.entries().keys())
+
+    def has(self, name):
+        return name in self.entries()
+
+    def entry(self, name):
+        """@return: (offset, length, checksum) of an entry"""
+        entries = self.entries()
+        if name not in entries:
+            raise KeyError("No %s in pack %s" % (name, self.path))
+        return entries[name]
+
+    def lock(self, fid):
+        if fcntl is not None:
+            fcntl.flock(fid.fileno(), fcntl.LOCK_EX)
+
+    def openLocked(self, mode="ab"):
+        """Open the pack, locked for other processes, by default for
+        appending"""
+        while True:
+            fid = open(self.path, mode)
+            self.lock(fid)
+            # the pack may have been replaced by repack meanwhile
+            if os.fstat(fid.fileno()).st_ino == os.stat(self.path).st_ino:
+                return fid
+            fid.close()
+
+    def append(self, files, removed=()):
+        """Append files to the pack and write a new index
+        @param files: list of (name, filePath, checksum), where checksum
+        is computed while copying if None
+        @param removed: names of entries to remove from the index
+        @return: dict with the checksum per name"""
+        checksums = {}
+        with packLock(self.path):
+            fid = self.openLocked()
+            try:
+                fid.seek(0, os.SEEK_END)
+                start = fid.tell()
+                self.cachedState = None
+                entries = dict(self.entries()) if start > 0 else {}
+                try:
+                    offset = start
+                    for name, filePath, checksum in files:
+                        length, digest = self.copyIn(fid, filePath)
+                        checksums[name] = checksum or digest
+                        entries[name] = (offset, length, checksums[name])
+                        offset += length
+                    for name in removed:
+                        entries.pop(name, None)
+                    index = json.dumps(entries, sort_keys=True) \
+                        .encode("latin-1")
+                    fid.write(index)
+                    fid.write(TRAILER.pack(MAGIC, offset, len(index)))
+                    fid.flush()
+                except:
+                    # the pack is left as before
+                    fid.truncate(start)
+                    raise
+            finally:
+                fid.close()
+        return checksums
+
+    def copyIn(self, fid, filePath):
+        """Append a file, computing its content hash
+        @return: length and content hash"""
+        digest = hashlib.sha1()
+        length = 0
+        src = open(filePath, "rb")
+        try:
+            while True:
+                data = src.read(CHUNK_SIZE)
+                if not data:
+                    break
+                digest.update(data)
+                fid.write(data)
+                length += len(data)
+        finally:
+            src.close()
+        return length, digest.hexdigest()
+
+    def add(self, name, filePath, checksum=None):
+        """Add or replace an entry with the content of a file
+        @return: the content hash of the entry"""
+        return self.append([(name, filePath, checksum)])[name]
+
+    def remove(self, names):
+        """Remove entries from the index, the data is left until repack"""
+        names = [n for n in names if self.has(n)]
+        if len(names) > 0:
+            self.append([], removed=names)
+
+    def open(self, name):
+        """Open an entry for reading, without extracting it
+        @return: a read-only binary file object"""
+        offset, length, checksum = self.entry(name)
+        return Section(open(self.path, "rb"), offset, length)
+
+    def extract(self, name, dst):
+        """Write the content of an entry to a file"""
+        offset, length, checksum = self.entry(name)
+        src = open(self.path, "rb")
+        try:
+            src.seek(offset)
+            out = open(dst, "wb")
+            try:
+                if copyBytes(src, out, length) != length:
+                    raise IOError("Could not extract %s from %s" % (
+                        name, self.path))
+            finally:
+                out.close()
+        finally:
+            src.close()
+
+    def hash(self, name):
+        """Content hash of the data of an entry, as stored in the index"""
+        digest = hashlib.sha1()
+        section = self.open(name)
+        try:
+            while True:
+                data = section.read(CHUNK_SIZE)
+                if not data:
+                    break
+                digest.update(data)
+        finally:
+            section.close()
+        return digest.hexdigest()
+
+    def garbage(self):
+        """Bytes of replaced and removed entries and old indices"""
+        if not self.exists():
+            return 0
+        live = sum(e[1] for e in self.entries().values()) + self.indexSize
+        return os.path.getsize(self.path) - live
+
+    def repack(self):
+        """Rewrite the pack with only the current entries
+        @return: number of bytes freed"""
+        with packLock(self.path):
+            src = self.openLocked("rb")
+            try:
+                before = os.fstat(src.fileno()).st_size
+                self.cachedState = None
+                entries = self.entries()
+                tmpPath = path.join(
+                    path.dirname(self.path),
+                    "." + path.basename(self.path) + ".tmp"
+                )
+                newEntries = {}
+                out = open(tmpPath, "wb")
+                try:
+                    offset = 0
+                    for name in sorted(entries.keys()):
+                        start, length, checksum = entries[name]
+                        src.seek(start)
+                        if copyBytes(src, out, length) != length:
+                            raise IOError("Could not copy %s from %s" % (
+                                name, self.path))
+                        newEntries[name] = (offset, length, checksum)
+                        offset += length
+                    index = json.dumps(newEntries, sort_keys=True) \
+                        .encode("latin-1")
+                    out.write(index)
+                    out.write(TRAILER.pack(MAGIC, offset, len(index)))
+                finally:
+                    out.close()
+                os.rename(tmpPath, self.path)
+            finally:
+                src.close()
+        self.cachedState = None
+        freed = before - os.path.getsize(self.path)
+        log.debug("Repacked %s, %i bytes freed" % (self.path, freed))
+        return freed
@@ -0,0 +1,140 @@
+# -*- coding: us-ascii -*-
+"""Residual based stopping of a running solver."""
+import re
+import math
+import logging
+
+from PyFoam.LogAnalysis.LogLineAnalyzer import LogLineAnalyzer
+from PyFoam.RunDictionary.ParameterFile import ParameterFile
+
+log = logging.getLogger(__name__)
+
+TIME_EXP = re.compile(r"^Time = (\S+)")
+RESIDUAL_EXP = re.compile(
+    r"Solving for (\w+), Initial residual = ([^,]+),"
+)
+
+STOP_CONVERGED = "converged"
+STOP_PLATEAU = "plateau"
+STOP_ITERATIONS = "iterations"
+
+
+def parseCriteria(criteriaList):
+    """Parse residual thresholds given as 'field:threshold'
+    @param criteriaList: list of strings, e.g. ['Ux:1e-4', 'p:1e-3']
+    @return: dict with threshold per field"""
+    criteria = {}
+    for item in criteriaList:
+        try:
+            field, threshold = item.split(":")
+            criteria[field] = float(threshold)
+        except ValueError:
+            log.error(
+                "Bad convergence criterion: '%s', " % item +
+                "should be given as field:threshold"
+            )
+            raise
+    return criteria
+
+
+def slope(values):
+    """Least squares slope of values against their index"""
+    n = len(values)
+    xMean = (n - 1) / 2.0
+    yMean = sum(values) / float(n)
+    num = 0
+    den = 0
+    for i, y in enumerate(values):
+        num += (i - xMean) * (y - yMean)
+        den += (i - xMean) ** 2
+    if den == 0:
+        return 0
+    return num / den
+
+
+class ConvergenceMonitor(LogLineAnalyzer):
+    """Monitors initial residuals in the solver log and makes the solver
+    write and stop when the convergence criteria are met"""
+
+    def __init__(self, controlDictPath, criteria,
+                 plateauWindow=None, plateauSlope=None):
+        """@param controlDictPath: controlDict of the running case
+        @param criteria: dict with initial residual threshold per field
+        @param plateauWindow: optional, number of iterations to fit the
+        slope of the residuals over
+        @param plateauSlope: the solver is stopped when the slope of
+        log10 of the residuals is less than this (decades per iteration)
+        for all fields"""
+        LogLineAnalyzer.__init__(self)
+        self.controlDictPath = controlDictPath
+        self.criteria = criteria
+        self.plateauWindow = plateauWindow
+        self.plateauSlope = plateauSlope
+        self.iterations = 0
+        self.history = {}
+        self.current = {}
+        self.reason = STOP_ITERATIONS
+        self.stopRequested = False
+
+    def doAnalysis(self, line):
+        match = TIME_EXP.match(line)
+        if match is not None:
+            self.timeStepFinished()
+            self.iterations += 1
+            self.current = {}
+            return
+        match = RESIDUAL_EXP.search(line)
+        if match is None:
+            return
+        field = match.group(1)
+        if field not in self.criteria or field in self.current:
+            # only the first solution of each time step is used
+            return
+        try:
+            self.current[field] = float(match.group(2))
+        except ValueError:
+            pass
+
+    def timeStepFinished(self):
+        if self.stopRequested or len(self.current) == 0:
+            return
+        for field, residual in self.current.items():
+            self.history.setdefault(field, []).append(residual)
+
+        if self.converged():
+            self.requestStop(STOP_CONVERGED)
+        elif self.plateaued():
+            self.requestStop(STOP_PLATEAU)
+
+    def converged(self):
+        for field, threshold in self.criteria.items():
+            if field not in self.current or self.current[field] > threshold:
+                return False
+        return True
+
+    def plateaued(self):
+        if self.plateauWindow is None or self.plateauSlope is None:
+            return False
+        for field in self.criteria.keys():
+            values = self.history.get(field, [])
+            if len(values) < self.plateauWindow:
+                return False
+            window = [
+                math.log10(max(v, 1e-300))
+                for v in values[-self.plateauWindow:]
+            ]
+            if abs(slope(window)) > self.plateauSlope:
+                return False
+        return True
+
+    def requestStop(self, reason):
+        """Make the solver write the current time and stop"""
+        log.info(
+            "Convergence criteria met (%s) after %i iterations, " % (
+                reason, self.iterations) +
+            "stopping solver"
+        )
+        self.reason = reason
+        self.stopRequested = True
+        controlDict = ParameterFile(self.controlDictPath)
+        controlDict.replaceParameter("stopAt", "writeNow")
@@ -1,18 +1,36 @@
 import os,sys,glob,math
+import threading
 import pdb
+
+def locked(method):
+    """Run a method holding the lock of the table"""
+    def wrapper(self,*args,**kwargs):
+        with self.lock:
+            return method(self,*args,**kwargs)
+    wrapper.__name__=method.__name__
+    wrapper.__doc__=method.__doc__
+    return wrapper
+
 class ConvergenceTable:
     def __init__(self,caseDir):
         self.probes={}
         self.residuals={}
+        self.stopInfo={}
         self.caseDir=caseDir
+        #Runs of a sweep may be added from several threads
+        self.lock=threading.RLock()
         self.resDir=os.path.join(self.caseDir,"convergence")
         if not os.path.exists(self.resDir):
             os.mkdir(self.resDir)
 
-    def addProbes(self,runId,fieldName,runIndex):
+    def addProbes(self,runId,fieldName,runIndex,caseDir=None):
+        """Add probe values of a run
+        @param caseDir: optional, case directory the run was made in"""
+        if caseDir==None:
+            caseDir=self.caseDir
         runId=str(runIndex)+"_"+runId
         probeDirs=[]
-        probeDir=os.path.join(self.caseDir,"probes")
+        probeDir=os.path.join(caseDir,"probes")
         if os.path.exists(probeDir):
             probeDirs.append(probeDir)
 
@@ -66,18 +84,23 @@ class ConvergenceTable:
                         record.append(data)
                     records[probeCoordinates]=record
 
-        for probe in records.keys():
-            key=fieldName+"_"+probe
-            if key in self.probes:
-                fieldProbeDict=self.probes[key]
-            else:
-                fieldProbeDict={}
-            fieldProbeDict[runId]=records[probe]
-            self.probes[key]=fieldProbeDict
+        with self.lock:
+            for probe in records.keys():
+                key=fieldName+"_"+probe
+                if key in self.probes:
+                    fieldProbeDict=self.probes[key]
+                else:
+                    fieldProbeDict={}
+                fieldProbeDict[runId]=records[probe]
+                self.probes[key]=fieldProbeDict
 
-    def addResidual(self,runId,solverName,fieldName,runIndex):
+    def addResidual(self,runId,solverName,fieldName,runIndex,caseDir=None):
+        """Add residuals of a run
+        @param caseDir: optional, case directory the run was made in"""
+        if caseDir==None:
+            caseDir=self.caseDir
         runId=str(runIndex)+"_"+runId
-        residualFile=os.path.join(self.caseDir,solverName+".analyzed",fieldName)
+        residualFile=os.path.join(caseDir,solverName+".analyzed",fieldName)
         if os.path.exists(residualFile):
             try:
                 pf=open(residualFile,'r')
@@ -93,14 +116,62 @@ class ConvergenceTable:
                 data=float(line[1])
                 record.append(data)
 
-            key=fieldName+"_"+solverName
-            if key in self.residuals:
-                fieldSolverDict=self.residuals[key]
-            else:
-                fieldSolverDict={}
-            fieldSolverDict[runId]=record
-            self.residuals[key]=fieldSolverDict
+            with self.lock:
+                key=fieldName+"_"+solverName
+                if key in self.residuals:
+                    fieldSolverDict=self.residuals[key]
+                else:
+                    fieldSolverDict={}
+                fieldSolverDict[runId]=record
+                self.residuals[key]=fieldSolverDict
+
+    def addStopInfo(self,runId,runIndex,iterations,reason):
+        """Add the number of iterations run and the reason for stopping
+        @param reason: e.g. converged, plateau or iterations"""
+        runId=str(runIndex)+"_"+runId
+        with self.lock:
+            self.stopInfo[runId]=(iterations,reason)
 
+    def readTable(self,fileName):
+        """Read a probe or residual table written by this class
+        @return: dict with list of values per run"""
+        fid=open(fileName,'r')
+        lines=fid.readlines()
+        fid.close()
+        runKeys=lines[0].rstrip("\n").split("\t")[1:]
+        table={}
+        for run in runKeys:
+            table[run]=[]
+        for line in lines[1:]:
+            values=line.rstrip("\n").split("\t")[1:]
+            for run,value in zip(runKeys,values):
+                if value!="":
+                    table[run].append(float(value))
+        return table
+
+    def readTables(self,resDir=None):
+        """Add the tables of a convergence directory, e.g. written by
+        another shard of a sweep, to the tables in memory
+        @param resDir: optional, convergence directory to read"""
+        if resDir==None:
+            resDir=self.resDir
+        with self.lock:
+            for fileName in glob.glob(os.path.join(resDir,"*_probe.asc")):
+                key=os.path.basename(fileName)[:-len("_probe.asc")]
+                self.probes.setdefault(key,{}).update(self.readTable(fileName))
+            for fileName in glob.glob(os.path.join(resDir,"*_residual.asc")):
+                key=os.path.basename(fileName)[:-len("_residual.asc")]
+                self.residuals.setdefault(key,{}).update(
+                    self.readTable(fileName))
+            fileName=os.path.join(resDir,"stopInfo.asc")
+            if os.path.exists(fileName):
+                fid=open(fileName,'r')
+                for line in fid.readlines()[1:]:
+                    run,iterations,reason=line.rstrip("\n").split("\t")
+                    self.stopInfo[run]=(int(iterations),reason)
+                fid.close()
+
+    @locked
     def writeProbes(self):
         for key in self.probes.keys():
             #Creating a list of runs sorted by run index
@@ -148,6 +219,7 @@ class ConvergenceTable:
                     fid.write("\n")
             fid.close()
 
+    @locked
     def writeResiduals(self):
         for key in self.residuals.keys():
             #Creating a list of runs sorted by run index
@@ -194,3 +266,20 @@ class ConvergenceTable:
                 else:
                     fid.write("\n")
             fid.close()
+
+    @locked
+    def writeStopInfo(self):
+        if len(self.stopInfo)==0:
+            return
+        runKeys=sorted(self.stopInfo.keys(),key=lambda runId: int(runId.split("_")[0]))
+        fileName=os.path.join(self.resDir,"stopInfo.asc")
+        try:
+            fid=open(fileName,'w')
+            fid.write("Run\tIterations\tReason\n")
+            for run in runKeys:
+                iterations,reason=self.stopInfo[run]
+                fid.write(run+"\t"+str(iterations)+"\t"+reason+"\n")
+            fid.close()
+        except:
+            print "Could not write stop info table"
+            sys.exit("Could not write stop info table")
@@ -0,0 +1,106 @@
+# -*- coding: us-ascii -*-
+"""Editing of OpenFOAM dictionaries in memory, with atomic writes."""
+import os
+import re
+import shutil
+import logging
+from contextlib import contextmanager
+from os import path
+
+log = logging.getLogger(__name__)
+
+
+def parameterPattern(parameter):
+    """Expression matching lines setting a parameter, as in ParameterFile"""
+    return re.compile(
+        r"^(\s*" + re.escape(parameter) + r"\s+)([^;\n]*?)(\s*;.*)$",
+        re.MULTILINE
+    )
+
+
+class DictEditor:
+    """A dictionary that is read once and edited in memory
+
+    Edits are made to the text in memory and written to the file in one
+    atomic replace by write, so that the file is never half modified. The
+    original text is kept in memory, and rollback writes it back, as
+    purgeFile of ParameterFile."""
+
+    def __init__(self, name):
+        """@param name: path of the dictionary"""
+        self.name = name
+        fid = open(name, "r")
+        try:
+            self.original = fid.read()
+        finally:
+            fid.close()
+        self.content = self.original
+        # text last written to the file
+        self.written = self.original
+
+    def readParameter(self, parameter):
+        """Value of a parameter, an empty string if not set, as in
+        ParameterFile"""
+        match = parameterPattern(parameter).search(self.content)
+        if match is None:
+            return ""
+        return match.group(2).strip()
+
+    def replaceParameter(self, parameter, newval):
+        """Set the value of a parameter in memory
+        @return: False if the parameter is not in the dictionary"""
+        exp = parameterPattern(parameter)
+        if exp.search(self.content) is None:
+            log.warning(
+                "Parameter %s not found in %s" % (parameter, self.name)
+            )
+            return False
+        self.content = exp.sub(
+            lambda m: m.group(1) + str(newval) + m.group(3), self.content
+        )
+        return True
+
+    def replaceParameters(self, values):
+        """Set several parameters in memory
+        @param values: list of (parameter, value) or a dict"""
+        if isinstance(values, dict):
+            values = sorted(values.items())
+        for parameter, newval in values:
+            self.replaceParameter(parameter, newval)
+
+    def isModified(self):
+        """True if the file differs from the text in memory"""
+        return self.content != self.written
+
+    def write(self):
+        """Write the dictionary, if modified, by replacing the file"""
+        if not self.isModified():
+            return
+        tmpPath = path.join(
+            path.dirname(self.name), "." + path.basename(self.name) + ".tmp"
+        )
+        fid = open(tmpPath, "w")
+        try:
+            fid.write(self.content)
+        finally:
+            fid.close()
+        shutil.copymode(self.name, tmpPath)
+        os.rename(tmpPath, self.name)
+        self.written = self.content
+
+    def rollback(self):
+        """Restore the dictionary to the state it had when read"""
+        self.content = self.original
+        self.write()
+
+    @contextmanager
+    def transaction(self):
+        """Edits made in the block are written together at its end, or
+        discarded if the block raises an exception"""
+        before = self.content
+        try:
+            yield self
+        except:
+            self.content = before
+            raise
+        self.write()
@@ -0,0 +1,70 @@
+# -*- coding: us-ascii -*-
+"""Cache of directory listings, invalidated by modification times."""
+import os
+import time
+import threading
+from os import path
+
+# listings of directories modified less than this many seconds before
+# they were read are not trusted, since a later change within the
+# resolution of the modification time would not be detected
+RACY_SECONDS = 1.0
+
+
+class DirCache:
+    """Values computed from the content of directories, such as lists of
+    time directories or fields, recomputed only when a directory has been
+    modified or the cache is invalidated
+
+    Adding, removing or renaming entries of a directory updates its
+    modification time, while writing to existing files does not."""
+
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, dirPaths, key, compute):
+        """Cached value of compute()
+        @param dirPaths: directories the value depends on
+        @param key: name of the value
+        @param compute: function computing the value"""
+        cacheKey = (tuple(dirPaths), key)
+        state = self.state(dirPaths)
+        with self.lock:
+            entry = self.entries.get(cacheKey)
+        if entry is not None and entry[0] == state:
+            return entry[1]
+        readTime = time.time()
+        value = compute()
+        if max([0] + [m for m in state if m is not None]) < \
+                readTime - RACY_SECONDS:
+            with self.lock:
+                self.entries[cacheKey] = (state, value)
+        return value
+
+    def state(self, dirPaths):
+        mtimes = []
+        for dirPath in dirPaths:
+            try:
+                mtimes.append(os.stat(dirPath).st_mtime)
+            except OSError:
+                mtimes.append(None)
+        return tuple(mtimes)
+
+    def listdir(self, dirPath):
+        """Names in a directory"""
+        return self.get([dirPath], "listdir", lambda: os.listdir(dirPath))
+
+    def invalidate(self, dirPath=None):
+        """Drop cached values, of those depending on a directory or below
+        it if given, otherwise all"""
+        with self.lock:
+            if dirPath is None:
+                self.entries.clear()
+                return
+            prefix = path.join(dirPath, "")
+            for cacheKey in list(self.entries.keys()):
+                for p in cacheKey[0]:
+                    if p == dirPath or p.startswith(prefix):
+                        del self.entries[cacheKey]
+                        break
@@ -0,0 +1,125 @@
+# -*- coding: us-ascii -*-
+"""Removal of large directory trees in background threads."""
+import os
+import glob
+import atexit
+import shutil
+import logging
+import tempfile
+import threading
+from os import path
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+log = logging.getLogger(__name__)
+
+# prefix of the directories that trees are moved to before removal
+TRASH_PREFIX = ".trash-"
+NTHREADS = 4
+
+
+class DirRemover:
+    """Removes directories in background threads
+
+    A directory is first renamed into a hidden trash directory next to it,
+    which is atomic, so that it is immediately gone from the case. The
+    trash directory is then removed by a pool of threads. Errors are
+    logged and kept until the next call of wait."""
+
+    def __init__(self, nthreads=NTHREADS):
+        self.nthreads = nthreads
+        self.queue = queue.Queue()
+        self.threads = []
+        self.errors = []
+        # trash directories queued or being removed
+        self.pending = set()
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if len(self.threads) > 0:
+                return
+            for i in range(self.nthreads):
+                thread = threading.Thread(target=self.work)
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+        # removals are finished before the interpreter exits
+        atexit.register(self.wait)
+
+    def work(self):
+        while True:
+            trashPath = self.queue.get()
+            try:
+                shutil.rmtree(trashPath, onerror=self.onError)
+            finally:
+                with self.lock:
+                    self.pending.discard(trashPath)
+                self.queue.task_done()
+
+    def onError(self, func, errorPath, excInfo):
+        message = "Could not remove %s: %s" % (errorPath, str(excInfo[1]))
+        log.error(message)
+        with self.lock:
+            self.errors.append(message)
+
+    def remove(self, dirPath):
+        """Move a directory out of the way and remove it in the background
+        If the directory cannot be moved, it is removed at once."""
+        if not path.exists(dirPath):
+            return
+        parent = path.dirname(path.abspath(dirPath))
+        try:
+            trashPath = tempfile.mkdtemp(prefix=TRASH_PREFIX, dir=parent)
+            os.rename(dirPath, path.join(trashPath, path.basename(dirPath)))
+        except OSError as e:
+            log.warning("Could not move %s, removing it at once: %s" % (
+                dirPath, str(e)))
+            shutil.rmtree(dirPath, onerror=self.onError)
+            return
+        self.put(trashPath)
+
+    def put(self, trashPath):
+        self.start()
+        with self.lock:
+            self.pending.add(trashPath)
+        self.queue.put(trashPath)
+
+    def removeStale(self, parent):
+        """Remove trash directories left in parent, e.g. by a killed run"""
+        parent = path.abspath(parent)
+        for trashPath in glob.glob(path.join(parent, TRASH_PREFIX + "*")):
+            with self.lock:
+                queued = trashPath in self.pending
+            if not queued:
+                self.put(trashPath)
+
+    def wait(self):
+        """Wait for all removals to finish
+        @return: list of error messages since the last call"""
+        if len(self.threads) > 0:
+            self.queue.join()
+        with self.lock:
+            errors = self.errors
+            self.errors = []
+        return errors
+
+
+_remover = DirRemover()
+
+
+def remove(dirPath):
+    """Remove a directory in the background, using a shared remover"""
+    _remover.remove(dirPath)
+
+
+def removeStale(parent):
+    _remover.removeStale(parent)
+
+
+def wait():
+    """Wait for the background removals of the shared remover"""
+    return _remover.wait()
@@ -0,0 +1,265 @@
+# -*- coding: us-ascii -*-
+"""Execution of shell commands and file operations with metrics.
+
+Every command and file operation is timed, and a metrics record with
+wall time, CPU time, exit status and output size is kept for it. The
+records are logged at debug level, appended as json lines to a metrics
+file if one is set, and summarized per command by summary().
+
+File operations such as copying, compressing and removing are done in
+Python instead of by forking cp, gzip or rm."""
+import os
+import time
+import errno
+import gzip
+import json
+import shutil
+import hashlib
+import logging
+import threading
+import subprocess
+from os import path
+
+log = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+GZIP_LEVEL = 6
+# default name of the metrics file in a case directory
+METRICS_FILE = "executionMetrics.jsonl"
+
+_records = []
+_lock = threading.Lock()
+_metricsFile = None
+
+
+def setMetricsFile(metricsPath):
+    """Append metrics records as json lines to a file, None to stop"""
+    global _metricsFile
+    _metricsFile = metricsPath
+
+
+def processTime():
+    t = os.times()
+    return t[0] + t[1]
+
+
+def record(command, args, wall, cpu, status, outputBytes, native):
+    """Store a metrics record of a command"""
+    rec = {
+        "command": command,
+        "args": args,
+        "wall": round(wall, 6),
+        "cpu": round(cpu, 6),
+        "status": status,
+        "outputBytes": outputBytes,
+        "native": native,
+        "time": round(time.time(), 3)
+    }
+    line = json.dumps(rec, sort_keys=True)
+    log.debug(line)
+    with _lock:
+        _records.append(rec)
+        if _metricsFile is not None:
+            fid = open(_metricsFile, "a")
+            try:
+                fid.write(line + "\n")
+            finally:
+                fid.close()
+    if status != 0:
+        log.warning("Command failed with status %i: %s %s" % (
+            status, command, args))
+    return rec
+
+
+def records():
+    """Metrics records of all commands run so far"""
+    with _lock:
+        return list(_records)
+
+
+def summary():
+    """Count, wall time, CPU time, failures and output bytes per command
+    @return: dict with a dict of totals per command"""
+    totals = {}
+    for rec in records():
+        tot = totals.setdefault(rec["command"], {
+            "count": 0, "wall": 0.0, "cpu": 0.0, "failed": 0,
+            "outputBytes": 0
+        })
+        tot["count"] += 1
+        tot["wall"] += rec["wall"]
+        tot["cpu"] += rec["cpu"]
+        tot["outputBytes"] += rec["outputBytes"]
+        if rec["status"] != 0:
+            tot["failed"] += 1
+    return totals
+
+
+def logSummary(logger=log):
+    """Log the totals per command, the most time consuming first"""
+    totals = summary()
+    for command in sorted(totals, key=lambda c: -totals[c]["wall"]):
+        tot = totals[command]
+        logger.info(
+            "%-10s %6i calls %10.2f s wall %10.2f s cpu %6i failed" % (
+                command, tot["count"], tot["wall"], tot["cpu"],
+                tot["failed"])
+        )
+
+
+def run(cmd):
+    """Run a shell command, recording its metrics
+    The CPU time is the user and system time of the command, including
+    its children.
+    @return: A list with all the output-lines of the execution"""
+    start = time.time()
+    proc = subprocess.Popen(
+        cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+    )
+    output = proc.stdout.read()
+    proc.stdout.close()
+    pid, status, usage = os.wait4(proc.pid, 0)
+    if os.WIFEXITED(status):
+        proc.returncode = os.WEXITSTATUS(status)
+    else:
+        proc.returncode = -os.WTERMSIG(status)
+    words = cmd.split(None, 1)
+    record(
+        path.basename(words[0]) if len(words) > 0 else "",
+        words[1] if len(words) > 1 else "",
+        time.time() - start, usage.ru_utime + usage.ru_stime,
+        proc.returncode, len(output), False
+    )
+    if not isinstance(output, str):
+        output = output.decode("latin-1")
+    return output.splitlines(True)
+
+
+class Timed:
+    """Context manager recording the metrics of a native operation
+    The CPU time is that of the whole process, including other threads."""
+
+    def __init__(self, command, args):
+        self.command = command
+        self.args = args
+        self.outputBytes = 0
+
+    def __enter__(self):
+        self.start = time.time()
+        self.cpuStart = processTime()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        record(
+            self.command, self.args, time.time() - self.start,
+            processTime() - self.cpuStart, 0 if excType is None else 1,
+            self.outputBytes, True
+        )
+        return False
+
+
+class HashingWriter:
+    """File object computing the content hash of the data written
+    through it, so that a copy and its checksum take a single pass"""
+
+    def __init__(self, fid):
+        self.fid = fid
+        self.digest = hashlib.sha1()
+
+    def write(self, data):
+        self.digest.update(data)
+        self.fid.write(data)
+
+    def flush(self):
+        self.fid.flush()
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+
+def copyFile(src, dst):
+    """Copy a file, as cp
+    @return: content hash of the copy, as Snapshot.fileHash"""
+    with Timed("cp", src + " " + dst) as t:
+        srcFid = open(src, "rb")
+        try:
+            dstFid = open(dst, "wb")
+            try:
+                writer = HashingWriter(dstFid)
+                shutil.copyfileobj(srcFid, writer, CHUNK_SIZE)
+            finally:
+                dstFid.close()
+        finally:
+            srcFid.close()
+        shutil.copymode(src, dst)
+        t.outputBytes = os.path.getsize(dst)
+    return writer.hexdigest()
+
+
+def gzipFile(src, dst, level=GZIP_LEVEL):
+    """Write a compressed copy of a file, as gzip -nc src > dst
+    @param level: compression level, 1 (fastest) to 9 (smallest)
+    @return: content hash of the compressed file, as Snapshot.fileHash"""
+    with Timed("gzip", src + " " + dst) as t:
+        srcFid = open(src, "rb")
+        try:
+            dstFid = open(dst, "wb")
+            try:
+                writer = HashingWriter(dstFid)
+                # no name or time in the header, as gzip -n, so that
+                # identical content gives identical files
+                gzFid = gzip.GzipFile(
+                    filename="", fileobj=writer, mode="wb",
+                    compresslevel=level, mtime=0
+                )
+                try:
+                    shutil.copyfileobj(srcFid, gzFid, CHUNK_SIZE)
+                finally:
+                    gzFid.close()
+            finally:
+                dstFid.close()
+        finally:
+            srcFid.close()
+        shutil.copymode(src, dst)
+        t.outputBytes = os.path.getsize(dst)
+    return writer.hexdigest()
+
+
+def gunzipFile(src, dst):
+    """Write a decompressed copy of a file, as gunzip -c src > dst"""
+    with Timed("gunzip", src + " " + dst) as t:
+        srcFid = gzip.open(src, "rb")
+        try:
+            dstFid = open(dst, "wb")
+            try:
+                shutil.copyfileobj(srcFid, dstFid, CHUNK_SIZE)
+            finally:
+                dstFid.close()
+        finally:
+            srcFid.close()
+        t.outputBytes = os.path.getsize(dst)
+
+
+def makeDirs(dirPath):
+    """Create a directory and its parents if missing, as mkdir -p"""
+    with Timed("mkdir", dirPath):
+        if not path.exists(dirPath):
+            try:
+                os.makedirs(dirPath)
+            except OSError as e:
+                # created by another thread or process meanwhile
+                if e.errno != errno.EEXIST or not path.isdir(dirPath):
+                    raise
+
+
+def remove(filePath):
+    """Remove a file or directory tree, as rm -r
+    @return: False if it did not exist"""
+    with Timed("rm", filePath):
+        if path.isdir(filePath) and not path.islink(filePath):
+            shutil.rmtree(filePath)
+            return True
+        if path.lexists(filePath):
+            os.remove(filePath)
+            return True
+    return False
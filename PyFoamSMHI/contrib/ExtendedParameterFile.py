@@ -1,12 +1,96 @@
-import sys, re, os, logging, glob
+import sys, re, os, logging, glob, shutil
 from os import path
 from PyFoam.RunDictionary.ParameterFile import ParameterFile
+from PyFoamSMHI.contrib.FieldFile import copyBytes
 
 class ExtendedParameterFile(ParameterFile):
 
     def __init__(self, name, backup=False):
         self.logger=logging.getLogger('ExtendedParameterFile')
         ParameterFile.__init__(self,name,backup)
+        # index of list parameters, as {parameter: (state, entries, set
+        # of entries, offset of the closing parenthesis)}
+        self.listIndex={}
+
+    def fileState(self):
+        st=os.stat(self.name)
+        return (st.st_size, st.st_mtime)
+
+    def indexParameterList(self,parameter):
+        """Reads the entries of a list parameter, unless already indexed
+        and the file is unchanged
+        @return: list of entries, set of entries and the offset of the
+        closing parenthesis of the list"""
+        state=self.fileState()
+        cached=self.listIndex.get(parameter)
+        if cached is not None and cached[0]==state:
+            return cached[1:]
+        fh=open(self.name,'rb')
+        try:
+            text=fh.read().decode("latin-1")
+        finally:
+            fh.close()
+        exp=re.compile(r"(?:^|\s)"+re.escape(parameter)+r"\s*\(")
+        expMatch=exp.search(text)
+        if expMatch==None:
+            self.logger.error("Missing parameter: "+parameter+" in dictionary: "+self.name)
+            sys.exit(1)
+        end=text.find(")",expMatch.end())
+        if end==-1:
+            self.logger.error("Unterminated list: "+parameter+" in dictionary: "+self.name)
+            sys.exit(1)
+        entries=text[expMatch.end():end].split()
+        self.listIndex[parameter]=(state,entries,set(entries),end)
+        return entries,set(entries),end
+
+    def readParameterList(self,parameter):
+        """@return: the values of a list parameter"""
+        return list(self.indexParameterList(parameter)[0])
+
+    def appendParameterList(self,parameter,newEntries):
+        """appends values to a list parameter, skipping values already
+        in the list. Only the new values are formatted, the rest of the
+        file is copied unchanged.
+
+        @param parameter: name of the parameter
+        @param newEntries: the values to append
+        @return: list of the appended values
+        """
+        entries,entrySet,end=self.indexParameterList(parameter)
+        added=[]
+        for val in newEntries:
+            val=str(val)
+            if val not in entrySet and val not in added:
+                added.append(val)
+        if len(added)==0:
+            return added
+        addedText="".join([val+"\n" for val in added])
+        src=open(self.name,'rb')
+        try:
+            src.seek(end-1)
+            if src.read(1)!=b"\n":
+                addedText="\n"+addedText
+        finally:
+            src.close()
+        addedText=addedText.encode("latin-1")
+        tmpName=path.join(path.dirname(self.name),"."+path.basename(self.name)+".tmp")
+        src=open(self.name,'rb')
+        try:
+            dst=open(tmpName,'wb')
+            try:
+                copyBytes(src,dst,end)
+                dst.write(addedText)
+                shutil.copyfileobj(src,dst)
+            finally:
+                dst.close()
+        finally:
+            src.close()
+        shutil.copymode(self.name,tmpName)
+        os.rename(tmpName,self.name)
+        entries=entries+added
+        self.listIndex[parameter]=(self.fileState(),entries,entrySet.union(added),end+len(addedText))
+        self.logger.debug("Appended to %s: %s" % (parameter, " ".join(added)))
+        return added
 
     def replaceParameterList(self,parameter,newList):
         """writes the list of parameter values
@@ -20,10 +104,10 @@ class ExtendedParameterFile(ParameterFile):
 
         exp=re.compile("(.*"+parameter+".*?"+r"\("+")(.*?)("+r"\);.*)",re.DOTALL)
         expMatch=exp.search(self.content)
-        self.logger.info(str(newList))
+        self.logger.debug(str(newList))
 
         if expMatch==None:
-            logger.error("Missing parameter: "+parameter+" in dictionary: "+self.name)
+            self.logger.error("Missing parameter: "+parameter+" in dictionary: "+self.name)
             sys.exit()
         else:
             listString="\n"
@@ -31,7 +115,7 @@ class ExtendedParameterFile(ParameterFile):
                 try:
                     listString+=str(val)+"\n"
                 except:
-                    logger.error("Cannot write parameter: "+parameter+" to dictionary, cannot convert to string...")
+                    self.logger.error("Cannot write parameter: "+parameter+" to dictionary, cannot convert to string...")
                     sys.exit()
             fh.write(expMatch.group(1))
             fh.write(listString)
@@ -0,0 +1,436 @@
+# -*- coding: us-ascii -*-
+"""Binary archive format of fields, with arrays readable by memory map.
+
+A field array file holds the nonuniform lists of an OpenFOAM field, i.e.
+the internalField and the nonuniform values of the patches, as binary
+arrays of little-endian doubles. The file starts with a preamble of the
+magic string, the offset and the length of the header. The arrays follow,
+each starting at a multiple of ALIGNMENT bytes, and the header is written
+last, as json with the mesh id, class, object and dimensions of the field,
+the name, type, shape and offset of each array and the text of the field
+between the arrays, so that the field can be written back as text.
+
+NumPy is optional, arrays are memory-mapped if it is installed and read
+into an array.array otherwise."""
+import io
+import os
+import re
+import sys
+import json
+import array
+import hashlib
+import logging
+import struct
+from os import path
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from PyFoamSMHI.contrib.FieldFile import (
+    openBinary, matchingBrace, parsePatches, BOUNDARY_EXP, CHUNK_SIZE
+)
+from PyFoamSMHI.contrib.MeshBoundary import meshFile
+
+log = logging.getLogger(__name__)
+
+MAGIC = b"FOAMARR1"
+PREAMBLE = struct.Struct("<8sQQ")
+ALIGNMENT = 64
+DTYPE = "<f8"
+ITEM_SIZE = 8
+# suffix of field array files, e.g. U.fa
+SUFFIX = ".fa"
+# values written per chunk when converting to text
+CHUNK_ITEMS = 65536
+
+# number of components of the element types of lists
+COMPONENTS = {
+    "scalar": 1, "vector": 3, "sphericalTensor": 1, "symmTensor": 6,
+    "tensor": 9
+}
+LIST_EXP = re.compile(br"\bnonuniform\s+List<(\w+)>\s*(\d+)\s*\(")
+# max length of a match of LIST_EXP that can span two chunks
+LIST_OVERLAP = 256
+# end of the last element of a list of vectors or tensors and the list
+ITEMS_END_EXP = re.compile(br"\)\s*\)")
+FOAMFILE_EXP = re.compile(r"\bFoamFile\s*\{")
+# the FoamFile header is looked for in the first bytes of a file
+HEADER_SEARCH = 4096
+MESH_FILES = ["points", "faces", "owner", "neighbour", "boundary"]
+
+
+def arrayName(fileName):
+    """Name of the field array file of a field file, e.g. U.gz -> U.fa"""
+    if fileName.endswith(".gz"):
+        fileName = fileName[:-3]
+    return fileName + SUFFIX
+
+
+def isFieldArray(fileName):
+    return fileName.endswith(SUFFIX)
+
+
+def meshId(meshDir):
+    """Content hash of a mesh, identifying the mesh that the arrays of a
+    field are defined on
+    @param meshDir: the polyMesh directory"""
+    digest = hashlib.sha1()
+    for name in MESH_FILES:
+        filePath = meshFile(meshDir, name)
+        if not path.exists(filePath):
+            continue
+        fid = openBinary(filePath)
+        try:
+            while True:
+                data = fid.read(1024 * 1024)
+                if not data:
+                    break
+                digest.update(data)
+        finally:
+            fid.close()
+    return digest.hexdigest()
+
+
+def parseValues(data):
+    """Values of elements of a list, with parentheses of vectors and
+    tensors removed
+    @param data: bytes of whole elements or values of a list
+    @return: array.array of doubles"""
+    return array.array(
+        "d", [float(v) for v in data.translate(None, b"()").split()]
+    )
+
+
+def toBytes(values):
+    """Little-endian bytes of an array of doubles"""
+    if numpy is not None:
+        return numpy.asarray(values, dtype=DTYPE).tobytes()
+    if sys.byteorder != "little":
+        values = array.array("d", values)
+        values.byteswap()
+    return values.tostring() if sys.version_info[0] < 3 else \
+        values.tobytes()
+
+
+def headerEntries(text):
+    """Class and object in the FoamFile header of a field and its
+    dimensions"""
+    entries = {"class": None, "object": None, "dimensions": None}
+    pos = 0
+    match = FOAMFILE_EXP.search(text, 0, HEADER_SEARCH)
+    if match is not None:
+        headerEnd = matchingBrace(text, match.end() - 1)
+        header = text[match.start():headerEnd]
+        if re.search(r"\bformat\s+binary\s*;", header):
+            raise ValueError("Binary field files are not supported")
+        for key in ("class", "object"):
+            match = re.search(r"\b%s\s+([^;\s]+)\s*;" % key, header)
+            if match is not None:
+                entries[key] = match.group(1)
+        pos = headerEnd
+    match = re.compile(r"^\s*dimensions\s+(\[[^\]]*\])\s*;", re.MULTILINE) \
+        .search(text, pos)
+    if match is not None:
+        entries["dimensions"] = match.group(1)
+    return entries
+
+
+def patchRanges(text):
+    """Patches of the boundaryField of a field
+    @return: list of (name, bodyStart, bodyEnd) with positions in text"""
+    match = BOUNDARY_EXP.search(text.encode("latin-1"))
+    if match is None:
+        return []
+    offset = match.start(1)
+    patches = parsePatches(text[offset:])[0]
+    return [(name, offset + bodyStart, offset + bodyEnd)
+            for name, start, end, bodyStart, bodyEnd in patches]
+
+
+class FieldReader:
+    """Field file in ascii format read in chunks, as the text between the
+    nonuniform lists and the values of the lists"""
+
+    def __init__(self, fid):
+        self.fid = fid
+        self.data = b""
+        self.pos = 0
+        self.fill()
+
+    def fill(self):
+        """Read the next chunk, dropping the data before the position
+        @return: False at the end of the file"""
+        chunk = self.fid.read(CHUNK_SIZE)
+        if not chunk:
+            return False
+        self.data = self.data[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def nextList(self):
+        """Text up to the next nonuniform list of a type in COMPONENTS,
+        with the position moved to the first element of the list
+        @return: text and (type, length) of the list, None at the end"""
+        parts = []
+        while True:
+            match = LIST_EXP.search(self.data, self.pos)
+            if match is not None:
+                listType = match.group(1).decode("latin-1")
+                if listType not in COMPONENTS:
+                    parts.append(self.data[self.pos:match.end()])
+                    self.pos = match.end()
+                    continue
+                parts.append(self.data[self.pos:match.start()])
+                self.pos = match.end()
+                return b"".join(parts).decode("latin-1"), \
+                    (listType, int(match.group(2)))
+            keep = max(self.pos, len(self.data) - LIST_OVERLAP)
+            parts.append(self.data[self.pos:keep])
+            self.pos = keep
+            if not self.fill():
+                parts.append(self.data[self.pos:])
+                self.pos = len(self.data)
+                return b"".join(parts).decode("latin-1"), None
+
+    def copyValues(self, ncomp, out):
+        """Write the values of the list at the position to a file, chunk
+        by chunk, and move the position past the end of the list
+        @param ncomp: components of the elements, 1 for empty lists
+        @return: number of values"""
+        count = 0
+        while True:
+            if ncomp == 1:
+                end = self.data.find(b")", self.pos)
+            else:
+                match = ITEMS_END_EXP.search(self.data, self.pos)
+                end = -1 if match is None else match.end() - 1
+            if end != -1:
+                cut = end
+            elif ncomp == 1:
+                # a value may continue in the next chunk
+                cut = max(
+                    self.data.rfind(b" ", self.pos),
+                    self.data.rfind(b"\n", self.pos)
+                )
+            else:
+                # the parenthesis of the last element may end the list
+                cut = self.data.rfind(b")", self.pos)
+            if cut > self.pos:
+                values = parseValues(self.data[self.pos:cut])
+                out.write(toBytes(values))
+                count += len(values)
+                self.pos = cut
+            if end != -1:
+                self.pos = end + 1
+                return count
+            if not self.fill():
+                raise ValueError("Unexpected end of list")
+
+
+def fromFoam(src, dst, meshId=None):
+    """Convert an OpenFOAM field file in ascii format, compressed or not,
+    to a field array file. The file is read in chunks and the values of
+    lists are written as they are parsed.
+    @param meshId: optional, id of the mesh of the field, see meshId
+    @return: the header of the field array file"""
+    fid = openBinary(src)
+    tmpPath = path.join(path.dirname(dst), "." + path.basename(dst) + ".tmp")
+    out = open(tmpPath, "wb")
+    try:
+        reader = FieldReader(fid)
+        # binary files are rejected before their data is parsed
+        headerEntries(reader.data[:HEADER_SEARCH].decode("latin-1"))
+        texts = []
+        arrays = []
+        out.write(PREAMBLE.pack(MAGIC, 0, 0))
+        offset = PREAMBLE.size
+        while True:
+            text, found = reader.nextList()
+            texts.append(text)
+            if found is None:
+                break
+            listType, n = found
+            ncomp = COMPONENTS[listType]
+            padding = -offset % ALIGNMENT
+            out.write(b"\0" * padding)
+            offset += padding
+            count = reader.copyValues(ncomp if n > 0 else 1, out)
+            if count != n * ncomp:
+                raise ValueError(
+                    "Expected %i values in list, found %i" % (n * ncomp, count)
+                )
+            arrays.append({
+                "type": listType,
+                "dtype": DTYPE,
+                "shape": [n] if ncomp == 1 else [n, ncomp],
+                "offset": offset
+            })
+            offset += count * ITEM_SIZE
+
+        # the text with empty lists in place of the arrays is used to
+        # name the arrays
+        parts = []
+        positions = []
+        for i in range(len(arrays)):
+            parts.append(texts[i])
+            positions.append(sum(len(p) for p in parts))
+            parts.append("()")
+        parts.append(texts[-1])
+        skeleton = "".join(parts)
+        patches = patchRanges(skeleton)
+        for info, pos in zip(arrays, positions):
+            lineStart = skeleton.rfind("\n", 0, pos) + 1
+            words = skeleton[lineStart:pos].split()
+            name = words[-1] if len(words) > 0 else "internalField"
+            for patch, bodyStart, bodyEnd in patches:
+                if bodyStart <= pos < bodyEnd:
+                    name = "boundaryField/%s/%s" % (patch, name)
+            info["name"] = name
+
+        header = headerEntries(skeleton)
+        header["meshId"] = meshId
+        header["arrays"] = arrays
+        header["text"] = texts
+        headerData = json.dumps(header, sort_keys=True).encode("latin-1")
+        out.write(headerData)
+        out.seek(0)
+        out.write(PREAMBLE.pack(MAGIC, offset, len(headerData)))
+    except:
+        out.close()
+        os.remove(tmpPath)
+        raise
+    finally:
+        fid.close()
+    out.close()
+    os.rename(tmpPath, dst)
+    return header
+
+
+def formatValue(value):
+    """Shortest text giving the same double, as 1.5, 1e-05 or 2"""
+    text = repr(float(value))
+    if text.endswith(".0"):
+        return text[:-2]
+    return text
+
+
+def formatItems(values, ncomp):
+    """Lines of the elements of a list, as written by OpenFOAM"""
+    values = [formatValue(v) for v in values]
+    if ncomp == 1:
+        return "\n".join(values) + "\n"
+    return "\n".join(
+        "(" + " ".join(values[i:i + ncomp]) + ")"
+        for i in range(0, len(values), ncomp)
+    ) + "\n"
+
+
+class FieldArray:
+    """A field array file, see the module documentation"""
+
+    def __init__(self, filePath, offset=0):
+        """@param offset: optional, position of the field array in the
+        file, e.g. of an entry in a CasePack"""
+        self.path = filePath
+        self.offset = offset
+        fid = open(filePath, "rb")
+        try:
+            fid.seek(offset)
+            magic, headerOffset, headerLength = PREAMBLE.unpack(
+                fid.read(PREAMBLE.size)
+            )
+            if magic != MAGIC:
+                raise ValueError("Not a field array file: " + filePath)
+            fid.seek(offset + headerOffset)
+            self.header = json.loads(fid.read(headerLength).decode("latin-1"))
+        finally:
+            fid.close()
+
+    def names(self):
+        """Names of the arrays, internalField for the internal field and
+        boundaryField/<patch>/<entry> for values of patches"""
+        return [a["name"] for a in self.header["arrays"]]
+
+    def arrayInfo(self, name):
+        for info in self.header["arrays"]:
+            if info["name"] == name:
+                return info
+        raise KeyError("No array %s in %s" % (name, self.path))
+
+    def array(self, name="internalField"):
+        """An array of the field, with one row per element for vectors
+        and tensors if NumPy is installed
+        @return: read-only numpy memmap, or a flat array.array"""
+        return self.readArray(self.arrayInfo(name))
+
+    def readArray(self, info):
+        count = 1
+        for n in info["shape"]:
+            count *= n
+        if numpy is not None:
+            if count == 0:
+                # empty files or regions can not be memory-mapped
+                return numpy.zeros(
+                    tuple(info["shape"]), dtype=numpy.dtype(info["dtype"])
+                )
+            return numpy.memmap(
+                self.path, dtype=numpy.dtype(info["dtype"]), mode="r",
+                offset=self.offset + info["offset"],
+                shape=tuple(info["shape"])
+            )
+        values = array.array("d")
+        fid = open(self.path, "rb")
+        try:
+            fid.seek(self.offset + info["offset"])
+            values.fromfile(fid, count)
+        finally:
+            fid.close()
+        if sys.byteorder != "little":
+            values.byteswap()
+        return values
+
+    def write(self, out):
+        """Write the field as OpenFOAM ascii text to a file object"""
+        texts = self.header["text"]
+        for i, info in enumerate(self.header["arrays"]):
+            out.write(texts[i].encode("latin-1"))
+            n = info["shape"][0]
+            ncomp = COMPONENTS[info["type"]]
+            out.write(("nonuniform List<%s> \n%i\n(\n" % (
+                info["type"], n)).encode("latin-1"))
+            values = self.readArray(info)
+            if numpy is not None:
+                values = values.reshape(-1)
+            step = CHUNK_ITEMS * ncomp
+            for j in range(0, n * ncomp, step):
+                out.write(formatItems(
+                    values[j:j + step].tolist(), ncomp
+                ).encode("latin-1"))
+            out.write(b")")
+        out.write(texts[-1].encode("latin-1"))
+
+    def toFoam(self, dst):
+        """Write the field as an OpenFOAM ascii file, compressed if dst
+        ends with .gz"""
+        tmpPath = path.join(
+            path.dirname(dst), "." + path.basename(dst) + ".tmp"
+        )
+        out = openBinary(tmpPath, "wb", compressed=dst.endswith(".gz"))
+        try:
+            self.write(out)
+        finally:
+            out.close()
+        os.rename(tmpPath, dst)
+
+    def text(self):
+        """The field as OpenFOAM ascii text"""
+        out = io.BytesIO()
+        self.write(out)
+        return out.getvalue().decode("latin-1")
+
+
+def toFoam(src, dst):
+    """Convert a field array file to an OpenFOAM field file"""
+    FieldArray(src).toFoam(dst)
@@ -0,0 +1,277 @@
+# -*- coding: us-ascii -*-
+"""Streaming editing of the boundaryField of large field files."""
+import os
+import re
+import gzip
+import shutil
+import logging
+import threading
+from os import path
+
+log = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+GZIP_LEVEL = 6
+
+BOUNDARY_EXP = re.compile(br"(?:^|\n)[ \t]*(boundaryField)\b")
+# max length of a match of BOUNDARY_EXP that can span two chunks
+OVERLAP = 64
+
+# byte offset of boundaryField per file, as {path: (state, offset)}, see
+# FieldFile.stat
+_offsetCache = {}
+_cacheLock = threading.Lock()
+
+
+def isCompressed(fieldPath):
+    return fieldPath.endswith(".gz")
+
+
+def openBinary(fieldPath, mode="rb", compressed=None):
+    """Open a field file in binary mode, compressed or not
+    @param compressed: optional, default is to decide from the file name"""
+    if compressed is None:
+        compressed = isCompressed(fieldPath)
+    if compressed:
+        if "w" in mode:
+            return gzip.open(fieldPath, mode, GZIP_LEVEL)
+        return gzip.open(fieldPath, mode)
+    return open(fieldPath, mode)
+
+
+def copyBytes(src, dst, count):
+    """Copy count bytes from file object src to dst, using a zero-copy
+    kernel copy when both are plain files and it is available"""
+    if hasattr(os, "sendfile") and not isinstance(src, gzip.GzipFile) \
+       and not isinstance(dst, gzip.GzipFile):
+        dst.flush()
+        offset = src.tell()
+        left = count
+        while left > 0:
+            sent = os.sendfile(dst.fileno(), src.fileno(), offset, left)
+            if sent == 0:
+                break
+            offset += sent
+            left -= sent
+        src.seek(offset)
+        dst.seek(0, os.SEEK_END)
+        return count - left
+    left = count
+    while left > 0:
+        data = src.read(min(CHUNK_SIZE, left))
+        if not data:
+            break
+        dst.write(data)
+        left -= len(data)
+    return count - left
+
+
+def skipSpace(text, pos):
+    """Position of the next token, skipping white space and comments"""
+    while pos < len(text):
+        if text[pos].isspace():
+            pos += 1
+        elif text.startswith("//", pos):
+            end = text.find("\n", pos)
+            pos = len(text) if end == -1 else end + 1
+        elif text.startswith("/*", pos):
+            end = text.find("*/", pos)
+            pos = len(text) if end == -1 else end + 2
+        else:
+            break
+    return pos
+
+
+def matchingBrace(text, pos):
+    """Position after the brace closing the brace at pos"""
+    depth = 0
+    while pos < len(text):
+        pos = skipSpace(text, pos)
+        if pos >= len(text):
+            break
+        c = text[pos]
+        if c == '"':
+            end = text.find('"', pos + 1)
+            pos = len(text) if end == -1 else end + 1
+            continue
+        if c == "{":
+            depth += 1
+        elif c == "}":
+            depth -= 1
+            if depth == 0:
+                return pos + 1
+        pos += 1
+    raise ValueError("Unbalanced braces in boundaryField")
+
+
+def parsePatches(text):
+    """Find the patch entries of a boundaryField entry
+    @param text: text starting with the boundaryField keyword
+    @return: list of (name, start, end, bodyStart, bodyEnd) for each
+    patch, where start and end delimit the whole entry and bodyStart and
+    bodyEnd the text between the braces, and the end of boundaryField"""
+    pos = text.find("{")
+    if pos == -1:
+        raise ValueError("No block after boundaryField")
+    end = matchingBrace(text, pos)
+    pos += 1
+    patches = []
+    while True:
+        pos = skipSpace(text, pos)
+        if pos >= end - 1:
+            break
+        start = pos
+        if text[pos] in "{;}":
+            pos += 1
+            continue
+        if text[pos] == '"':
+            pos = text.index('"', pos + 1) + 1
+        else:
+            while pos < end and not text[pos].isspace() and \
+                    text[pos] not in "{;}":
+                pos += 1
+        name = text[start:pos].strip('"')
+        pos = skipSpace(text, pos)
+        if text[pos] == "{":
+            entryEnd = matchingBrace(text, pos)
+            patches.append((name, start, entryEnd, pos + 1, entryEnd - 1))
+            pos = entryEnd
+        else:
+            # other entries, e.g. #include or macros, ending at ; or
+            # end of line
+            ends = [i for i in [text.find(";", pos, end),
+                                text.find("\n", pos, end)] if i != -1]
+            pos = min(ends + [end - 1]) + 1
+    return patches, end
+
+
+class FieldFile:
+    """A field file where only the boundaryField is read and modified
+
+    The byte offset of the boundaryField entry is found by scanning the
+    file once in chunks and is cached as long as the file is unchanged.
+    When the boundaryField is modified, the part before it is copied
+    unchanged to the new file without being parsed."""
+
+    def __init__(self, fieldPath):
+        self.path = fieldPath
+
+    def stat(self):
+        """State of the file, changed when it is written or replaced, e.g.
+        by rename of a restored file with the same size and mtime"""
+        st = os.stat(self.path)
+        return st.st_size, st.st_mtime, st.st_ino, st.st_dev
+
+    def scanOffset(self):
+        """Byte offset (uncompressed) of the boundaryField keyword"""
+        fid = openBinary(self.path)
+        try:
+            offset = 0
+            tail = b""
+            while True:
+                chunk = fid.read(CHUNK_SIZE)
+                if not chunk:
+                    return None
+                data = tail + chunk
+                match = BOUNDARY_EXP.search(data)
+                if match is not None:
+                    return offset - len(tail) + match.start(1)
+                tail = data[-OVERLAP:]
+                offset += len(chunk)
+        finally:
+            fid.close()
+
+    def boundaryOffset(self):
+        """Byte offset of boundaryField, None if there is no boundaryField"""
+        key = path.realpath(self.path)
+        state = self.stat()
+        with _cacheLock:
+            cached = _offsetCache.get(key)
+        if cached is not None and cached[0] == state:
+            return cached[1]
+        offset = self.scanOffset()
+        with _cacheLock:
+            _offsetCache[key] = (state, offset)
+        return offset
+
+    def readBoundaryField(self):
+        """Text from the boundaryField keyword to the end of the file"""
+        offset = self.boundaryOffset()
+        if offset is None:
+            return None
+        fid = openBinary(self.path)
+        try:
+            # for gzip, seek decompresses without keeping the data
+            fid.seek(offset)
+            return fid.read().decode("latin-1")
+        finally:
+            fid.close()
+
+    def readBcType(self, patch):
+        """Type of the boundary condition of a patch, None if not found"""
+        text = self.readBoundaryField()
+        if text is None:
+            return None
+        patches, end = parsePatches(text)
+        for name, start, entryEnd, bodyStart, bodyEnd in patches:
+            if name != patch:
+                continue
+            match = re.search(r"\btype\s+([^;\s]+)\s*;",
+                              text[bodyStart:bodyEnd])
+            if match is not None:
+                return match.group(1)
+        return None
+
+    def setBcTypes(self, bcTypes):
+        """Replace the boundary conditions of patches
+        @param bcTypes: dict with the new boundary condition per patch
+        @return: list of patches not found, the file is not modified
+        unless all patches are found"""
+        offset = self.boundaryOffset()
+        if offset is None:
+            return list(bcTypes.keys())
+        text = self.readBoundaryField()
+        patches, end = parsePatches(text)
+        found = [p[0] for p in patches if p[0] in bcTypes]
+        missing = [p for p in bcTypes.keys() if p not in found]
+        if len(missing) > 0:
+            return missing
+
+        parts = []
+        pos = 0
+        for name, start, entryEnd, bodyStart, bodyEnd in patches:
+            if name not in bcTypes:
+                continue
+            parts.append(text[pos:start])
+            parts.append("%s\n    {\n%s\n    }" % (name, bcTypes[name]))
+            pos = entryEnd
+        parts.append(text[pos:])
+        self.write(offset, "".join(parts).encode("latin-1"))
+        return []
+
+    def write(self, offset, boundaryField):
+        """Write the file with a new text from offset, keeping the part
+        before offset, and replace the file when done"""
+        tmpPath = path.join(
+            path.dirname(self.path), "." + path.basename(self.path) + ".tmp"
+        )
+        src = openBinary(self.path)
+        try:
+            dst = openBinary(
+                tmpPath, "wb", compressed=isCompressed(self.path)
+            )
+            try:
+                copied = copyBytes(src, dst, offset)
+                if copied != offset:
+                    raise IOError("Could not copy %s" % self.path)
+                dst.write(boundaryField)
+            finally:
+                dst.close()
+        finally:
+            src.close()
+        shutil.copymode(self.path, tmpPath)
+        os.rename(tmpPath, self.path)
+        # the part before the boundaryField is unchanged
+        state = self.stat()
+        with _cacheLock:
+            _offsetCache[path.realpath(self.path)] = (state, offset)
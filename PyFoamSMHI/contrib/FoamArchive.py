@@ -1,22 +1,52 @@
-import os, sys, logging
-from os import path, popen4, listdir
+import os, sys, io, logging, gzip, shutil
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from os import path, listdir
+
+from PyFoamSMHI.contrib import Execution, FieldArray
+from PyFoamSMHI.contrib.ArchiveIndex import ArchiveIndex, isArchived
+from PyFoamSMHI.contrib.Snapshot import tmpPath
 
 logger = logging.getLogger('foamArchive')
 
 class FoamArchive:
     """Archive for storage of Foam-fields from batch runs"""
 
-    def __init__(self, archivePath, name, compress=False):
+    def __init__(self, archivePath, name, compress=False,
+                 level=Execution.GZIP_LEVEL, nthreads=None, store=None,
+                 arrays=False, meshId=None, pack=False):
         """Creates a new archive object
         @param archivePath: The directory to create the archive in
-        @param name: the name of the archive directory to be created"""
+        @param name: the name of the archive directory to be created
+        @param compress: if True, files are compressed when archived
+        @param level: gzip compression level, 1 (fastest) to 9 (smallest)
+        @param nthreads: optional, number of files archived or restored in
+        parallel, default is the number of CPUs
+        @param store: optional ObjectStore, archived files are then stored
+        once per content and referenced from the archive directories
+        @param arrays: if True, fields are archived as field array files,
+        see FieldArray, and converted back to text when fetched
+        @param meshId: optional, id of the mesh stored with field arrays
+        @param pack: if True, the files of each directory are added to a
+        single file, <dirName>.pack, see CasePack. The object store is not
+        used for packed files"""
         self.compress = compress
+        self.level = level
+        self.store = store
+        self.arrays = arrays
+        self.meshId = meshId
+        self.pack = pack
+        if nthreads is None:
+            nthreads = multiprocessing.cpu_count()
+        self.nthreads = max(1, int(nthreads))
         if not path.exists(archivePath):
             logger.error("Path for foamArchive: " + name + "does not exist")
             sys.exit(1)
         self.path = path.join(archivePath, name)
         if not path.exists(self.path):
             os.mkdir(self.path)
+        # membership and listing queries are answered by the index
+        self.index = ArchiveIndex(self.path)
         logger.debug("Path for archiving is: " + path.join(archivePath, name))
 
     def addFile(self, inFilePath, dirName=None, fileName=None):
@@ -28,18 +58,133 @@ class FoamArchive:
         if not path.exists(inFilePath):
             logger.error("File to be archived does not exist")
             sys.exit(1)
+        packed = self.pack and dirName is not None
         if dirName!=None:
             dirPath = path.join(self.path, dirName)
-            if not path.exists(dirPath):
-                self.execute("mkdir " + dirPath)
+            if not path.exists(dirPath) and not packed:
+                Execution.makeDirs(dirPath)
         else:
             dirPath = self.path
-        resultPath = path.join(dirPath, path.basename(inFilePath))
-        self.execute("cp " + inFilePath + " " + resultPath)
-        if self.compress:
-            tmp = self.execute("gzip -f " + resultPath)
+        baseName = path.basename(inFilePath)
+        # files already written compressed (writeCompression) are copied
+        # as they are, others compressed while copying
+        compress = self.compress and not inFilePath.endswith(".gz")
+        if compress:
+            resultName = baseName + ".gz"
+        else:
+            resultName = baseName
+        # written to a temporary file and renamed, since an archived file
+        # may be shared with other cases by the object store
+        if packed:
+            tmp = tmpPath(path.join(self.path, dirName + "." + resultName))
+        elif self.store is not None:
+            tmp = self.store.tmpPath()
+        else:
+            tmp = tmpPath(path.join(dirPath, resultName))
+        checksum = None
+        if self.arrays:
+            try:
+                with Execution.Timed("fromFoam", inFilePath + " " + tmp) as t:
+                    FieldArray.fromFoam(inFilePath, tmp, self.meshId)
+                    t.outputBytes = os.path.getsize(tmp)
+                resultName = FieldArray.arrayName(baseName)
+            except ValueError as e:
+                logger.warning(
+                    "Archiving %s as text, not a field array: %s" % (
+                        inFilePath, str(e))
+                )
+        if not FieldArray.isFieldArray(resultName):
+            if compress:
+                checksum = Execution.gzipFile(inFilePath, tmp, self.level)
+            else:
+                checksum = Execution.copyFile(inFilePath, tmp)
+        resultPath = path.join(dirPath, resultName)
+        # other versions of the file, e.g. uncompressed, are replaced
+        fieldName = baseName[:-3] if baseName.endswith(".gz") else baseName
+        others = [name for name in [fieldName, fieldName + ".gz",
+                                    FieldArray.arrayName(fieldName)]
+                  if name != resultName]
+        if packed:
+            pack = self.index.pack(dirName)
+            with Execution.Timed("pack", tmp + " " + pack.path) as t:
+                checksum = pack.append(
+                    [(resultName, tmp, checksum)], removed=others
+                )[resultName]
+                t.outputBytes = os.path.getsize(tmp)
+            os.remove(tmp)
+            for name in others:
+                self.index.removeEntry(dirName, name)
+            # files of the directory from before it was packed
+            others.append(resultName)
+        elif self.store is not None:
+            checksum = self.store.put(tmp, checksum)
+            self.store.link(checksum, resultPath)
+        else:
+            os.rename(tmp, resultPath)
+        for name in others:
+            if path.exists(path.join(dirPath, name)):
+                Execution.remove(path.join(dirPath, name))
+                self.index.removeEntry(dirName or "", name)
+        self.index.addEntry(dirName or "", resultName, checksum=checksum)
         logger.debug("Added file: " + inFilePath)
 
+    def addFiles(self, inFilePaths, dirName=None):
+        """copy several files to the archive, in parallel
+        @param inFilePaths: paths to the files to be copied
+        @param dirName: optional name of the directory within the archive to hold the files"""
+        if dirName is not None and not self.pack:
+            Execution.makeDirs(path.join(self.path, dirName))
+        self.map(lambda inFilePath: self.addFile(inFilePath, dirName),
+                 inFilePaths)
+
+    def map(self, func, items):
+        """apply func to all items, using a pool of self.nthreads threads"""
+        items = list(items)
+        nthreads = min(self.nthreads, len(items))
+        if nthreads <= 1:
+            return [func(item) for item in items]
+
+        def call(item):
+            # sys.exit in a worker would leave the pool waiting for it
+            try:
+                return False, func(item)
+            except SystemExit as e:
+                return True, e
+
+        pool = ThreadPool(nthreads)
+        try:
+            results = pool.map(call, items)
+        finally:
+            pool.close()
+            pool.join()
+        for exited, result in results:
+            if exited:
+                raise result
+        return [result for exited, result in results]
+
+    def findFile(self, fileName, dirName=None):
+        """locate an archived file, that may be compressed, a field array
+        or in the pack of the directory
+        @param fileName: name of the file, or of the uncompressed field
+        @param dirName: optional, name of the directory within the archive
+        @return: (name, pack) with the name in the archive and the CasePack
+        holding the file, None if not packed, or None if not found"""
+        if dirName is not None:
+            dirPath = path.join(self.path, dirName)
+        else:
+            dirPath = self.path
+        names = [fileName, fileName + ".gz", FieldArray.arrayName(fileName)]
+        for name in names:
+            if path.exists(path.join(dirPath, name)):
+                return name, None
+        if dirName is not None:
+            pack = self.index.pack(dirName)
+            if pack.exists():
+                for name in names:
+                    if pack.has(name):
+                        return name, pack
+        return None
+
     def getFile(self, outputFile, fileName, archiveDirName=None):
         """copy the specified file from the archive given the specified name
         @param outputFile: name of the field/file to be copied
@@ -52,16 +197,16 @@ class FoamArchive:
         else:
             filePath = path.join(self.path, fileName)
 
-        if path.exists(filePath):
-            compressed = False
-        elif path.exists(filePath + ".gz"):
-            filePath = filePath+".gz"
-            compressed = True
-            if '.gz' not in outputFile:
-                outputFile = outputFile + ".gz"
-        else:
+        found = self.findFile(fileName, archiveDirName)
+        if found is None:
             logger.error("File: " + filePath + " to get from archive does not exist")
             sys.exit(1)
+        name, pack = found
+        filePath = path.join(path.dirname(filePath), name)
+        compressed = name == fileName + ".gz"
+        converted = name != fileName and FieldArray.isFieldArray(name)
+        if compressed and '.gz' not in outputFile:
+            outputFile = outputFile + ".gz"
 
         if not path.exists(path.dirname(outputFile)):
             logger.error(
@@ -69,9 +214,116 @@ class FoamArchive:
                 " when fetching an archived file does not exist"
             )
             sys.exit(1)
-        self.execute("cp " + filePath + " " + outputFile)
         if compressed:
-           tmp = self.execute("gunzip -f "+outputFile)
+            # decompressed while copying
+            if pack is None:
+                Execution.gunzipFile(filePath, outputFile[:-3])
+            else:
+                self.gunzipPacked(pack, name, outputFile[:-3])
+            if path.exists(outputFile):
+                # as gunzip -f, the compressed file is replaced
+                Execution.remove(outputFile)
+        elif converted:
+            # written as text, compressed if outputFile ends with .gz
+            with Execution.Timed("toFoam", filePath + " " + outputFile) as t:
+                self.fieldArray(name, pack, filePath).toFoam(outputFile)
+                t.outputBytes = os.path.getsize(outputFile)
+        elif pack is None:
+            Execution.copyFile(filePath, outputFile)
+        else:
+            with Execution.Timed("unpack", filePath + " " + outputFile) as t:
+                pack.extract(name, outputFile)
+                t.outputBytes = os.path.getsize(outputFile)
+
+    def gunzipPacked(self, pack, name, outputFile):
+        """decompress a packed file, as Execution.gunzipFile"""
+        with Execution.Timed("gunzip", pack.path + " " + outputFile) as t:
+            section = pack.open(name)
+            try:
+                srcFid = gzip.GzipFile(fileobj=section, mode="rb")
+                dstFid = open(outputFile, "wb")
+                try:
+                    shutil.copyfileobj(srcFid, dstFid, Execution.CHUNK_SIZE)
+                finally:
+                    dstFid.close()
+            finally:
+                section.close()
+            t.outputBytes = os.path.getsize(outputFile)
+
+    def fieldArray(self, name, pack, filePath):
+        """FieldArray of an archived field array file, packed or not"""
+        if pack is None:
+            return FieldArray.FieldArray(filePath)
+        return FieldArray.FieldArray(pack.path, pack.entry(name)[0])
+
+    def openFile(self, fileName, archiveDirName=None):
+        """open an archived file for reading, decompressing it if needed
+        @param fileName: name of the file to open
+        @param archiveDirName: name of the directory within the archive containing the file
+        @return: a file object"""
+        if archiveDirName is not None:
+            filePath = path.join(self.path, archiveDirName, fileName)
+        else:
+            filePath = path.join(self.path, fileName)
+
+        found = self.findFile(fileName, archiveDirName)
+        if found is None:
+            logger.error("File: " + filePath + " to open from archive does not exist")
+            sys.exit(1)
+        name, pack = found
+        filePath = path.join(path.dirname(filePath), name)
+        if FieldArray.isFieldArray(name) and name != fileName:
+            return io.BytesIO(
+                self.fieldArray(name, pack, filePath).text().encode("latin-1")
+            )
+        if pack is not None:
+            # read directly from the pack, without extracting the file
+            if name.endswith(".gz"):
+                return gzip.GzipFile(fileobj=pack.open(name), mode="rb")
+            return pack.open(name)
+        if name.endswith(".gz"):
+            return gzip.open(filePath, "rb")
+        return open(filePath, "r")
+
+    def removeDir(self, dirName):
+        """remove a directory and its metadata from the archive
+        @param dirName: name of the directory in the archive"""
+        dirPath = path.join(self.path, dirName)
+        if path.exists(dirPath):
+            shutil.rmtree(dirPath)
+        if path.exists(dirPath + ".meta"):
+            os.remove(dirPath + ".meta")
+        pack = self.index.pack(dirName)
+        if pack.exists():
+            os.remove(pack.path)
+        self.index.removeDir(dirName)
+        logger.debug("Removed directory: " + dirName + " from archive")
+
+    def setMetadata(self, dirName, metadata):
+        """store metadata, e.g. provenance, for a directory in the archive
+        @param dirName: name of the directory in the archive
+        @param metadata: dictionary with values to store"""
+        metaPath = path.join(self.path, dirName + ".meta")
+        fid = open(metaPath, "w")
+        for key in sorted(metadata.keys()):
+            fid.write("%s %s\n" % (key, str(metadata[key])))
+        fid.close()
+
+    def getMetadata(self, dirName):
+        """read metadata for a directory in the archive
+        @param dirName: name of the directory in the archive
+        @return: dictionary with metadata as strings, empty if not given"""
+        metaPath = path.join(self.path, dirName + ".meta")
+        metadata = {}
+        if path.exists(metaPath):
+            fid = open(metaPath, "r")
+            for line in fid:
+                if line.strip() == "":
+                    continue
+                key, value = (line.strip().split(None, 1) + [""])[:2]
+                metadata[key] = value
+            fid.close()
+        return metadata
 
     def inArchive(self, dirName=None, filename=None):
         """Test if a file, directory or a file within a directory exist in the archive
@@ -82,11 +334,17 @@ class FoamArchive:
             return True
         
         if dirName is not None and filename is None:
-            return path.exists(path.join(self.path, dirName))
-        elif filename is not None and dirName is None:
-            return path.exists(path.join(self.path, filename))
-        elif filename is not None and dirName is not None:
-            return path.exists(path.join(self.path, dirName, filename))
+            return self.index.hasDir(dirName)
+        elif filename is not None:
+            # compressed files and field arrays are converted when fetched,
+            # the names are those looked for by findFile
+            if dirName is None:
+                dirName = ""
+            for name in [filename, filename + ".gz",
+                         FieldArray.arrayName(filename)]:
+                if self.index.hasFile(dirName, name):
+                    return True
+            return False
         else:
            raise ValueError('Must specify at least one of dirName and fileName')
 
@@ -101,8 +359,7 @@ class FoamArchive:
 
     def listDirs(self):
         """Returns a list of all directories in archive"""
-        dirs = [d for d in os.listdir(self.path) if path.isdir(path.join(self.path, d))]
-        return dirs
+        return self.index.dirs()
 
     def listFiles(self):
         """Returns a list of all files in archive root directory"""
@@ -111,33 +368,25 @@ class FoamArchive:
     def listFilesInDir(self, dirName):
         """Return a list of files located in a given directory in the archive
         @param dirName: Name of directory in archive"""
-        files=[f for f in os.listdir(path.join(self.path,dirName)) if ".bak" not in f and "~" not in f and "#" not in f]
-        return files
+        return [r[1] for r in self.index.files(dirName)]
 
     def listFilesInDirs(self, prefix=None):
         """Returns a list of all files in directories within the archive
         @param prefix: optional, only list the files with prefix in the filename"""
-        files = []
-        for d in self.listDirs():
-            dirPath = path.join(self.path, d)
-            dirFiles = [path.join(dirPath, f) for f in os.listdir(dirPath) if path.isfile(path.join(dirPath, f))]
-            dirFiles = [f for f in dirFiles if ".bak" not in f and "~" not in f and "#" not in f]
-            if prefix is not None:
-                dirFiles = [f for f in dirFiles if prefix in path.basename(f)]
-            files += dirFiles
-        return files
+        return [
+            path.join(self.path, d, f)
+            for d, f, size, checksum, comp in self.index.files(prefix=prefix)
+            if d != ""
+        ]
 
-    def execute(self, cmd):
-        """Execute the command cmd
+    def setCaseKey(self, dirName, wspeed, wdir, z0=None):
+        """record the case parameters of a directory in the index"""
+        self.index.setCaseKey(dirName, wspeed, wdir, z0)
 
-        Currently no error-handling is done
+    def execute(self, cmd):
+        """Execute the command cmd, recording its metrics, see Execution
         @return: A list with all the output-lines of the execution"""
-        #        print cmd
-
-        rein, raus = popen4(cmd)
-        tmp = raus.readlines()
-
-        return tmp
+        return Execution.run(cmd)
 
     def restore(self, dirName, destinationDir, fileNames=None):
         """Copies the given files from archive to a given directory
@@ -152,7 +401,56 @@ class FoamArchive:
                         fileName, path.join(self.path, dirName))
                     )
         else:
-            fileNames = listdir(path.join(self.path, dirName))
-        for fileName in fileNames:
-            outFile = path.join(destinationDir,fileName)
-            self.getFile(outFile, fileName, dirName)
+            names = []
+            if path.isdir(path.join(self.path, dirName)):
+                names += listdir(path.join(self.path, dirName))
+            pack = self.index.pack(dirName)
+            if pack.exists():
+                names += [n for n in pack.names() if n not in names]
+            # field arrays are restored as fields
+            fileNames = [
+                f[:-len(FieldArray.SUFFIX)] if FieldArray.isFieldArray(f)
+                else f for f in names
+            ]
+        self.map(
+            lambda fileName: self.getFile(
+                path.join(destinationDir, fileName), fileName, dirName
+            ),
+            fileNames
+        )
+
+    def packDir(self, dirName):
+        """move the files of a directory in the archive to its pack
+        @param dirName: name of the directory in the archive"""
+        dirPath = path.join(self.path, dirName)
+        fileNames = [
+            f for f in listdir(dirPath)
+            if isArchived(f) and path.isfile(path.join(dirPath, f))
+        ]
+        pack = self.index.pack(dirName)
+        with Execution.Timed("pack", dirPath + " " + pack.path) as t:
+            checksums = pack.append(
+                [(f, path.join(dirPath, f), None) for f in fileNames]
+            )
+            t.outputBytes = sum(
+                os.path.getsize(path.join(dirPath, f)) for f in fileNames
+            )
+        shutil.rmtree(dirPath)
+        for f in fileNames:
+            self.index.addEntry(dirName, f, checksum=checksums[f])
+        logger.debug("Packed directory: " + dirName)
+
+    def repack(self, dirName=None):
+        """remove replaced and removed files from packs
+        @param dirName: optional, only repack the pack of this directory
+        @return: number of bytes freed"""
+        if dirName is not None:
+            dirNames = [dirName]
+        else:
+            dirNames = self.listDirs()
+        freed = 0
+        for d in dirNames:
+            pack = self.index.pack(d)
+            if pack.exists() and pack.garbage() > 0:
+                freed += pack.repack()
+        return freed
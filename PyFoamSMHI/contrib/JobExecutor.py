@@ -0,0 +1,392 @@
+# -*- coding: us-ascii -*-
+"""Submission of batch jobs to SLURM or to a local process pool."""
+import os
+import sys
+import time
+import signal
+import logging
+import threading
+import subprocess
+import multiprocessing
+
+from PyFoamSMHI.contrib.Sharding import ARRAY_TASK_ENV
+
+log = logging.getLogger(__name__)
+
+# job states, named as in SLURM
+PENDING = "PENDING"
+RUNNING = "RUNNING"
+COMPLETED = "COMPLETED"
+FAILED = "FAILED"
+CANCELLED = "CANCELLED"
+TIMEOUT = "TIMEOUT"
+FINISHED_STATES = [COMPLETED, FAILED, CANCELLED, TIMEOUT]
+
+# dependency types
+AFTER_OK = "afterok"
+AFTER_ANY = "afterany"
+
+CORES_PER_NODE = 16
+
+
+def parseWalltime(walltime):
+    """Seconds of a walltime given as [days-]hours:minutes:seconds,
+    minutes:seconds or minutes"""
+    days = 0
+    if "-" in walltime:
+        days, walltime = walltime.split("-", 1)
+    parts = [int(p) for p in walltime.split(":")]
+    if len(parts) == 1:
+        parts = [0, parts[0], 0]
+    elif len(parts) == 2:
+        parts = [0] + parts
+    hours, minutes, seconds = parts
+    return ((int(days) * 24 + hours) * 60 + minutes) * 60 + seconds
+
+
+class Job:
+    """Description of a batch job"""
+
+    def __init__(self, name, command, script=False, nodes=None, CPUs=None,
+                 walltime=None, mem=None, account=None, array=None,
+                 dependencies=None, dependencyType=AFTER_OK):
+        """@param name: name of the job
+        @param command: command as a list, starting with the batch script
+        if script is True
+        @param script: True if command is a batch script with arguments
+        @param nodes: optional, number of nodes
+        @param CPUs: optional, number of CPUs
+        @param walltime: optional, max run time, e.g. 01:00:00
+        @param mem: optional, memory in MB
+        @param account: optional, account to charge
+        @param array: optional, number of tasks of a job array
+        @param dependencies: ids of jobs to wait for
+        @param dependencyType: afterok or afterany"""
+        self.name = name
+        self.command = command
+        self.script = script
+        self.nodes = nodes
+        self.CPUs = CPUs
+        self.walltime = walltime
+        self.mem = mem
+        self.account = account
+        self.array = array
+        self.dependencies = dependencies or []
+        self.dependencyType = dependencyType
+
+    def cpus(self):
+        """Number of CPUs used by the job"""
+        if self.CPUs is not None:
+            return int(self.CPUs)
+        if self.nodes is not None:
+            return CORES_PER_NODE * int(self.nodes)
+        return 1
+
+
+class JobExecutor:
+    """Interface of job executors"""
+
+    def submit(self, job):
+        """Submit a job
+        @return: id of the job"""
+        raise NotImplementedError
+
+    def status(self, jobId):
+        """State of a job, e.g. PENDING, RUNNING or COMPLETED"""
+        raise NotImplementedError
+
+    def cancel(self, jobId):
+        """Cancel a pending or running job"""
+        raise NotImplementedError
+
+    def wait(self):
+        """Wait for the submitted jobs to finish, if they are run by the
+        submitting process"""
+        pass
+
+
+class SlurmExecutor(JobExecutor):
+    """Submits jobs to SLURM using sbatch"""
+
+    def command(self, job):
+        execList = ["sbatch", "--parsable", "-J", job.name]
+        if job.walltime is not None:
+            execList += ["-t", job.walltime]
+        if job.nodes is not None:
+            execList += ["-N", str(int(job.nodes))]
+        if job.CPUs is not None:
+            execList += ["-n", str(int(job.CPUs))]
+        if job.mem is not None:
+            execList += ["--mem", str(int(job.mem))]
+        if job.account is not None:
+            execList += ["-A", job.account]
+        if job.array is not None:
+            execList.append("--array=0-%i" % (job.array - 1))
+        if len(job.dependencies) > 0:
+            execList.append(
+                "--dependency=" + job.dependencyType + ":" +
+                ":".join(job.dependencies)
+            )
+        if job.script:
+            execList += job.command
+        else:
+            execList += ["--wrap", " ".join(job.command)]
+        return execList
+
+    def submit(self, job):
+        execList = self.command(job)
+        log.info("running: " + " ".join(execList))
+        proc = subprocess.Popen(execList, stdout=subprocess.PIPE)
+        output = proc.communicate()[0]
+        if proc.returncode != 0:
+            raise OSError("Could not submit job %s" % job.name)
+        # parsable output is jobid[;cluster]
+        return output.strip().split(";")[0]
+
+    def status(self, jobId):
+        proc = subprocess.Popen(
+            ["squeue", "-h", "-j", jobId, "-o", "%T"],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        states = proc.communicate()[0].split()
+        if len(states) == 0:
+            # no longer in queue
+            proc = subprocess.Popen(
+                ["sacct", "-n", "-X", "-j", jobId, "-o", "State"],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            )
+            states = proc.communicate()[0].split()
+        if len(states) == 0:
+            return None
+        for state in [RUNNING, PENDING, FAILED, TIMEOUT, CANCELLED]:
+            if state in states:
+                return state
+        return states[0]
+
+    def cancel(self, jobId):
+        subprocess.call(["scancel", jobId])
+
+
+class LocalJob:
+    """A job, or a task of a job array, run by the LocalExecutor"""
+
+    def __init__(self, jobId, job, taskId=None):
+        self.id = jobId
+        self.job = job
+        self.taskId = taskId
+        self.state = PENDING
+        self.process = None
+        self.started = None
+        self.cpus = job.cpus()
+        self.dependencies = []
+
+
+class LocalExecutor(JobExecutor):
+    """Runs jobs as local processes, as a stand-in for SLURM
+
+    Jobs are started when their dependencies are satisfied and enough
+    CPU slots are free. The output of a job is written to
+    <name>-<jobId>.out in the working directory. Tasks of job arrays
+    get their index in the same environment variable as in SLURM."""
+
+    def __init__(self, slots=None, outputDir=None, pollInterval=0.5):
+        """@param slots: number of CPUs to use, default all
+        @param outputDir: directory for job output, default is current
+        @param pollInterval: seconds between checks of running jobs"""
+        if slots is None:
+            slots = multiprocessing.cpu_count()
+        self.slots = int(slots)
+        self.outputDir = outputDir or os.getcwd()
+        self.pollInterval = pollInterval
+        self.jobs = {}
+        self.arrays = {}
+        self.order = []
+        self.nextId = 1
+        self.lock = threading.RLock()
+        self.changed = threading.Condition(self.lock)
+        self.thread = None
+
+    def submit(self, job):
+        with self.lock:
+            jobId = str(self.nextId)
+            self.nextId += 1
+            if job.cpus() > self.slots:
+                log.warning(
+                    "Job %s needs %i CPUs, but only %i are available" % (
+                        job.name, job.cpus(), self.slots)
+                )
+            dependencies = []
+            for depId in job.dependencies:
+                dependencies += self.expand(depId)
+            if job.array is None:
+                tasks = [LocalJob(jobId, job)]
+            else:
+                tasks = [
+                    LocalJob("%s_%i" % (jobId, i), job, taskId=i)
+                    for i in range(job.array)
+                ]
+                self.arrays[jobId] = [task.id for task in tasks]
+            for task in tasks:
+                task.dependencies = dependencies
+                task.cpus = min(task.cpus, self.slots)
+                self.jobs[task.id] = task
+                self.order.append(task.id)
+            log.info("Submitted job %s: %s" % (jobId, job.name))
+            self.schedule()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.monitor)
+                self.thread.daemon = True
+                self.thread.start()
+            self.changed.notify_all()
+        return jobId
+
+    def expand(self, jobId):
+        """Ids of the tasks of a job, i.e. all tasks of an array"""
+        if jobId in self.arrays:
+            return self.arrays[jobId]
+        if jobId not in self.jobs:
+            raise KeyError("No job with id %s" % jobId)
+        return [jobId]
+
+    def status(self, jobId):
+        with self.lock:
+            states = [self.jobs[t].state for t in self.expand(jobId)]
+        for state in [RUNNING, PENDING, FAILED, TIMEOUT, CANCELLED]:
+            if state in states:
+                return state
+        return COMPLETED
+
+    def cancel(self, jobId):
+        with self.lock:
+            for taskId in self.expand(jobId):
+                self.finish(self.jobs[taskId], CANCELLED)
+            self.schedule()
+            self.changed.notify_all()
+
+    def finish(self, task, state):
+        if task.state in FINISHED_STATES:
+            return
+        if task.process is not None and task.process.poll() is None:
+            # kill the process group, including solvers started by it
+            try:
+                os.killpg(task.process.pid, signal.SIGTERM)
+            except OSError:
+                pass
+            task.process.wait()
+        task.state = state
+        log.info("Job %s (%s): %s" % (task.id, task.job.name, state))
+
+    def freeSlots(self):
+        used = sum([
+            task.cpus for task in self.jobs.values() if task.state == RUNNING
+        ])
+        return self.slots - used
+
+    def dependencyState(self, task):
+        """True if dependencies are satisfied, False if they never will
+        be and None if they are not finished"""
+        states = [self.jobs[depId].state for depId in task.dependencies]
+        if len([s for s in states if s not in FINISHED_STATES]) > 0:
+            return None
+        if task.job.dependencyType == AFTER_OK and \
+           len([s for s in states if s != COMPLETED]) > 0:
+            return False
+        return True
+
+    def schedule(self):
+        """Start pending jobs that can run, in order of submission"""
+        for taskId in self.order:
+            task = self.jobs[taskId]
+            if task.state != PENDING:
+                continue
+            ready = self.dependencyState(task)
+            if ready is False:
+                self.finish(task, CANCELLED)
+            elif ready and task.cpus <= self.freeSlots():
+                self.start(task)
+
+    def start(self, task):
+        env = dict(os.environ)
+        command = list(task.job.command)
+        if task.job.script:
+            command = ["bash"] + command
+        if task.taskId is not None:
+            env[ARRAY_TASK_ENV] = str(task.taskId)
+        outputPath = os.path.join(
+            self.outputDir, "%s-%s.out" % (task.job.name, task.id)
+        )
+        output = open(outputPath, "w")
+        try:
+            task.process = subprocess.Popen(
+                command, stdout=output, stderr=subprocess.STDOUT, env=env,
+                preexec_fn=os.setsid
+            )
+        except OSError as e:
+            log.error("Could not start job %s: %s" % (task.id, str(e)))
+            task.state = FAILED
+            return
+        finally:
+            output.close()
+        task.started = time.time()
+        task.state = RUNNING
+        log.info("Started job %s (%s) on %i CPUs" % (
+            task.id, task.job.name, task.cpus))
+
+    def poll(self):
+        """Check running jobs for exit and exceeded walltime"""
+        for task in self.jobs.values():
+            if task.state != RUNNING:
+                continue
+            returncode = task.process.poll()
+            if returncode is not None:
+                if returncode == 0:
+                    self.finish(task, COMPLETED)
+                else:
+                    self.finish(task, FAILED)
+            elif task.job.walltime is not None and \
+                    time.time() - task.started > \
+                    parseWalltime(task.job.walltime):
+                self.finish(task, TIMEOUT)
+
+    def monitor(self):
+        while True:
+            with self.lock:
+                self.poll()
+                self.schedule()
+                self.changed.notify_all()
+                if self.done():
+                    self.thread = None
+                    return
+            time.sleep(self.pollInterval)
+
+    def done(self):
+        return len([
+            t for t in self.jobs.values() if t.state not in FINISHED_STATES
+        ]) == 0
+
+    def wait(self):
+        """Wait for all jobs, cancelling them if interrupted"""
+        try:
+            with self.lock:
+                while not self.done():
+                    # a timeout keeps the wait interruptible
+                    self.changed.wait(1)
+        except KeyboardInterrupt:
+            log.warning("Interrupted, cancelling all jobs")
+            for jobId in list(self.jobs.keys()):
+                self.cancel(jobId)
+            raise
+
+
+EXECUTORS = {"slurm": SlurmExecutor, "local": LocalExecutor}
+
+
+def createExecutor(name, **kwargs):
+    """Create an executor by name, slurm or local"""
+    if name not in EXECUTORS:
+        log.error(
+            "Unknown executor %s, should be one of: %s" % (
+                name, ", ".join(sorted(EXECUTORS.keys())))
+        )
+        sys.exit(1)
+    return EXECUTORS[name](**kwargs)
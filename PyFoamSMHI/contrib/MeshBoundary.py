@@ -0,0 +1,374 @@
+# -*- coding: us-ascii -*-
+"""Classification of lateral boundary patches as inlet, outlet or side
+from their face normals and the wind direction."""
+import os
+import re
+import math
+import logging
+import threading
+from os import path
+
+from PyFoamSMHI.contrib.FieldFile import (
+    openBinary, matchingBrace, skipSpace, CHUNK_SIZE
+)
+
+log = logging.getLogger(__name__)
+
+# patches of these types are classified, others (walls, symmetry planes
+# etc.) are left as they are
+LATERAL_TYPES = ["patch"]
+# max vertical component of the unit normal of a lateral patch
+MAX_VERTICAL = 0.5
+# max deviation (degrees) from perpendicular to the flow for side patches
+SIDE_ANGLE = 0.5
+# min ratio of the area of the mean normal to the patch area, below which
+# the patch is too curved for a single role
+MIN_FLATNESS = 0.5
+
+ENTRY_EXP = re.compile(r"(\w+)\s+([^;]+);")
+# items skipped by searching for each one, more are skipped by splitting
+SKIP_FIND = 1000
+# the FoamFile header is looked for in the first bytes of a file
+HEADER_SIZE = 4096
+
+# normals per mesh, as {files: (state, normals)}, see meshState
+_normalCache = {}
+_cacheLock = threading.Lock()
+
+
+def flowVector(wdir):
+    """Unit vector of the flow for a wind direction, where the direction
+    is where the wind blows from, clockwise from north (y-axis)"""
+    wdirRadians = math.pi / 180 * (90. - wdir)
+    return (-math.cos(wdirRadians), -math.sin(wdirRadians), 0.0)
+
+
+def meshFile(meshDir, name):
+    """Path of a mesh file, compressed or not"""
+    filePath = path.join(meshDir, name)
+    if not path.exists(filePath) and path.exists(filePath + ".gz"):
+        return filePath + ".gz"
+    return filePath
+
+
+def parseHeader(text, filePath):
+    """Class of a mesh file in the FoamFile header at the start of text
+    @return: class of the file and the position after the header"""
+    fileClass = None
+    pos = skipSpace(text, 0)
+    if text.startswith("FoamFile", pos):
+        headerEnd = matchingBrace(text, text.index("{", pos))
+        header = text[pos:headerEnd]
+        if re.search(r"\bformat\s+binary\s*;", header):
+            raise ValueError("Binary mesh file not supported: " + filePath)
+        match = re.search(r"\bclass\s+(\w+)\s*;", header)
+        if match is not None:
+            fileClass = match.group(1)
+        pos = headerEnd
+    return fileClass, pos
+
+
+def readMeshFile(filePath):
+    """Text of a mesh file after the FoamFile header
+    @return: class of the file and the text"""
+    fid = openBinary(filePath)
+    try:
+        text = fid.read().decode("latin-1")
+    finally:
+        fid.close()
+    fileClass, pos = parseHeader(text, filePath)
+    return fileClass, text[pos:]
+
+
+class ListStream:
+    """The list of a mesh file in ascii format, read in chunks
+
+    Items are skipped by counting the parentheses closing them, or the
+    values of a list of labels, without parsing them, so that only the
+    items needed are converted and kept in memory."""
+
+    def __init__(self, filePath):
+        self.path = filePath
+        self.fid = openBinary(filePath)
+        self.data = b""
+        self.pos = 0
+        # the header is assumed to be in the first bytes of the file
+        while len(self.data) < HEADER_SIZE and self.fill():
+            pass
+        self.fileClass, self.pos = parseHeader(
+            self.data.decode("latin-1"), filePath
+        )
+
+    def close(self):
+        self.fid.close()
+
+    def fill(self):
+        """Read the next chunk, dropping the data before the position
+        @return: False at the end of the file"""
+        chunk = self.fid.read(CHUNK_SIZE)
+        if not chunk:
+            return False
+        self.data = self.data[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def find(self, sub):
+        """Position of the next sub, reading chunks as needed"""
+        while True:
+            i = self.data.find(sub, self.pos)
+            if i != -1:
+                return i
+            if not self.fill():
+                raise ValueError("Unexpected end of file: " + self.path)
+
+    def openList(self):
+        """Move to the first item of the next list"""
+        self.pos = self.find(b"(") + 1
+
+    def closeList(self):
+        """Move past the end of a list of labels"""
+        self.pos = self.find(b")") + 1
+
+    def skipItems(self, n):
+        """Skip items ending with a parenthesis, e.g. faces or points"""
+        while n > 0:
+            if n <= SKIP_FIND:
+                self.pos = self.find(b")") + 1
+                n -= 1
+                continue
+            count = self.data.count(b")", self.pos)
+            if count >= n:
+                pieces = self.data[self.pos:].split(b")", n)[:n]
+                self.pos += sum(len(p) for p in pieces) + n
+                return
+            n -= count
+            self.pos = len(self.data)
+            if not self.fill():
+                raise ValueError("Unexpected end of file: " + self.path)
+
+    def readItem(self):
+        """Text of the next item ending with a parenthesis, without it"""
+        end = self.find(b")")
+        item = self.data[self.pos:end]
+        self.pos = end + 1
+        return item
+
+    def labels(self, n, keep=True):
+        """Read or skip the next n values of a list of labels
+        @return: list of the labels, empty if not kept"""
+        labels = []
+        while n > 0:
+            end = self.data.find(b")", self.pos)
+            if end == -1:
+                # a label may continue in the next chunk
+                end = max(
+                    self.data.rfind(b" ", self.pos),
+                    self.data.rfind(b"\n", self.pos)
+                )
+            parts = self.data[self.pos:max(end, self.pos)].split(None, n)
+            if len(parts) > n:
+                self.pos = end - len(parts[n])
+                parts = parts[:n]
+            elif end > self.pos:
+                self.pos = end
+            n -= len(parts)
+            if keep:
+                labels.extend(int(v) for v in parts)
+            if n > 0 and (self.data.startswith(b")", self.pos) or
+                          not self.fill()):
+                raise ValueError("Too few labels in " + self.path)
+        return labels
+
+
+def listBody(text, pos=0):
+    """Text of the first list in text and the position after it"""
+    start = text.index("(", pos)
+    depth = 0
+    for i in range(start, len(text)):
+        c = text[i]
+        if c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+            if depth == 0:
+                return text[start + 1:i], i + 1
+    raise ValueError("Unbalanced list")
+
+
+def readBoundary(meshDir):
+    """Patches of the boundary file of a mesh
+    @return: list of (name, entries), where entries is a dict"""
+    text = readMeshFile(meshFile(meshDir, "boundary"))[1]
+    body = listBody(text)[0]
+    patches = []
+    pos = 0
+    while True:
+        pos = skipSpace(body, pos)
+        brace = body.find("{", pos)
+        if brace == -1:
+            break
+        name = body[pos:brace].strip().strip('"')
+        end = matchingBrace(body, brace)
+        entries = dict(
+            (m.group(1), m.group(2).strip())
+            for m in ENTRY_EXP.finditer(body[brace + 1:end - 1])
+        )
+        patches.append((name, entries))
+        pos = end
+    return patches
+
+
+def readPoints(meshDir, labels):
+    """Points of a mesh, only those with the given labels are parsed
+    @return: dict with (x, y, z) per label"""
+    stream = ListStream(meshFile(meshDir, "points"))
+    points = {}
+    try:
+        stream.openList()
+        current = 0
+        for label in sorted(set(labels)):
+            stream.skipItems(label - current)
+            x, y, z = stream.readItem().replace(b"(", b" ").split()
+            points[label] = (float(x), float(y), float(z))
+            current = label + 1
+    finally:
+        stream.close()
+    return points
+
+
+def readFaces(meshDir, start, count):
+    """Faces of a mesh as lists of point labels, the faces before start
+    are skipped without being parsed
+    @param start: index of the first face, e.g. the first boundary face
+    @param count: number of faces to read"""
+    stream = ListStream(meshFile(meshDir, "faces"))
+    try:
+        stream.openList()
+        if stream.fileClass == "faceCompactList":
+            stream.labels(start, keep=False)
+            offsets = stream.labels(count + 1)
+            stream.closeList()
+            stream.openList()
+            stream.labels(offsets[0], keep=False)
+            labels = stream.labels(offsets[-1] - offsets[0])
+            return [
+                labels[offsets[i] - offsets[0]:offsets[i + 1] - offsets[0]]
+                for i in range(count)
+            ]
+        stream.skipItems(start)
+        faces = []
+        for i in range(count):
+            labels = stream.readItem().split(b"(")[1]
+            faces.append([int(v) for v in labels.split()])
+        return faces
+    finally:
+        stream.close()
+
+
+def faceAreaVector(points):
+    """Area vector of a polygon, pointing as given by the right hand rule"""
+    ax = ay = az = 0.0
+    n = len(points)
+    for i in range(n):
+        x1, y1, z1 = points[i]
+        x2, y2, z2 = points[(i + 1) % n]
+        ax += y1 * z2 - z1 * y2
+        ay += z1 * x2 - x1 * z2
+        az += x1 * y2 - y1 * x2
+    return 0.5 * ax, 0.5 * ay, 0.5 * az
+
+
+def meshState(meshDir):
+    """Identity of the mesh files, shared by hard linked copies of the
+    mesh, and their state, changed when they are written
+    @return: (files, state)"""
+    stats = [
+        os.stat(meshFile(meshDir, name))
+        for name in ["boundary", "points", "faces"]
+    ]
+    return (
+        tuple((st.st_dev, st.st_ino) for st in stats),
+        tuple((st.st_size, st.st_mtime) for st in stats)
+    )
+
+
+def patchNormals(meshDir):
+    """Mean outward unit normal of the lateral patches of a mesh, cached
+    as long as the mesh files are unchanged
+    @return: dict with (nx, ny, nz) per patch"""
+    key, state = meshState(meshDir)
+    with _cacheLock:
+        cached = _normalCache.get(key)
+    if cached is not None and cached[0] == state:
+        return cached[1]
+
+    patches = [
+        (name, entries) for name, entries in readBoundary(meshDir)
+        if entries.get("type") in LATERAL_TYPES and
+        int(entries.get("nFaces", 0)) > 0
+    ]
+    normals = {}
+    if len(patches) > 0:
+        # only the faces of the lateral patches and their points are read
+        firstFace = min(int(e["startFace"]) for name, e in patches)
+        endFace = max(
+            int(e["startFace"]) + int(e["nFaces"]) for name, e in patches
+        )
+        faces = readFaces(meshDir, firstFace, endFace - firstFace)
+        points = readPoints(meshDir, [p for face in faces for p in face])
+        for name, entries in patches:
+            start = int(entries["startFace"]) - firstFace
+            sx = sy = sz = area = 0.0
+            for face in faces[start:start + int(entries["nFaces"])]:
+                ax, ay, az = faceAreaVector([points[p] for p in face])
+                sx += ax
+                sy += ay
+                sz += az
+                area += math.sqrt(ax * ax + ay * ay + az * az)
+            norm = math.sqrt(sx * sx + sy * sy + sz * sz)
+            if norm == 0:
+                log.warning("Patch %s has no mean normal, skipping" % name)
+                continue
+            if norm < MIN_FLATNESS * area:
+                log.warning(
+                    "Patch %s is curved, its role is taken from its mean "
+                    "normal" % name
+                )
+            normals[name] = (sx / norm, sy / norm, sz / norm)
+    with _cacheLock:
+        _normalCache[key] = (state, normals)
+    return normals
+
+
+def classify(normal, flow, sideAngle=SIDE_ANGLE):
+    """Role of a patch, inlet, outlet or side, from its outward normal
+    and the flow vector, using horizontal components only"""
+    nx, ny = normal[:2]
+    length = math.sqrt(nx * nx + ny * ny)
+    cosine = (nx * flow[0] + ny * flow[1]) / length
+    if abs(cosine) <= math.sin(math.radians(sideAngle)):
+        return "side"
+    if cosine < 0:
+        return "inlet"
+    return "outlet"
+
+
+def patchRoles(meshDir, wdir, sideAngle=SIDE_ANGLE):
+    """Role of the lateral patches of a mesh for a wind direction
+    Lateral patches are patches of the types in LATERAL_TYPES with mostly
+    horizontal normals. Flow entering through a patch makes it an inlet,
+    flow leaving an outlet and flow along it a side.
+    @param meshDir: polyMesh directory
+    @param wdir: wind direction in degrees, any value
+    @param sideAngle: max deviation from perpendicular to the flow, in
+    degrees, for patches to be sides
+    @return: dict with inlet, outlet or side per patch"""
+    flow = flowVector(wdir)
+    roles = {}
+    for name, normal in patchNormals(meshDir).items():
+        if abs(normal[2]) > MAX_VERTICAL:
+            continue
+        roles[name] = classify(normal, flow, sideAngle)
+    if len(roles) == 0:
+        raise ValueError("No lateral patches found in " + meshDir)
+    return roles
@@ -0,0 +1,146 @@
+# -*- coding: us-ascii -*-
+"""Content-addressed store of archived files, shared by hard links."""
+import os
+import time
+import errno
+import shutil
+import logging
+import tempfile
+from os import path
+
+from PyFoamSMHI.contrib.Snapshot import fileHash, linkFile
+
+log = logging.getLogger(__name__)
+
+# default name of the store directory, next to the archives sharing it
+STORE_DIR = ".objects"
+# objects linked or added less than this many seconds ago are kept by
+# collect, since they may be about to be referenced
+GC_GRACE_SECONDS = 3600.0
+
+
+class ObjectStore:
+    """Files stored once per content, named by their content hash
+
+    Archives reference an object by a hard link from their case
+    directories, so that archived files are still plain files to readers,
+    e.g. getFile, archiveToRuntime or OpenFOAM itself. Identical files in
+    several cases or archives are stored once. An object that is no longer
+    linked from any archive is removed by collect.
+
+    Objects are never modified in place. Files are written to a temporary
+    file in the store and then moved into place by put."""
+
+    def __init__(self, storePath):
+        """@param storePath: the store directory, created if missing"""
+        self.path = storePath
+        self.tmpDir = path.join(storePath, "tmp")
+        if not path.exists(self.tmpDir):
+            try:
+                os.makedirs(self.tmpDir)
+            except OSError as e:
+                # created by another process meanwhile
+                if e.errno != errno.EEXIST:
+                    raise
+
+    def objectPath(self, checksum):
+        return path.join(self.path, checksum[:2], checksum[2:])
+
+    def has(self, checksum):
+        return path.exists(self.objectPath(checksum))
+
+    def tmpPath(self):
+        """Path of a new temporary file in the store, for files to put"""
+        fd, tmp = tempfile.mkstemp(dir=self.tmpDir)
+        os.close(fd)
+        return tmp
+
+    def put(self, filePath, checksum=None):
+        """Move a file into the store, or remove it if the content is
+        already stored
+        @param checksum: optional, computed from the file if not given
+        @return: the checksum"""
+        if checksum is None:
+            checksum = fileHash(filePath)
+        objPath = self.objectPath(checksum)
+        if path.exists(objPath):
+            os.remove(filePath)
+            # the object is in use again, keep it from collect
+            os.utime(objPath, None)
+            return checksum
+        objDir = path.dirname(objPath)
+        if not path.exists(objDir):
+            try:
+                os.mkdir(objDir)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        os.rename(filePath, objPath)
+        return checksum
+
+    def link(self, checksum, dst):
+        """Replace dst with a reference to an object"""
+        linkFile(self.objectPath(checksum), dst)
+
+    def adopt(self, filePath):
+        """Deduplicate a file already in an archive, by replacing it with a
+        reference to the stored object of its content
+        @return: True if the content was already stored"""
+        checksum = fileHash(filePath)
+        objPath = self.objectPath(checksum)
+        if path.exists(objPath):
+            if not path.samefile(objPath, filePath):
+                self.link(checksum, filePath)
+            return True
+        tmp = self.tmpPath()
+        os.remove(tmp)
+        try:
+            os.link(filePath, tmp)
+        except OSError:
+            shutil.copyfile(filePath, tmp)
+        self.put(tmp, checksum)
+        if not path.samefile(objPath, filePath):
+            self.link(checksum, filePath)
+        return False
+
+    def objects(self):
+        """Checksums of all stored objects"""
+        checksums = []
+        for d in os.listdir(self.path):
+            dirPath = path.join(self.path, d)
+            if len(d) != 2 or not path.isdir(dirPath):
+                continue
+            checksums += [d + f for f in os.listdir(dirPath)]
+        return checksums
+
+    def stats(self):
+        """@return: number of objects and their total size in bytes"""
+        nbytes = 0
+        checksums = self.objects()
+        for checksum in checksums:
+            nbytes += os.path.getsize(self.objectPath(checksum))
+        return len(checksums), nbytes
+
+    def collect(self, grace=GC_GRACE_SECONDS):
+        """Remove objects that are not referenced by any archive, and
+        temporary files left by interrupted writes
+        @param grace: objects and files changed more recently are kept
+        @return: number of objects removed and their size in bytes"""
+        limit = time.time() - grace
+        removed = 0
+        nbytes = 0
+        for checksum in self.objects():
+            objPath = self.objectPath(checksum)
+            st = os.stat(objPath)
+            if st.st_nlink > 1 or max(st.st_mtime, st.st_ctime) > limit:
+                continue
+            os.remove(objPath)
+            removed += 1
+            nbytes += st.st_size
+        for f in os.listdir(self.tmpDir):
+            tmp = path.join(self.tmpDir, f)
+            if os.stat(tmp).st_mtime < limit:
+                os.remove(tmp)
+        log.info("Removed %i unreferenced objects, %i bytes" % (
+            removed, nbytes))
+        return removed, nbytes
@@ -0,0 +1,91 @@
+# -*- coding: us-ascii -*-
+"""Background post-processing of finished cases in a sweep."""
+import sys
+import logging
+import threading
+import traceback
+from Queue import Queue
+
+log = logging.getLogger(__name__)
+
+
+class PostProcessingPipeline:
+    """Runs post-processing jobs of finished cases in a pool of threads
+
+    Jobs are put on a bounded queue, submitting a job blocks while the
+    queue is full. Failed jobs are collected and reported when the
+    pipeline is closed, so that no case is lost silently."""
+
+    def __init__(self, nworkers=1, maxQueued=None):
+        """@param nworkers: number of worker threads, with 0 the jobs are
+        run directly when submitted
+        @param maxQueued: optional, max number of jobs waiting in queue,
+        default is the number of workers"""
+        self.nworkers = max(0, int(nworkers))
+        if maxQueued is None:
+            maxQueued = max(1, self.nworkers)
+        self.queue = Queue(maxsize=int(maxQueued))
+        self.failures = []
+        self.finished = []
+        self.lock = threading.Lock()
+        self.threads = []
+        for i in range(self.nworkers):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def _run(self, name, func, args):
+        try:
+            func(*args)
+        except BaseException:
+            # also catches sys.exit called from within the job
+            error = traceback.format_exc()
+            log.error("Post-processing of %s failed:\n%s" % (name, error))
+            with self.lock:
+                self.failures.append((name, error))
+        else:
+            with self.lock:
+                self.finished.append(name)
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            self._run(*job)
+
+    def submit(self, name, func, *args):
+        """Add a job to the pipeline
+        @param name: name of the job, used when reporting
+        @param func: function to call
+        @param args: arguments for func"""
+        if self.nworkers == 0:
+            self._run(name, func, args)
+        else:
+            log.debug("Queueing post-processing of %s" % name)
+            self.queue.put((name, func, args))
+
+    def close(self):
+        """Wait for all jobs to finish and stop the worker threads
+        @return: list of (name, traceback) for failed jobs"""
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        return self.failures
+
+    def closeOrExit(self):
+        """Like close, but reports failures and exits if any job failed"""
+        failures = self.close()
+        if len(failures) > 0:
+            log.error(
+                "Post-processing failed for %i case(s):" % len(failures)
+            )
+            for name, error in failures:
+                log.error("  " + name)
+            sys.exit(1)
+        log.info(
+            "Post-processing finished for %i case(s)" % len(self.finished)
+        )
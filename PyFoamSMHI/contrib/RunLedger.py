@@ -0,0 +1,242 @@
+# -*- coding: us-ascii -*-
+"""Persistent ledger of run cases, used to predict run times."""
+import time
+import logging
+import sqlite3
+import threading
+from os import path
+
+log = logging.getLogger(__name__)
+
+LEDGER_FILE = "runLedger.sqlite"
+
+# number of recent cases used when predicting run times
+HISTORY = 50
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS sweeps (
+        id INTEGER PRIMARY KEY,
+        runner TEXT,
+        started REAL,
+        nprocesses INTEGER,
+        workers INTEGER,
+        iterations INTEGER,
+        nruns INTEGER
+    )""",
+    """CREATE TABLE IF NOT EXISTS cases (
+        id INTEGER PRIMARY KEY,
+        sweep INTEGER,
+        caseName TEXT,
+        wspeed REAL,
+        wdir REAL,
+        iterations INTEGER,
+        stopReason TEXT,
+        wallTime REAL,
+        finished REAL
+    )""",
+    """CREATE TABLE IF NOT EXISTS stages (
+        id INTEGER PRIMARY KEY,
+        sweep INTEGER,
+        caseName TEXT,
+        stage TEXT,
+        seconds REAL
+    )"""
+]
+
+
+def median(values):
+    values = sorted(values)
+    n = len(values)
+    if n == 0:
+        return None
+    if n % 2 == 1:
+        return values[n // 2]
+    return 0.5 * (values[n // 2 - 1] + values[n // 2])
+
+
+def formatWalltime(seconds):
+    """Format seconds as a walltime for sbatch, e.g. 1-02:30:00"""
+    seconds = int(seconds + 0.5)
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    walltime = "%02i:%02i:%02i" % (hours, minutes, seconds)
+    if days > 0:
+        walltime = "%i-%s" % (days, walltime)
+    return walltime
+
+
+class StageTimer:
+    """Measures the wall time of consecutive stages of a case"""
+
+    def __init__(self):
+        self.stages = []
+        self.current = None
+        self.started = time.time()
+
+    def start(self, stage):
+        """Start timing a stage, the current stage is stopped"""
+        self.stop()
+        self.current = (stage, time.time())
+
+    def stop(self):
+        if self.current is not None:
+            stage, started = self.current
+            self.stages.append((stage, time.time() - started))
+            self.current = None
+
+    def total(self):
+        return time.time() - self.started
+
+
+class RunLedger:
+    """SQLite ledger with the parameters and stage timings of all cases
+    run in a case directory, across sweeps
+
+    A connection is opened for each operation, so that the ledger can
+    be used from several threads and processes."""
+
+    def __init__(self, casePath, fileName=LEDGER_FILE):
+        """@param casePath: case directory to keep the ledger in
+        @param fileName: name of the ledger file"""
+        self.path = path.join(casePath, fileName)
+        self.lock = threading.Lock()
+        self.sweep = None
+        self.runner = None
+        self.procsPerWorker = None
+        self.workers = 1
+        self.execute(SCHEMA)
+
+    def execute(self, statements, fetch=False):
+        """Execute a list of statements or (statement, parameters)
+        @param fetch: if True, rows of the last statement are returned"""
+        with self.lock:
+            con = sqlite3.connect(self.path, timeout=60)
+            try:
+                cur = con.cursor()
+                for statement in statements:
+                    if isinstance(statement, tuple):
+                        cur.execute(*statement)
+                    else:
+                        cur.execute(statement)
+                if fetch:
+                    rows = cur.fetchall()
+                else:
+                    rows = cur.lastrowid
+                con.commit()
+            finally:
+                con.close()
+        return rows
+
+    def startSweep(self, runner, nprocesses, workers, iterations, nruns):
+        """Add a sweep to the ledger, cases added are part of this sweep
+        @param runner: name of the runner, e.g. windRunner
+        @param nprocesses: total number of processes of the sweep
+        @param workers: number of cases run simultaneously
+        @param iterations: max number of iterations per case
+        @param nruns: number of cases in the sweep"""
+        self.runner = runner
+        self.workers = max(1, int(workers))
+        self.procsPerWorker = max(1, int(nprocesses) // self.workers)
+        self.sweep = self.execute([(
+            "INSERT INTO sweeps " +
+            "(runner, started, nprocesses, workers, iterations, nruns) " +
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (runner, time.time(), int(nprocesses), int(workers),
+             int(iterations), int(nruns))
+        )])
+        return self.sweep
+
+    def addCase(self, caseName, wspeed, wdir, iterations, stopReason,
+                timer):
+        """Add a finished case with the timings of its stages
+        @param iterations: number of iterations actually run
+        @param stopReason: why the solver stopped
+        @param timer: StageTimer of the case"""
+        timer.stop()
+        statements = [(
+            "INSERT INTO cases " +
+            "(sweep, caseName, wspeed, wdir, iterations, stopReason, " +
+            "wallTime, finished) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (self.sweep, caseName, wspeed, wdir, int(iterations),
+             stopReason, timer.total(), time.time())
+        )]
+        for stage, seconds in timer.stages:
+            statements.append(self.stageStatement(caseName, stage, seconds))
+        self.execute(statements)
+
+    def addStage(self, caseName, stage, seconds):
+        """Add the timing of a stage run separately from the case, e.g.
+        post-processing in the background"""
+        self.execute([self.stageStatement(caseName, stage, seconds)])
+
+    def stageStatement(self, caseName, stage, seconds):
+        return (
+            "INSERT INTO stages (sweep, caseName, stage, seconds) " +
+            "VALUES (?, ?, ?, ?)",
+            (self.sweep, caseName, stage, seconds)
+        )
+
+    def history(self, runner):
+        """Recent cases of a runner as tuples of
+        (procsPerWorker, iterations, wallTime, solveTime)"""
+        return self.execute([(
+            "SELECT sweeps.nprocesses / MAX(sweeps.workers, 1), " +
+            "cases.iterations, cases.wallTime, " +
+            "(SELECT SUM(stages.seconds) FROM stages " +
+            "WHERE stages.sweep = cases.sweep " +
+            "AND stages.caseName = cases.caseName " +
+            "AND stages.stage = 'solve') " +
+            "FROM cases JOIN sweeps ON cases.sweep = sweeps.id " +
+            "WHERE sweeps.runner = ? ORDER BY cases.finished DESC LIMIT ?",
+            (runner, HISTORY)
+        )], fetch=True)
+
+    def predictCaseTime(self, runner, procsPerWorker, iterations):
+        """Predict the wall time of a case from the recorded cases
+        The time is modelled as a fixed overhead plus a time per
+        iteration. Cases run with the same number of processes are
+        preferred, otherwise the time per iteration is scaled assuming
+        linear speed-up.
+        @param runner: name of the runner
+        @param procsPerWorker: number of processes used for each case
+        @param iterations: number of iterations of the case
+        @return: predicted time in seconds, None if there is no history"""
+        rows = [
+            row for row in self.history(runner)
+            if row[1] > 0 and row[3] is not None
+        ]
+        if len(rows) == 0:
+            return None
+        sameProcs = [row for row in rows if row[0] == procsPerWorker]
+        if len(sameProcs) > 0:
+            rows = sameProcs
+        overhead = median([wallTime - solveTime
+                           for procs, its, wallTime, solveTime in rows])
+        perIteration = median([
+            solveTime / its * procs / float(procsPerWorker)
+            for procs, its, wallTime, solveTime in rows
+        ])
+        return max(0.0, overhead) + perIteration * iterations
+
+    def predictSweepTime(self, runner, nprocesses, workers, iterations,
+                         nruns):
+        """Predict the wall time of running nruns cases
+        @return: predicted time in seconds, None if there is no history"""
+        workers = max(1, int(workers))
+        procsPerWorker = max(1, int(nprocesses) // workers)
+        caseTime = self.predictCaseTime(runner, procsPerWorker, iterations)
+        if caseTime is None:
+            return None
+        # cases are run in batches of one case per worker
+        batches = (int(nruns) + workers - 1) // workers
+        return batches * caseTime
+
+    def predictRemaining(self, casesLeft, iterations):
+        """Predict the remaining time of the current sweep"""
+        caseTime = self.predictCaseTime(
+            self.runner, self.procsPerWorker, iterations
+        )
+        if caseTime is None:
+            return None
+        return (casesLeft + self.workers - 1) // self.workers * caseTime
@@ -0,0 +1,57 @@
+# -*- coding: us-ascii -*-
+"""Splitting of a sweep into shards run as separate jobs."""
+import os
+import glob
+import logging
+from os import path
+
+log = logging.getLogger(__name__)
+
+# environment variable holding the index of a task in a SLURM job array
+ARRAY_TASK_ENV = "SLURM_ARRAY_TASK_ID"
+
+
+def shardIndex(shard, nshards):
+    """Index of the shard to run
+    @param shard: index given on the command line, or None
+    @param nshards: number of shards the sweep is split in
+    @return: the shard index, taken from the job array task id if not
+    given, or None if the sweep is not sharded"""
+    if shard is None and nshards > 1 and ARRAY_TASK_ENV in os.environ:
+        shard = int(os.environ[ARRAY_TASK_ENV])
+    if shard is not None and not 0 <= shard < nshards:
+        raise ValueError(
+            "Shard index %i out of range for %i shards" % (shard, nshards)
+        )
+    return shard
+
+
+def shardPath(casePath, shard):
+    """Path of the cloned case directory of a shard"""
+    return "%s_shard%i" % (casePath.rstrip(os.sep), shard)
+
+
+def shardPaths(casePath):
+    """Paths of all existing shard case directories of a case"""
+    return sorted(glob.glob(shardPath(casePath, 0)[:-1] + "[0-9]*"))
+
+
+def shardDirections(wdirs, shard, nshards):
+    """Wind directions run in a shard
+    The sweep is split by wind direction, so that all wind speeds of a
+    direction are run in the same shard, where they can warm-start from
+    or be scaled from each other."""
+    if shard is None:
+        return list(wdirs)
+    return [wdir for i, wdir in enumerate(wdirs) if i % nshards == shard]
+
+
+def createShard(caseHandler, shard):
+    """Clone a case to run a shard in, if not already done
+    @return: path of the shard case directory"""
+    clonePath = shardPath(caseHandler.name, shard)
+    if not path.exists(clonePath):
+        log.info("Creating case directory for shard %i: %s" % (
+            shard, clonePath))
+        caseHandler.createWorkingCopy(clonePath)
+    return clonePath
@@ -0,0 +1,228 @@
+# -*- coding: us-ascii -*-
+"""Snapshots of directories of field files, restored by content hash."""
+import os
+import errno
+import shutil
+import hashlib
+import logging
+from os import path
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+MANIFEST = ".manifest"
+CHUNK_SIZE = 1024 * 1024
+# ioctl to clone a file sharing its extents (copy-on-write) on Linux
+FICLONE = 0x40049409
+
+
+def fileHash(filePath):
+    """Content hash of a file"""
+    digest = hashlib.sha1()
+    fid = open(filePath, "rb")
+    try:
+        while True:
+            data = fid.read(CHUNK_SIZE)
+            if not data:
+                break
+            digest.update(data)
+    finally:
+        fid.close()
+    return digest.hexdigest()
+
+
+def fileState(filePath):
+    """Signature of a file that changes when the file is written"""
+    st = os.stat(filePath)
+    return "%i:%r:%r:%i" % (st.st_size, st.st_mtime, st.st_ctime, st.st_ino)
+
+
+def tmpPath(filePath):
+    return path.join(
+        path.dirname(filePath), "." + path.basename(filePath) + ".tmp"
+    )
+
+
+def reflink(src, dst):
+    """Clone src to dst sharing the data on disk, if the file system
+    supports it
+    @return: True if cloned"""
+    if fcntl is None:
+        return False
+    srcFid = open(src, "rb")
+    try:
+        dstFid = open(dst, "wb")
+        try:
+            fcntl.ioctl(dstFid.fileno(), FICLONE, srcFid.fileno())
+        except (IOError, OSError):
+            dstFid.close()
+            os.remove(dst)
+            return False
+        dstFid.close()
+    finally:
+        srcFid.close()
+    return True
+
+
+def cloneFile(src, dst):
+    """Replace dst with a copy of src that can be modified independently,
+    a reflink if possible, otherwise a full copy"""
+    tmp = tmpPath(dst)
+    if not reflink(src, tmp):
+        shutil.copyfile(src, tmp)
+    shutil.copymode(src, tmp)
+    os.rename(tmp, dst)
+
+
+def linkFile(src, dst):
+    """Replace dst with a hard link to src, or a clone if linking fails
+    Only for files that are never modified in place."""
+    # renaming a link over another link to the same file does nothing
+    if path.exists(dst) and path.samefile(src, dst):
+        return
+    tmp = tmpPath(dst)
+    try:
+        if path.exists(tmp):
+            os.remove(tmp)
+        os.link(src, tmp)
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK,
+                           errno.ENOTSUP):
+            raise
+        cloneFile(src, dst)
+        return
+    os.rename(tmp, dst)
+
+
+def linkTree(src, dst):
+    """Create dst with the directories of src and hard links to its
+    files, see linkFile. Only for files that are never modified in place,
+    e.g. the mesh of a case during a sweep."""
+    for dirPath, dirNames, fileNames in os.walk(src):
+        dstDir = path.join(dst, path.relpath(dirPath, src))
+        if not path.exists(dstDir):
+            os.makedirs(dstDir)
+        for f in fileNames:
+            linkFile(path.join(dirPath, f), path.join(dstDir, f))
+
+
+def isField(f):
+    return ".bak" not in f and f[0] not in "#." and "~" not in f
+
+
+class Snapshot:
+    """A snapshot of the files of a directory
+
+    Files in the snapshot are never modified in place, new versions
+    replace them by rename. They can therefore be shared by hard links,
+    e.g. between the snapshots of working copies of a case. Restored
+    files are reflinks where the file system supports it, otherwise
+    copies, so that they can be modified without changing the snapshot.
+
+    The manifest holds the content hash of each file in the snapshot and
+    the state of the file when it was last taken or restored, so that
+    restore only writes files that have been changed since."""
+
+    def __init__(self, snapshotPath):
+        self.path = snapshotPath
+        self.manifestPath = path.join(snapshotPath, MANIFEST)
+
+    def readManifest(self):
+        """@return: dict with (hash, state of restored file) per file"""
+        manifest = {}
+        if not path.exists(self.manifestPath):
+            return manifest
+        fid = open(self.manifestPath, "r")
+        try:
+            for line in fid:
+                parts = line.split()
+                if len(parts) == 3:
+                    manifest[parts[0]] = (parts[1], parts[2])
+        finally:
+            fid.close()
+        return manifest
+
+    def writeManifest(self, manifest):
+        tmp = tmpPath(self.manifestPath)
+        fid = open(tmp, "w")
+        try:
+            for name in sorted(manifest.keys()):
+                fid.write("%s %s %s\n" % ((name,) + manifest[name]))
+        finally:
+            fid.close()
+        os.rename(tmp, self.manifestPath)
+
+    def files(self):
+        return [
+            f for f in os.listdir(self.path)
+            if isField(f) and path.isfile(path.join(self.path, f))
+        ]
+
+    def take(self, srcDir):
+        """Update the snapshot from the files of a directory, writing only
+        files with new content
+        @return: list of files written to the snapshot"""
+        if not path.exists(self.path):
+            os.makedirs(self.path)
+        manifest = self.readManifest()
+        written = []
+        for f in os.listdir(srcDir):
+            srcPath = path.join(srcDir, f)
+            if not isField(f) or not path.isfile(srcPath):
+                continue
+            snapPath = path.join(self.path, f)
+            state = fileState(srcPath)
+            if f in manifest and manifest[f][1] == state and \
+                    path.exists(snapPath):
+                continue
+            digest = fileHash(srcPath)
+            if f not in manifest or manifest[f][0] != digest or \
+                    not path.exists(snapPath):
+                cloneFile(srcPath, snapPath)
+                written.append(f)
+            manifest[f] = (digest, state)
+        self.writeManifest(manifest)
+        return written
+
+    def restore(self, dstDir):
+        """Restore the files of the snapshot to a directory, writing only
+        files that are missing or changed since they were last restored
+        @return: list of restored files"""
+        if not path.exists(dstDir):
+            os.makedirs(dstDir)
+        manifest = self.readManifest()
+        restored = []
+        for f in self.files():
+            snapPath = path.join(self.path, f)
+            dstPath = path.join(dstDir, f)
+            if f in manifest:
+                digest, state = manifest[f]
+            else:
+                # snapshot made by plain copy, without manifest
+                digest, state = fileHash(snapPath), None
+            if path.exists(dstPath):
+                if fileState(dstPath) == state:
+                    continue
+                if fileHash(dstPath) == digest:
+                    manifest[f] = (digest, fileState(dstPath))
+                    continue
+            cloneFile(snapPath, dstPath)
+            manifest[f] = (digest, fileState(dstPath))
+            restored.append(f)
+        self.writeManifest(manifest)
+        return restored
+
+    def link(self, copyPath):
+        """Create a snapshot sharing the files of this one by hard links
+        @return: the new snapshot"""
+        if not path.exists(copyPath):
+            os.makedirs(copyPath)
+        for f in self.files():
+            linkFile(path.join(self.path, f), path.join(copyPath, f))
+        if path.exists(self.manifestPath):
+            shutil.copyfile(self.manifestPath, path.join(copyPath, MANIFEST))
+        return Snapshot(copyPath)
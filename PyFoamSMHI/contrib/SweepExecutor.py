@@ -0,0 +1,150 @@
+# -*- coding: us-ascii -*-
+"""Concurrent execution of the cases in a wind speed/direction sweep."""
+import sys
+import logging
+import threading
+import traceback
+from os import path
+from Queue import Queue, Empty
+
+from PyFoamSMHI.contrib.ParallelExecutionNSC import LAMMachine
+from PyFoamSMHI.contrib.CaseHandler import CaseHandler
+
+log = logging.getLogger(__name__)
+
+
+class SweepWorker:
+    """A working copy of a case together with its share of the CPUs"""
+
+    def __init__(self, index, caseHandler, nprocesses):
+        """@param index: index of the worker
+        @param caseHandler: the case directory used by the worker
+        @param nprocesses: number of processes available to the worker"""
+        self.index = index
+        self.case = caseHandler
+        self.nprocesses = nprocesses
+        self.lam = None
+        if nprocesses > 1:
+            self.lam = LAMMachine(nr=nprocesses)
+            self.lam.writeScotch(caseHandler)
+
+
+class SweepExecutor:
+    """Runs the cases of a sweep in a number of concurrent working copies"""
+
+    def __init__(self, caseHandler, nworkers=1, nprocesses=1, cloneDir=None):
+        """Creates the workers, cloning the case if more than one is used
+        @param caseHandler: the case to run the sweep for
+        @param nworkers: number of cases to run simultaneously
+        @param nprocesses: total number of processes to split among workers
+        @param cloneDir: directory to create the working copies in,
+        default is the parent directory of the case"""
+        self.case = caseHandler
+        self.nworkers = max(1, int(nworkers))
+        if self.nworkers > nprocesses:
+            log.warning(
+                "More workers than processes, running %i workers" %
+                nprocesses
+            )
+            self.nworkers = max(1, int(nprocesses))
+        self.procsPerWorker = max(1, int(nprocesses) // self.nworkers)
+        if cloneDir is None:
+            cloneDir = path.dirname(caseHandler.name)
+        self.cloneDir = cloneDir
+        self.workers = []
+        for i in range(self.nworkers):
+            if self.nworkers == 1:
+                workerCase = caseHandler
+            else:
+                workerCase = self.workingCopy(i)
+            self.workers.append(
+                SweepWorker(i, workerCase, self.procsPerWorker)
+            )
+        log.info(
+            "Sweep uses %i worker(s) with %i processes each" % (
+                self.nworkers, self.procsPerWorker)
+        )
+
+    def workingCopy(self, index):
+        """Returns a handler to working copy number index of the case"""
+        copyPath = path.join(
+            self.cloneDir,
+            "%s_worker%i" % (path.basename(self.case.name), index)
+        )
+        if not path.exists(copyPath):
+            log.info("Creating working copy: %s" % copyPath)
+            self.case.createWorkingCopy(copyPath)
+        return CaseHandler(copyPath)
+
+    def run(self, cases, caseFunc, resultFunc=None):
+        """Runs all cases, calling caseFunc(worker, case) for each of them
+        @param cases: list of cases, e.g. (wspeed, wdir, runIndex) tuples
+        @param caseFunc: function running a case in a worker
+        @param resultFunc: optional, called with (case, result) in the
+        calling thread as soon as a case finishes. Results can arrive in
+        another order than the cases were given.
+        @return: list of cases that failed"""
+        if self.nworkers == 1:
+            for case in cases:
+                result = caseFunc(self.workers[0], case)
+                if resultFunc is not None:
+                    resultFunc(case, result)
+            return []
+
+        tasks = Queue()
+        results = Queue()
+        for case in cases:
+            tasks.put(case)
+        abort = threading.Event()
+
+        def work(worker):
+            while not abort.is_set():
+                try:
+                    case = tasks.get_nowait()
+                except Empty:
+                    return
+                try:
+                    results.put((case, caseFunc(worker, case), None))
+                except BaseException:
+                    # also catches sys.exit called from within the case
+                    abort.set()
+                    results.put((case, None, traceback.format_exc()))
+
+        threads = []
+        for worker in self.workers:
+            thread = threading.Thread(target=work, args=(worker,))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        failed = []
+        while True:
+            try:
+                case, result, error = results.get(timeout=1)
+            except Empty:
+                if [t for t in threads if t.is_alive()]:
+                    continue
+                if results.empty():
+                    break
+                continue
+            if error is not None:
+                log.error("Case %s failed:\n%s" % (str(case), error))
+                failed.append(case)
+            elif resultFunc is not None:
+                resultFunc(case, result)
+
+        if abort.is_set():
+            # cases that were never started are also reported as failed
+            while not tasks.empty():
+                failed.append(tasks.get_nowait())
+        return failed
+
+    def runOrExit(self, cases, caseFunc, resultFunc=None):
+        """Like run, but exits if any case failed"""
+        failed = self.run(cases, caseFunc, resultFunc)
+        if len(failed) > 0:
+            log.error(
+                "%i case(s) of the sweep failed: %s" % (
+                    len(failed), str(failed))
+            )
+            sys.exit(1)
@@ -0,0 +1,155 @@
+# -*- coding: us-ascii -*-
+"""Crash-safe journal of the cases in a sweep."""
+import os
+import time
+import shutil
+import logging
+import threading
+from os import path
+
+log = logging.getLogger(__name__)
+
+# states of a case, in the order they are passed
+QUEUED = "queued"
+RESTORED = "restored"
+DECOMPOSED = "decomposed"
+SOLVED = "solved"
+RECONSTRUCTED = "reconstructed"
+ARCHIVED = "archived"
+# results are written to the archive while archiving, or while scaling
+# for cases derived from another case, an archive directory of a case in
+# these states is incomplete
+ARCHIVING = "archiving"
+SCALING = "scaling"
+STATES = [
+    QUEUED, RESTORED, DECOMPOSED, SOLVED, RECONSTRUCTED, ARCHIVING, SCALING,
+    ARCHIVED
+]
+PARTIAL_STATES = [ARCHIVING, SCALING]
+
+# pseudo case used to record start and end of a sweep
+SWEEP = "sweep"
+STARTED = "started"
+FINISHED = "finished"
+
+
+class SweepJournal:
+    """Append-only journal recording the state transitions of each case
+
+    Every transition is flushed to disk before the sweep continues, so
+    that an interrupted sweep can be resumed where it stopped. The
+    dictionaries modified during the sweep are saved when the sweep
+    starts, to be restored when resuming."""
+
+    def __init__(self, casePath, name):
+        """@param casePath: case directory to keep the journal in
+        @param name: name of the journal, e.g. the name of the runner"""
+        self.casePath = casePath
+        self.path = path.join(casePath, name + ".journal")
+        self.dictDir = path.join(casePath, name + ".dictionaries")
+        self.lock = threading.Lock()
+        self.states = {}
+        self.infos = {}
+        if path.exists(self.path):
+            self.read()
+
+    def read(self):
+        fid = open(self.path, "r")
+        for line in fid:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 3:
+                # last line may be incomplete after a crash
+                continue
+            caseName, state = fields[1], fields[2]
+            if state not in STATES and state not in (STARTED, FINISHED):
+                continue
+            self.states[caseName] = state
+            if len(fields) > 3:
+                self.infos[caseName] = fields[3]
+        fid.close()
+
+    def record(self, caseName, state, info=None):
+        """Record a state transition of a case
+        @param caseName: name of the case, e.g. its archive directory
+        @param state: the state the case has reached
+        @param info: optional, extra information for the state"""
+        fields = [time.strftime("%Y-%m-%d %H:%M:%S"), caseName, state]
+        if info is not None:
+            fields.append(str(info))
+        with self.lock:
+            fid = open(self.path, "a")
+            fid.write("\t".join(fields) + "\n")
+            fid.flush()
+            os.fsync(fid.fileno())
+            fid.close()
+            self.states[caseName] = state
+            if info is not None:
+                self.infos[caseName] = str(info)
+            elif caseName in self.infos:
+                del self.infos[caseName]
+        log.debug("Journal: %s %s" % (caseName, state))
+
+    def state(self, caseName):
+        """The last recorded state of a case, None if not in journal"""
+        return self.states.get(caseName)
+
+    def info(self, caseName):
+        """The information recorded with the last state of a case"""
+        return self.infos.get(caseName)
+
+    def isDone(self, caseName):
+        return self.state(caseName) == ARCHIVED
+
+    def isInterrupted(self):
+        """True if a sweep was started but never finished"""
+        return self.state(SWEEP) == STARTED
+
+    def unfinishedCases(self):
+        """Names of cases that were started but not archived"""
+        return [
+            caseName for caseName, state in self.states.items()
+            if caseName != SWEEP and state not in (QUEUED, ARCHIVED)
+        ]
+
+    def startSweep(self, dictPaths):
+        """Record the start of a sweep
+        When starting, the dictionaries are saved. When resuming an
+        interrupted sweep, the saved dictionaries are kept as they hold
+        the state from before the interrupted sweep.
+        @param dictPaths: paths of dictionaries modified by the sweep,
+        relative to the case directory"""
+        if self.isInterrupted():
+            log.info("Resuming interrupted sweep")
+        else:
+            if path.exists(self.dictDir):
+                shutil.rmtree(self.dictDir)
+            for dictPath in dictPaths:
+                src = path.join(self.casePath, dictPath)
+                if not path.exists(src):
+                    continue
+                dst = path.join(self.dictDir, dictPath)
+                if not path.exists(path.dirname(dst)):
+                    os.makedirs(path.dirname(dst))
+                shutil.copy2(src, dst)
+        self.record(SWEEP, STARTED)
+
+    def restoreDictionaries(self, casePath=None):
+        """Restore the dictionaries saved when the sweep started
+        @param casePath: optional, case to restore the dictionaries in,
+        e.g. a working copy of the case"""
+        if casePath is None:
+            casePath = self.casePath
+        if not path.exists(self.dictDir):
+            return
+        for root, dirs, files in os.walk(self.dictDir):
+            for f in files:
+                src = path.join(root, f)
+                dst = path.join(
+                    casePath, path.relpath(src, self.dictDir)
+                )
+                shutil.copy2(src, dst)
+                log.debug("Restored dictionary: %s" % dst)
+
+    def finishSweep(self):
+        """Record that the sweep has finished"""
+        self.record(SWEEP, FINISHED)
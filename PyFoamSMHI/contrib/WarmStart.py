@@ -0,0 +1,377 @@
+# -*- coding: us-ascii -*-
+"""Derivation of wind fields from already archived cases."""
+import os
+import re
+import gzip
+import math
+import logging
+from os import path
+
+log = logging.getLogger(__name__)
+
+ARCHIVE_DIR_EXP = re.compile(r"^wspeed_(.+)_wdir_(.+)$")
+VECTOR_EXP = re.compile(
+    r"\(\s*([^\s()]+)\s+([^\s()]+)\s+([^\s()]+)\s*\)"
+)
+
+# exponent of the wind speed ratio that each field scales with, fields
+# not listed can not be scaled
+SPEED_EXPONENTS = {
+    "U": 1, "k": 2, "epsilon": 3, "p": 2, "omega": 1, "nut": 1,
+    "nuTilda": 1, "alphat": 1
+}
+
+# entries scaled when deriving a field for another wind speed
+SCALED_ENTRIES = [
+    "internalField", "value", "inletValue", "uniformValue", "refValue",
+    "Uref"
+]
+
+
+def parseCaseDirName(dirName):
+    """Returns (wspeed, wdir) of an archive directory, or None"""
+    match = ARCHIVE_DIR_EXP.match(dirName)
+    if match is None:
+        return None
+    try:
+        return float(match.group(1)), float(match.group(2))
+    except ValueError:
+        return None
+
+
+def dirDiff(wdir1, wdir2):
+    """Smallest angle in degrees between two wind directions"""
+    diff = abs(wdir1 - wdir2) % 360.0
+    return min(diff, 360.0 - diff)
+
+
+def findNearestCase(archive, wspeed, wdir, fileNames, maxDirDiff=180.0):
+    """Find the archived case closest to a given wind speed and direction
+    Cases with the nearest direction are preferred, and among them the
+    case with the nearest speed (as a ratio).
+    @param archive: FoamArchive to search
+    @param fileNames: files that must be present in the archived case
+    @param maxDirDiff: max difference in wind direction to accept
+    @return: (dirName, wspeed, wdir) of the nearest case or None"""
+    best = None
+    bestKey = None
+    for dirName in archive.listDirs():
+        caseParams = parseCaseDirName(dirName)
+        if caseParams is None:
+            continue
+        caseSpeed, caseDir = caseParams
+        if caseSpeed <= 0 or (caseSpeed == wspeed and caseDir == wdir):
+            continue
+        angle = dirDiff(caseDir, wdir)
+        if angle > maxDirDiff:
+            continue
+        if not archive.filesInArchive(dirName, fileNames):
+            continue
+        key = (angle, abs(math.log(wspeed / caseSpeed)))
+        if bestKey is None or key < bestKey:
+            best = (dirName, caseSpeed, caseDir)
+            bestKey = key
+    return best
+
+
+def fieldName(fileName):
+    """Name of the field stored in a (possibly compressed) file"""
+    if fileName.endswith(".gz"):
+        return fileName[:-3]
+    return fileName
+
+
+def openField(fieldPath, mode="r"):
+    """Open a field file, compressed or not"""
+    if fieldPath.endswith(".gz"):
+        return gzip.open(fieldPath, mode + "b")
+    return open(fieldPath, mode)
+
+
+def formatScalar(value):
+    """Shortest text giving the same double, so that scaled values keep
+    the precision written by the solver"""
+    text = repr(float(value))
+    if text.endswith(".0"):
+        return text[:-2]
+    return text
+
+
+def speedExponent(fileName):
+    """Exponent of the wind speed ratio that a field scales with
+    @raise ValueError: if the scaling of the field is not known"""
+    name = fieldName(fileName)
+    if name not in SPEED_EXPONENTS:
+        raise ValueError("Unknown speed scaling of field: " + name)
+    return SPEED_EXPONENTS[name]
+
+
+def transformLine(line, scale, rotation):
+    """Scale and rotate the values of a line of an internalField
+    @param scale: factor to multiply values with
+    @param rotation: angle (radians) to rotate vectors counter clockwise
+    around the z-axis"""
+    match = VECTOR_EXP.search(line)
+    if match is not None:
+        x, y, z = [float(v) for v in match.groups()]
+        xr = x * math.cos(rotation) - y * math.sin(rotation)
+        yr = x * math.sin(rotation) + y * math.cos(rotation)
+        vec = "(%s %s %s)" % (
+            formatScalar(scale * xr),
+            formatScalar(scale * yr),
+            formatScalar(scale * z)
+        )
+        return line[:match.start()] + vec + line[match.end():]
+
+    stripped = line.strip().rstrip(";")
+    try:
+        value = float(stripped)
+    except ValueError:
+        return line
+    return line.replace(stripped, formatScalar(scale * value), 1)
+
+
+def iterInternalField(lines):
+    """Split the lines of a field file in three parts
+    @return: generator of (part, line) where part is 0 before the
+    internalField, 1 for the internalField entry and 2 after it"""
+    part = 0
+    for line in lines:
+        if part == 0 and line.lstrip().startswith("internalField"):
+            part = 1
+            yield part, line
+            if line.rstrip().endswith(";"):
+                part = 2
+            continue
+        yield part, line
+        if part == 1 and line.strip().startswith(";") or \
+           part == 1 and line.rstrip().endswith(");"):
+            part = 2
+
+
+def transformEntry(line, scale, rotation):
+    """Transform the value of an entry given on a single line, e.g.
+    'value uniform (1 0 0);', 'Uref 10;' or 'value nonuniform 2(1 2);'"""
+    keyword, rest = line.split(None, 1)
+    head = line[:line.index(keyword) + len(keyword)]
+    rest = line[len(head):]
+    if "nonuniform" in rest:
+        # short list given on a single line
+        listHead, values = rest.split("(", 1)
+        values, tail = values.rsplit(")", 1)
+        if VECTOR_EXP.search(values):
+            values = VECTOR_EXP.sub(
+                lambda m: transformLine(m.group(0), scale, rotation),
+                values
+            )
+        else:
+            values = " ".join(
+                [transformLine(v, scale, rotation) for v in values.split()]
+            )
+        return head + listHead + "(" + values + ")" + tail
+    if "uniform" in rest:
+        valueHead, value = rest.split("uniform", 1)
+        return head + valueHead + "uniform" + transformLine(
+            value, scale, rotation
+        )
+    return head + transformLine(rest, scale, rotation)
+
+
+def transformEntries(lines, scale, rotation, keywords):
+    """Generator of lines where the values of entries with the given
+    keywords are scaled and rotated, other lines are kept as they are"""
+    inEntry = False
+    inList = False
+    for line in lines:
+        if not inEntry:
+            words = line.split(None, 1)
+            if len(words) == 0 or words[0] not in keywords:
+                yield line
+            elif "nonuniform" in line and "(" not in line:
+                # list starts on the following lines
+                inEntry = True
+                yield line
+            else:
+                yield transformEntry(line, scale, rotation)
+        elif not inList:
+            if line.strip() == "(":
+                inList = True
+            elif line.strip().startswith(";"):
+                inEntry = False
+            yield line
+        elif line.strip().startswith(")"):
+            inList = False
+            if line.rstrip().endswith(";"):
+                inEntry = False
+            yield line
+        else:
+            yield transformLine(line, scale, rotation)
+
+
+def transformInternalField(lines, scale, rotation):
+    """Generator of transformed lines of the internalField entry"""
+    internalField = (line for part, line in iterInternalField(lines)
+                     if part == 1)
+    return transformEntries(
+        internalField, scale, rotation, ["internalField"]
+    )
+
+
+def parseValues(text):
+    """Parse scalars or vectors from text into a list of tuples"""
+    vectors = VECTOR_EXP.findall(text)
+    if len(vectors) > 0:
+        return [tuple([float(c) for c in vec]) for vec in vectors]
+    return [(float(word),) for word in text.split()]
+
+
+def internalFieldValues(lines):
+    """Generator of the values of the internalField entry as tuples"""
+    inList = False
+    for part, line in iterInternalField(lines):
+        if part != 1:
+            continue
+        stripped = line.strip()
+        if stripped.startswith("internalField"):
+            if "nonuniform" not in line:
+                values = line.split("uniform", 1)[1].strip().rstrip(";")
+            elif "(" in line:
+                values = line.split("(", 1)[1].rsplit(")", 1)[0]
+            else:
+                continue
+            for value in parseValues(values):
+                yield value
+        elif not inList:
+            if stripped == "(":
+                inList = True
+        elif stripped.startswith(")"):
+            inList = False
+        else:
+            for value in parseValues(stripped):
+                yield value
+
+
+def warmStartField(sourceLines, fieldPath, scale, rotation):
+    """Replace the internalField of a field file by the transformed
+    internalField of another field, keeping header and boundaryField
+    @param sourceLines: iterable over the lines of the source field
+    @param fieldPath: field file to modify
+    @param scale: factor to multiply the values with
+    @param rotation: angle (radians) to rotate vectors with"""
+    tmpPath = fieldPath + ".warmStart"
+    current = openField(fieldPath)
+    out = openField(tmpPath, "w")
+    try:
+        written = False
+        for part, line in iterInternalField(current):
+            if part == 0 or part == 2:
+                out.write(line)
+            elif not written:
+                for newLine in transformInternalField(
+                        sourceLines, scale, rotation):
+                    out.write(newLine)
+                written = True
+    finally:
+        current.close()
+        out.close()
+    os.rename(tmpPath, fieldPath)
+
+
+def warmStart(archive, dirName, caseSpeed, caseDir, wspeed, wdir,
+              initialDir, fieldNames):
+    """Initialise fields from an archived case, rotating vectors to the
+    new wind direction and scaling values with the speed ratio
+    @param archive: FoamArchive with the case to start from
+    @param dirName: name of the archived case
+    @param caseSpeed: wind speed of the archived case
+    @param caseDir: wind direction of the archived case
+    @param initialDir: directory with the fields to initialise
+    @param fieldNames: names of fields to initialise (as in the archive)"""
+    speedRatio = wspeed / caseSpeed
+    # wind directions are clockwise, rotation counter clockwise
+    rotation = -math.radians(wdir - caseDir)
+    for fileName in fieldNames:
+        name = fieldName(fileName)
+        fieldPath = path.join(initialDir, name)
+        if not path.exists(fieldPath):
+            fieldPath += ".gz"
+        if not path.exists(fieldPath):
+            log.warning(
+                "Cannot warm-start %s, field does not exist in %s" % (
+                    name, initialDir)
+            )
+            continue
+        if name not in SPEED_EXPONENTS:
+            log.warning(
+                "Cannot warm-start %s, unknown speed scaling" % name
+            )
+            continue
+        scale = speedRatio ** SPEED_EXPONENTS[name]
+        source = archive.openFile(fileName, dirName)
+        try:
+            warmStartField(source, fieldPath, scale, rotation)
+        finally:
+            source.close()
+        log.debug("Warm-started %s from %s" % (name, dirName))
+
+
+def scaleCase(archive, refDirName, refSpeed, dirName, wspeed,
+              fileNames, tmpDir):
+    """Derive an archived case for another wind speed by scaling the
+    fields of an archived reference case with the same wind direction.
+    For neutral conditions, results are assumed to be independent of
+    the Reynolds number.
+    @param archive: FoamArchive holding the reference case
+    @param refDirName: name of the archived reference case
+    @param refSpeed: wind speed of the reference case
+    @param dirName: name of the case to create in the archive
+    @param wspeed: wind speed of the case to create
+    @param fileNames: names of the archived files to scale
+    @param tmpDir: directory to write scaled files to before archiving
+    @raise ValueError: if the speed scaling of a field is not known, see
+    SPEED_EXPONENTS"""
+    speedRatio = wspeed / refSpeed
+    # refuse before writing anything rather than archive unscaled fields
+    exponents = dict((f, speedExponent(f)) for f in fileNames)
+    for fileName in fileNames:
+        exponent = exponents[fileName]
+        tmpPath = path.join(tmpDir, fileName)
+        source = archive.openFile(fileName, refDirName)
+        out = openField(tmpPath, "w")
+        try:
+            for line in transformEntries(
+                    source, speedRatio ** exponent, 0.0, SCALED_ENTRIES):
+                out.write(line)
+        finally:
+            source.close()
+            out.close()
+        archive.addFile(tmpPath, dirName=dirName)
+        os.remove(tmpPath)
+    archive.setMetadata(dirName, {
+        "derivedFrom": refDirName,
+        "method": "speedScaling",
+        "speedRatio": speedRatio
+    })
+
+
+def scalingError(archive, refDirName, refSpeed, dirName, wspeed, fileName):
+    """Relative RMS difference between the internalField of a solved
+    case and the field derived by scaling the reference case"""
+    exponent = speedExponent(fileName)
+    scale = (wspeed / refSpeed) ** exponent
+    ref = archive.openFile(fileName, refDirName)
+    solved = archive.openFile(fileName, dirName)
+    sumDiff = 0.0
+    sumSolved = 0.0
+    try:
+        for refValue, solvedValue in zip(
+                internalFieldValues(ref), internalFieldValues(solved)):
+            for r, v in zip(refValue, solvedValue):
+                sumDiff += (scale * r - v) ** 2
+                sumSolved += v ** 2
+    finally:
+        ref.close()
+        solved.close()
+    if sumSolved == 0:
+        return 0.0
+    return math.sqrt(sumDiff / sumSolved)
@@ -1,39 +1,80 @@
-defaultCf="""
-#===============Template for controlfile================== 
-#--------------Meteorology---------------
-z0: 0.1
-wspeeds: 3.0
-wdirs: 0 45 90 135 180 225 275 315
-
-#---------------Numerics-----------------
-iterations: 20
-solver: windFoam
-initialize: setWindInlet
-
-#---------------Archives-----------------
-#----flow calculations----
-flowArchiveDirName: flowArchive
-fieldsToArchive: U p epsilon k
-
-#----disperison calculations----
-concArchiveDirName: concArchive
-
-#---general archive settings----
-archiveVTK: True
-VTKArchiveDir: /data/proj/Ml-data/miljosakerhet_ml/CFD/projekt/...
-restoreArchived: True
-
-#--------------Computation----------------
-# CPUs is optional
-#Number of nodes
-nodes: 2
-#CPUs:
-walltime: 00:05:00
-jobname: test
-
-#----------------Output-------------------
-outputFormat: ascii
-comression: False
-
-#=========================================================
-"""
+defaultCf="""
+#===============Template for controlfile================== 
+#--------------Meteorology---------------
+z0: 0.1
+wspeeds: 3.0
+wdirs: 0 45 90 135 180 225 275 315
+
+#---------------Numerics-----------------
+iterations: 20
+solver: windFoam
+initialize: setWindInlet
+#Initialise U, k, epsilon and p from the nearest archived case (optional)
+#warmStart: False
+#Max difference in wind direction for a case to start from (degrees)
+#warmStartMaxDirDiff: 45
+#Stop the solver when initial residuals are below thresholds (optional)
+#convergenceCriteria: Ux:1e-4 Uy:1e-4 k:1e-4 epsilon:1e-4
+#...or when log10 of the residuals changes less than the slope
+#(decades per iteration) over the window (optional)
+#convergencePlateauWindow: 200
+#convergencePlateauSlope: 1e-4
+#Solve only referenceSpeed and derive the other wind speeds by scaling
+#(neutral conditions only, optional)
+#speedScaling: False
+#referenceSpeed: 3.0
+#Wind speeds that are also solved to check the scaling against (optional)
+#validateSpeedScaling:
+
+#---------------Archives-----------------
+#----flow calculations----
+flowArchiveDirName: flowArchive
+fieldsToArchive: U p epsilon k
+
+#----disperison calculations----
+concArchiveDirName: concArchive
+
+#---general archive settings----
+archiveVTK: True
+VTKArchiveDir: /data/proj/Ml-data/miljosakerhet_ml/CFD/projekt/...
+restoreArchived: True
+#Compress archived fields written uncompressed, with gzip level 1-9
+#(optional, default False and 6)
+#compressArchive: False
+#archiveCompressionLevel: 6
+#Store identical archived files once, in .objects in the case directory,
+#see archiveIndex --gc (optional, default False)
+#dedupArchive: False
+#Archive flow fields as binary arrays readable by numpy, see FieldArray
+#(optional, default False)
+#archiveFieldArrays: False
+#Archive the flow fields of each case in a single file, <case>.pack, to
+#save inodes, see archiveIndex --pack/--repack (optional, default False)
+#packArchive: False
+
+#--------------Computation----------------
+# CPUs is optional
+#Number of nodes
+nodes: 2
+#CPUs:
+#Number of cases run concurrently, sharing the CPUs (optional, default 1)
+#workers: 1
+#Decompose the mesh once and reuse it for all cases (optional, default False)
+#decomposeOnce: False
+#Threads reconstructing and archiving finished cases while the next case
+#is solved (optional, default 0 which post-processes before the next case)
+#postProcessWorkers: 0
+#Split the sweep by wind direction in shards, submitted by batchRun as a
+#job array with a job merging the convergence tables (optional, default 1)
+#shards: 1
+#walltime can be set to auto, to use the time predicted by batchRun from
+#previous runs of the case (see runLedger.sqlite in the case directory)
+walltime: 00:05:00
+jobname: test
+
+#----------------Output-------------------
+outputFormat: ascii
+comression: False
+
+#=========================================================
+"""
@@ -0,0 +1,2 @@
+# -*- coding: us-ascii -*-
+"""Tests of the PyFoamSMHI package."""
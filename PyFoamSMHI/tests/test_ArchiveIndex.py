@@ -0,0 +1,123 @@
+# -*- coding: us-ascii -*-
+"""Tests of the SQLite index of an archive."""
+import os
+import shutil
+import tempfile
+import unittest
+from os import path
+
+from PyFoamSMHI.contrib.ArchiveIndex import ArchiveIndex, INDEX_FILE
+from PyFoamSMHI.contrib.CasePack import CasePack
+
+
+def writeFile(filePath, text):
+    fid = open(filePath, "wb")
+    try:
+        fid.write(text.encode("latin-1"))
+    finally:
+        fid.close()
+
+
+class ArchiveIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.archivePath = tempfile.mkdtemp()
+        for d in ["wspeed_3.0_wdir_0.0", "wspeed_3.0_wdir_90.0"]:
+            os.mkdir(path.join(self.archivePath, d))
+            writeFile(path.join(self.archivePath, d, "U"), "U of " + d)
+            writeFile(path.join(self.archivePath, d, "k.gz"), "k of " + d)
+        writeFile(path.join(self.archivePath, "concFileList"), "list")
+
+    def tearDown(self):
+        shutil.rmtree(self.archivePath)
+
+    def filePath(self, dirName, fileName):
+        return path.join(self.archivePath, dirName, fileName)
+
+    def testBuiltWhenMissing(self):
+        index = ArchiveIndex(self.archivePath)
+        self.assertTrue(path.exists(path.join(self.archivePath, INDEX_FILE)))
+        self.assertEqual(
+            index.dirs(), ["wspeed_3.0_wdir_0.0", "wspeed_3.0_wdir_90.0"]
+        )
+        self.assertTrue(index.hasFile("wspeed_3.0_wdir_0.0", "U"))
+        self.assertTrue(index.hasFile("", "concFileList"))
+        self.assertEqual(
+            [(f[1], f[4]) for f in index.files("wspeed_3.0_wdir_0.0")],
+            [("U", "none"), ("k.gz", "gzip")]
+        )
+        self.assertEqual(
+            index.caseKey("wspeed_3.0_wdir_90.0"), (3.0, 90.0, None)
+        )
+        self.assertEqual(index.verify(checksums=True), [])
+
+    def testVerifyManualEdits(self):
+        index = ArchiveIndex(self.archivePath)
+        os.remove(self.filePath("wspeed_3.0_wdir_0.0", "k.gz"))
+        writeFile(self.filePath("wspeed_3.0_wdir_0.0", "p"), "p")
+        writeFile(self.filePath("wspeed_3.0_wdir_90.0", "U"), "longer U")
+        # same size, only found by comparing checksums
+        writeFile(
+            self.filePath("wspeed_3.0_wdir_90.0", "k.gz"),
+            "K OF wspeed_3.0_wdir_90.0"
+        )
+        # temporary and backup files are not archive entries
+        writeFile(self.filePath("wspeed_3.0_wdir_90.0", ".U.tmp"), "")
+        writeFile(self.filePath("wspeed_3.0_wdir_90.0", "U.bak"), "")
+
+        self.assertEqual(index.verify(), [
+            ("wspeed_3.0_wdir_0.0", "k.gz", "missing"),
+            ("wspeed_3.0_wdir_90.0", "U", "size"),
+            ("wspeed_3.0_wdir_0.0", "p", "unindexed")
+        ])
+        self.assertEqual(
+            index.verify(checksums=True)[2],
+            ("wspeed_3.0_wdir_90.0", "k.gz", "checksum")
+        )
+
+    def testRebuildAfterManualEdits(self):
+        index = ArchiveIndex(self.archivePath)
+        index.setCaseKey("wspeed_3.0_wdir_0.0", 3.0, 0.0, 0.1)
+        index.setCaseKey("wspeed_3.0_wdir_90.0", 3.0, 90.0, 0.2)
+        shutil.rmtree(path.join(self.archivePath, "wspeed_3.0_wdir_90.0"))
+        os.mkdir(path.join(self.archivePath, "wspeed_5.0_wdir_0.0"))
+        writeFile(self.filePath("wspeed_5.0_wdir_0.0", "U"), "U")
+        writeFile(self.filePath("wspeed_3.0_wdir_0.0", "U"), "new U")
+        self.assertNotEqual(index.verify(), [])
+
+        self.assertEqual(index.rebuild(), 4)
+        self.assertEqual(index.verify(checksums=True), [])
+        self.assertEqual(
+            index.dirs(), ["wspeed_3.0_wdir_0.0", "wspeed_5.0_wdir_0.0"]
+        )
+        # case keys of directories still in the archive are kept
+        self.assertEqual(
+            index.caseKey("wspeed_3.0_wdir_0.0"), (3.0, 0.0, 0.1)
+        )
+        self.assertEqual(
+            index.caseKey("wspeed_5.0_wdir_0.0"), (5.0, 0.0, None)
+        )
+        self.assertEqual(index.caseKey("wspeed_3.0_wdir_90.0"), None)
+
+    def testPackedFiles(self):
+        dirName = "wspeed_3.0_wdir_0.0"
+        pack = CasePack(path.join(self.archivePath, dirName + ".pack"))
+        for f in ["U", "k.gz"]:
+            pack.add(f, self.filePath(dirName, f))
+        shutil.rmtree(path.join(self.archivePath, dirName))
+        index = ArchiveIndex(self.archivePath)
+        self.assertTrue(index.hasDir(dirName))
+        self.assertEqual(
+            [(f[1], f[2]) for f in index.files(dirName)],
+            [("U", len("U of " + dirName)), ("k.gz", len("k of " + dirName))]
+        )
+        self.assertEqual(index.verify(checksums=True), [])
+
+        pack.remove(["k.gz"])
+        self.assertEqual(index.verify(), [(dirName, "k.gz", "missing")])
+        index.rebuild()
+        self.assertEqual(index.verify(checksums=True), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
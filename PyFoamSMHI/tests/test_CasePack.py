@@ -0,0 +1,160 @@
+# -*- coding: us-ascii -*-
+"""Tests of the single-file containers of archived cases."""
+import os
+import shutil
+import hashlib
+import tempfile
+import unittest
+from os import path
+
+from PyFoamSMHI.contrib.CasePack import CasePack, TRAILER
+
+
+class CasePackTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.pack = CasePack(path.join(self.dir, "case.pack"))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def writeFile(self, name, data):
+        filePath = path.join(self.dir, name)
+        fid = open(filePath, "wb")
+        try:
+            fid.write(data)
+        finally:
+            fid.close()
+        return filePath
+
+    def content(self, name):
+        section = self.pack.open(name)
+        try:
+            return section.read()
+        finally:
+            section.close()
+
+    def add(self, name, data):
+        return self.pack.add(name, self.writeFile(name, data))
+
+    def testAppend(self):
+        self.assertEqual(self.pack.entries(), {})
+        checksums = self.pack.append([
+            ("U", self.writeFile("U", b"U values\n"), None),
+            ("k.gz", self.writeFile("k.gz", b"k values\n"), "given")
+        ])
+        self.assertEqual(
+            checksums["U"], hashlib.sha1(b"U values\n").hexdigest()
+        )
+        self.assertEqual(checksums["k.gz"], "given")
+        self.assertEqual(self.pack.names(), ["U", "k.gz"])
+        self.assertEqual(self.content("U"), b"U values\n")
+        self.assertEqual(self.pack.hash("U"), checksums["U"])
+        self.assertEqual(self.pack.entry("k.gz")[1], len(b"k values\n"))
+        self.assertEqual(self.pack.garbage(), 0)
+
+        dst = path.join(self.dir, "extracted")
+        self.pack.extract("k.gz", dst)
+        fid = open(dst, "rb")
+        self.assertEqual(fid.read(), b"k values\n")
+        fid.close()
+        self.assertRaises(KeyError, self.pack.open, "p")
+
+    def testSection(self):
+        self.add("U", b"first line\nsecond line\nthird")
+        self.add("k", b"other entry")
+        section = self.pack.open("U")
+        try:
+            self.assertEqual(section.readline(), b"first line\n")
+            self.assertEqual(list(section), [b"second line\n", b"third"])
+            self.assertEqual(section.read(), b"")
+            section.seek(-5, 2)
+            self.assertEqual(section.read(100), b"third")
+            section.seek(6)
+            self.assertEqual(section.read(4), b"line")
+            self.assertEqual(section.tell(), 10)
+        finally:
+            section.close()
+
+    def testReplace(self):
+        self.add("U", b"old U")
+        self.add("k", b"k")
+        self.add("U", b"new U values")
+        self.assertEqual(self.pack.names(), ["U", "k"])
+        self.assertEqual(self.content("U"), b"new U values")
+        self.assertEqual(self.content("k"), b"k")
+        self.assertTrue(self.pack.garbage() > len(b"old U"))
+
+    def testRemove(self):
+        self.add("U", b"U")
+        self.add("k", b"k")
+        self.pack.remove(["U", "p"])
+        self.assertFalse(self.pack.has("U"))
+        self.assertEqual(self.pack.names(), ["k"])
+        self.assertEqual(self.content("k"), b"k")
+        # a new reader sees the removal
+        self.assertEqual(
+            CasePack(self.pack.path).names(), ["k"]
+        )
+
+    def testRepack(self):
+        self.add("U", b"old U")
+        self.add("k", b"k values")
+        self.add("U", b"new U")
+        self.add("p", b"p")
+        self.pack.remove(["p"])
+        self.assertTrue(self.pack.garbage() > 0)
+        size = os.path.getsize(self.pack.path)
+        entries = self.pack.entries()
+
+        freed = self.pack.repack()
+        self.assertTrue(freed > 0)
+        self.assertEqual(os.path.getsize(self.pack.path), size - freed)
+        self.assertEqual(self.pack.garbage(), 0)
+        self.assertEqual(self.pack.names(), ["U", "k"])
+        self.assertEqual(self.content("U"), b"new U")
+        self.assertEqual(self.content("k"), b"k values")
+        for name in ["U", "k"]:
+            self.assertEqual(self.pack.entry(name)[2], entries[name][2])
+            self.assertEqual(self.pack.hash(name), entries[name][2])
+        self.assertFalse(
+            path.exists(path.join(self.dir, ".case.pack.tmp"))
+        )
+        self.add("p", b"p again")
+        self.assertEqual(self.pack.names(), ["U", "k", "p"])
+
+    def testTruncatedTrailer(self):
+        self.add("U", b"U")
+        self.add("k", b"k")
+        complete = os.path.getsize(self.pack.path)
+        self.add("U", b"U being replaced")
+        # an append interrupted in the trailer
+        fid = open(self.pack.path, "r+b")
+        fid.truncate(os.path.getsize(self.pack.path) - TRAILER.size // 2)
+        fid.close()
+
+        pack = CasePack(self.pack.path)
+        self.assertEqual(pack.names(), ["U", "k"])
+        # the incomplete append is garbage
+        self.assertTrue(
+            pack.garbage() >= os.path.getsize(pack.path) - complete
+        )
+        section = pack.open("U")
+        self.assertEqual(section.read(), b"U")
+        section.close()
+
+        # appending after the incomplete data recovers the pack
+        pack.add("p", self.writeFile("p", b"p"))
+        pack = CasePack(self.pack.path)
+        self.assertEqual(pack.names(), ["U", "k", "p"])
+        self.assertEqual(pack.hash("p"), pack.entry("p")[2])
+        self.assertEqual(pack.hash("k"), pack.entry("k")[2])
+
+    def testNoTrailer(self):
+        self.writeFile("case.pack", b"data without index")
+        self.assertRaises(ValueError, self.pack.entries)
+
+
+if __name__ == "__main__":
+    unittest.main()
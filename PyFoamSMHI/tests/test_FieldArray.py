@@ -0,0 +1,212 @@
+# -*- coding: us-ascii -*-
+"""Tests of the field array archive format."""
+import os
+import gzip
+import shutil
+import tempfile
+import unittest
+from os import path
+
+from PyFoamSMHI.contrib import FieldArray
+
+HEADER = """\
+/*--------------------------------*- C++ -*------------------------------*\\
+| =========                 |                                             |
+\\*-----------------------------------------------------------------------*/
+FoamFile
+{
+    version     2.0;
+    format      ascii;
+    class       %s;
+    location    "0";
+    object      %s;
+}
+// * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * //
+
+"""
+
+# values are written as by FieldArray.formatValue and lists as by
+# OpenFOAM, with a space after the type, to compare the text
+VECTOR_FIELD = HEADER % ("volVectorField", "U") + """\
+dimensions      [0 1 -1 0 0 0 0];
+
+internalField   nonuniform List<vector>
+3
+(
+(1.5 -2 0.1)
+(1e-05 3 0)
+(0 0 -7.25)
+)
+;
+
+boundaryField
+{
+    inlet
+    {
+        type            fixedValue;
+        value           nonuniform List<vector>
+2
+(
+(3 0 0)
+(4 0.5 0)
+)
+;
+    }
+    ground
+    {
+        type            fixedValue;
+        value           uniform (0 0 0);
+    }
+    top
+    {
+        type            slip;
+    }
+}
+
+
+// ************************************************************************* //
+""".replace(">\n", "> \n")
+
+SCALAR_FIELD = HEADER % ("volScalarField", "k") + """\
+dimensions      [0 2 -2 0 0 0 0];
+
+internalField   uniform 0.375;
+
+boundaryField
+{
+    inlet
+    {
+        type            inletOutlet;
+        inletValue      uniform 0;
+        value           nonuniform List<scalar>
+4
+(
+0.1
+0.2
+1e+30
+-3
+)
+;
+    }
+    outlet
+    {
+        type            zeroGradient;
+    }
+}
+
+
+// ************************************************************************* //
+""".replace(">\n", "> \n")
+
+
+def flat(values):
+    """Values of a numpy array or array.array as a list"""
+    if hasattr(values, "reshape"):
+        values = values.reshape(-1)
+    return [float(v) for v in values]
+
+
+class FieldArrayTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.chunkSize = FieldArray.CHUNK_SIZE
+
+    def tearDown(self):
+        FieldArray.CHUNK_SIZE = self.chunkSize
+        shutil.rmtree(self.dir)
+
+    def writeField(self, name, text):
+        fieldPath = path.join(self.dir, name)
+        if name.endswith(".gz"):
+            fid = gzip.open(fieldPath, "wb")
+        else:
+            fid = open(fieldPath, "wb")
+        try:
+            fid.write(text.encode("latin-1"))
+        finally:
+            fid.close()
+        return fieldPath
+
+    def readField(self, fieldPath):
+        if fieldPath.endswith(".gz"):
+            fid = gzip.open(fieldPath, "rb")
+        else:
+            fid = open(fieldPath, "rb")
+        try:
+            return fid.read().decode("latin-1")
+        finally:
+            fid.close()
+
+    def roundTrip(self, name, text):
+        src = self.writeField(name, text)
+        dst = path.join(self.dir, FieldArray.arrayName(name))
+        FieldArray.fromFoam(src, dst, meshId="mesh")
+        back = path.join(self.dir, "back_" + name)
+        FieldArray.toFoam(dst, back)
+        self.assertEqual(self.readField(back), text)
+        return FieldArray.FieldArray(dst)
+
+    def testVectorField(self):
+        fa = self.roundTrip("U", VECTOR_FIELD)
+        self.assertEqual(
+            fa.names(), ["internalField", "boundaryField/inlet/value"]
+        )
+        values = fa.array()
+        if hasattr(values, "shape"):
+            self.assertEqual(values.shape, (3, 3))
+        self.assertEqual(
+            flat(values), [1.5, -2, 0.1, 1e-05, 3, 0, 0, 0, -7.25]
+        )
+        self.assertEqual(
+            flat(fa.array("boundaryField/inlet/value")), [3, 0, 0, 4, 0.5, 0]
+        )
+        self.assertEqual(fa.header["class"], "volVectorField")
+        self.assertEqual(fa.header["object"], "U")
+        self.assertEqual(fa.header["dimensions"], "[0 1 -1 0 0 0 0]")
+        self.assertEqual(fa.header["meshId"], "mesh")
+        for info in fa.header["arrays"]:
+            self.assertEqual(info["offset"] % FieldArray.ALIGNMENT, 0)
+
+    def testScalarFieldWithUniformInternalField(self):
+        fa = self.roundTrip("k", SCALAR_FIELD)
+        self.assertEqual(fa.names(), ["boundaryField/inlet/value"])
+        self.assertEqual(
+            flat(fa.array("boundaryField/inlet/value")), [0.1, 0.2, 1e30, -3]
+        )
+        self.assertRaises(KeyError, fa.array, "internalField")
+
+    def testCompressed(self):
+        fa = self.roundTrip("U.gz", VECTOR_FIELD)
+        self.assertEqual(fa.text(), VECTOR_FIELD)
+
+    def testSmallChunks(self):
+        # lists and values spanning several chunks
+        for chunkSize in [1, 7, 64]:
+            FieldArray.CHUNK_SIZE = chunkSize
+            self.roundTrip("U", VECTOR_FIELD)
+            self.roundTrip("k", SCALAR_FIELD)
+
+    def testWrongLength(self):
+        src = self.writeField(
+            "U", VECTOR_FIELD.replace("List<vector> \n3", "List<vector> \n4")
+        )
+        dst = path.join(self.dir, "U.fa")
+        self.assertRaises(ValueError, FieldArray.fromFoam, src, dst)
+        self.assertEqual(os.listdir(self.dir), ["U"])
+
+    def testBinaryFormat(self):
+        src = self.writeField(
+            "U", VECTOR_FIELD.replace("ascii;", "binary;")
+        )
+        dst = path.join(self.dir, "U.fa")
+        self.assertRaises(ValueError, FieldArray.fromFoam, src, dst)
+        self.assertEqual(os.listdir(self.dir), ["U"])
+
+    def testNotFieldArray(self):
+        src = self.writeField("U", VECTOR_FIELD)
+        self.assertRaises(ValueError, FieldArray.FieldArray, src)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+# -*- coding: us-ascii -*-
+"""Tests of archiving and restoring the fields of cases."""
+import os
+import gzip
+import shutil
+import tempfile
+import unittest
+from os import path
+
+from PyFoamSMHI.contrib.FoamArchive import FoamArchive
+
+CASE = "wspeed_3.0_wdir_0.0"
+
+
+def writeFile(filePath, text):
+    fid = open(filePath, "wb")
+    try:
+        fid.write(text.encode("latin-1"))
+    finally:
+        fid.close()
+
+
+def readFile(filePath):
+    fid = open(filePath, "rb")
+    try:
+        return fid.read().decode("latin-1")
+    finally:
+        fid.close()
+
+
+class FoamArchiveTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fields = []
+        for name in ["U", "k"]:
+            fieldPath = path.join(self.dir, name)
+            writeFile(fieldPath, name + " values\n")
+            self.fields.append(fieldPath)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testCompressed(self):
+        archive = FoamArchive(self.dir, "archive", compress=True, nthreads=1)
+        archive.addFiles(self.fields, CASE)
+        self.assertEqual(
+            sorted(archive.listFilesInDir(CASE)), ["U.gz", "k.gz"]
+        )
+        fid = gzip.open(path.join(archive.path, CASE, "U.gz"), "rb")
+        self.assertEqual(fid.read(), b"U values\n")
+        fid.close()
+
+        self.assertTrue(archive.inArchive(CASE, "U"))
+        self.assertTrue(archive.filesInArchive(CASE, ["U", "k"]))
+        self.assertFalse(archive.filesInArchive(CASE, ["U", "p"]))
+
+        restored = path.join(self.dir, "restored")
+        os.mkdir(restored)
+        archive.restore(CASE, restored, ["U", "k"])
+        for name in ["U", "k"]:
+            self.assertEqual(
+                readFile(path.join(restored, name)), name + " values\n"
+            )
+        self.assertRaises(ValueError, archive.restore, CASE, restored, ["p"])
+
+
+if __name__ == "__main__":
+    unittest.main()
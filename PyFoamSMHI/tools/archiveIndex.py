@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+"""Verify or rebuild the index of a FoamArchive, maintain the object store
+shared by archives and the packs of cases."""
+import sys
+import logging
+from os import path
+from optparse import OptionParser
+
+from PyFoamSMHI.contrib.ArchiveIndex import ArchiveIndex
+from PyFoamSMHI.contrib.FoamArchive import FoamArchive
+from PyFoamSMHI.contrib.ObjectStore import ObjectStore, STORE_DIR
+
+usage = "usage: %prog -a <archiveDirectory> [options]"
+version = "%prog 1.0"
+
+
+def main():
+    parser = OptionParser(usage=usage, version=version)
+
+    parser.add_option("-a", "--archive",
+                      action="store", dest="archive", default=None,
+                      help="Specifies archive directory")
+
+    parser.add_option("--verify",
+                      action="store_true", dest="verify", default=False,
+                      help="Compare the index with the files in the " +
+                      "archive")
+
+    parser.add_option("--checksums",
+                      action="store_true", dest="checksums", default=False,
+                      help="Also compare checksums when verifying")
+
+    parser.add_option("--rebuild",
+                      action="store_true", dest="rebuild", default=False,
+                      help="Rebuild the index from the files in the archive")
+
+    parser.add_option("--dedup",
+                      action="store_true", dest="dedup", default=False,
+                      help="Move the files of the archive into the object " +
+                      "store, sharing identical files")
+
+    parser.add_option("--gc",
+                      action="store_true", dest="gc", default=False,
+                      help="Remove objects not referenced by any archive " +
+                      "from the object store")
+
+    parser.add_option("--pack",
+                      action="store_true", dest="pack", default=False,
+                      help="Move the files of each directory of the " +
+                      "archive to a single pack file")
+
+    parser.add_option("--repack",
+                      action="store_true", dest="repack", default=False,
+                      help="Remove replaced and removed files from packs")
+
+    parser.add_option("--store",
+                      action="store", dest="store", default=None,
+                      help="Object store directory, default is " +
+                      STORE_DIR + " next to the archive")
+
+    (options, args) = parser.parse_args()
+
+    rootLogger = logging.getLogger('')
+    logger = logging.getLogger('archiveIndex')
+    reportLevel = logging.INFO
+    rootLogger.setLevel(reportLevel)
+
+    console = logging.StreamHandler()
+    console.setLevel(reportLevel)
+    formatter = logging.Formatter('%(name)-12s: %(levelname)-8s %(message)s')
+    console.setFormatter(formatter)
+    rootLogger.addHandler(console)
+
+    if len(args) != 0:
+        parser.error("Incorrect number of arguments")
+
+    if options.archive is None:
+        parser.error("Needs to specify archive directory")
+
+    if not (options.verify or options.rebuild or options.dedup or
+            options.gc or options.pack or options.repack):
+        parser.error("Needs to specify --verify, --rebuild, --dedup, " +
+                     "--gc, --pack or --repack")
+
+    archivePath = path.abspath(options.archive)
+    if not path.isdir(archivePath):
+        logger.error("Archive directory does not exist: %s" % archivePath)
+        sys.exit(1)
+
+    if options.store is None:
+        storePath = path.join(path.dirname(archivePath), STORE_DIR)
+    else:
+        storePath = path.abspath(options.store)
+
+    index = ArchiveIndex(archivePath)
+    problems = []
+    if options.verify:
+        problems = index.verify(checksums=options.checksums)
+        for dirName, fileName, problem in problems:
+            logger.warning(
+                "%s: %s" % (problem, path.join(dirName, fileName))
+            )
+        logger.info("Found %i differences in index" % len(problems))
+
+    if options.rebuild:
+        nfiles = index.rebuild()
+        logger.info("Rebuilt index with %i files" % nfiles)
+
+    if options.dedup or options.gc:
+        store = ObjectStore(storePath)
+
+    if options.dedup:
+        nshared = 0
+        files = index.files()
+        files = [
+            f for f in files if path.exists(path.join(archivePath, f[0], f[1]))
+        ]
+        for dirName, fileName, size, checksum, comp in files:
+            if store.adopt(path.join(archivePath, dirName, fileName)):
+                nshared += 1
+        logger.info(
+            "Moved %i files to object store, %i identical to stored files" %
+            (len(files), nshared)
+        )
+
+    if options.pack or options.repack:
+        archive = FoamArchive(
+            path.dirname(archivePath), path.basename(archivePath)
+        )
+
+    if options.pack:
+        dirNames = [
+            d for d in archive.listDirs()
+            if path.isdir(path.join(archivePath, d))
+        ]
+        for dirName in dirNames:
+            archive.packDir(dirName)
+        logger.info("Packed %i directories" % len(dirNames))
+
+    if options.repack:
+        freed = archive.repack()
+        logger.info("Repacked archive, %i bytes freed" % freed)
+
+    if options.gc:
+        store.collect()
+        nobjects, nbytes = store.stats()
+        logger.info(
+            "Object store has %i objects, %i bytes" % (nobjects, nbytes)
+        )
+
+    if not options.rebuild and len(problems) > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,10 @@ from os import path
 import os, glob, time,sys, logging, shutil
 from optparse import OptionParser
 
+from PyFoamSMHI.contrib.Snapshot import cloneFile
+from PyFoamSMHI.contrib import FieldArray
+from PyFoamSMHI.contrib.CasePack import CasePack, SUFFIX as PACK_SUFFIX
+
 #import pdb
 
 usage = "usage: %prog -a <archiveDirectory> -d <destination> [options]"
@@ -25,7 +29,8 @@ def main():
 
     parser.add_option("--copy",
                       action="store_true",dest="copy",default=False,
-                      help="Copy files instead of creating symbolic links")
+                      help="Copy files instead of creating symbolic links, "+
+                      "as reflinks where the file system supports it")
     
     (options, args) = parser.parse_args()
     
@@ -61,14 +66,38 @@ def main():
 
     #pdb.set_trace()
     for fieldDirName in os.listdir(archiveDir):
+        if fieldDirName.endswith(PACK_SUFFIX) and \
+                not fieldDirName.startswith("."):
+            # packed files are extracted
+            pack=CasePack(path.join(archiveDir,fieldDirName))
+            fieldDirName=fieldDirName[:-len(PACK_SUFFIX)]
+            for field in pack.names():
+                if FieldArray.isFieldArray(field):
+                    base=field[:-len(FieldArray.SUFFIX)]
+                    FieldArray.FieldArray(pack.path,pack.entry(field)[0]).toFoam(
+                        path.join(dest,base+"_"+fieldDirName))
+                else:
+                    base,ext=path.splitext(field)
+                    pack.extract(field,path.join(dest,base+"_"+fieldDirName+ext))
+            continue
+        # skip the index and metadata files of the archive
+        if not path.isdir(path.join(archiveDir,fieldDirName)):
+            continue
         for field in os.listdir(path.join(archiveDir,fieldDirName)):
-            base,ext=path.splitext(field)
             src=path.join(archiveDir,fieldDirName,field)
+            if FieldArray.isFieldArray(field):
+                # field arrays are written as fields
+                base=field[:-len(FieldArray.SUFFIX)]
+                FieldArray.toFoam(src,path.join(dest,base+"_"+fieldDirName))
+                continue
+            base,ext=path.splitext(field)
             dst=path.join(dest,base+"_"+fieldDirName+ext)
             if not options.copy:
                 os.symlink(src,dst)
             else:
-                shutil.copy(src,dst)
+                # archived files may be shared by the object store, a
+                # clone shares the data but can be modified separately
+                cloneFile(src,dst)
 
 
     logger.info("Successfully transferred archived fields to destination directory")
@@ -1,15 +1,51 @@
 #!/usr/bin/env python
 # -*- coding: us-ascii -*-
 """Utility to batch run PyFoam runners."""
-import subprocess
 import sys
+import os
+import logging
 from os import path
 from optparse import OptionParser
-from PyFoamSMHI.contrib import ControlFile
+from PyFoamSMHI.contrib import ControlFile, RunLedger, JobExecutor
 
 usage = "usage: %prog controlFile [options] "
 version = "%prog 1.0"
 
+# safety margin applied to the walltime predicted from the run ledger
+WALLTIME_MARGIN = 1.25
+# walltime of the job merging the results of a sharded sweep
+MERGE_WALLTIME = "00:30:00"
+
+
+def suggestWalltime(cf, casePath, runner, shards=1):
+    """Suggest a walltime for a sweep from the run ledger of the case
+    @param shards: number of shards the sweep is split in, the walltime
+    is suggested for a single shard
+    @return: walltime as a string, None if the case has no run history"""
+    if not path.exists(path.join(casePath, RunLedger.LEDGER_FILE)):
+        return None
+    wspeeds = cf.findScalarList("wspeeds:", optional=True, default=[])
+    wdirs = cf.findScalarList("wdirs:", optional=True, default=[])
+    iterations = cf.findScalar("iterations:", optional=True)
+    if iterations is None or len(wspeeds) * len(wdirs) == 0:
+        return None
+    nodes = cf.findScalar("nodes:", optional=True, default=1)
+    CPUs = cf.findScalar("CPUs:", optional=True)
+    if CPUs is None:
+        nprocesses = JobExecutor.CORES_PER_NODE * int(nodes)
+    else:
+        nprocesses = int(CPUs)
+    workers = int(cf.findScalar("workers:", optional=True, default=1))
+    # sweeps are sharded by wind direction
+    nwdirs = (len(wdirs) + shards - 1) // shards
+    ledger = RunLedger.RunLedger(casePath)
+    seconds = ledger.predictSweepTime(
+        runner, nprocesses, workers, iterations, len(wspeeds) * nwdirs
+    )
+    if seconds is None:
+        return None
+    return RunLedger.formatWalltime(WALLTIME_MARGIN * seconds)
+
 
 def main():
     parser = OptionParser(usage=usage, version=version)
@@ -30,11 +66,43 @@ def main():
                       action="store", dest="case", default=None,
                       help="Specifies case directory")
 
+    parser.add_option("-e", "--executor",
+                      action="store", dest="executor", default="slurm",
+                      help="Executor running the jobs, slurm or local " +
+                      "(default is slurm)")
+
+    parser.add_option("--slots",
+                      action="store", type="int", dest="slots", default=None,
+                      help="Number of CPUs used by the local executor " +
+                      "(default is all)")
+
+    parser.add_option("-r", "--runner",
+                      action="store", dest="runner", default="windRunner",
+                      help="Runner started by the batch script, used to " +
+                      "suggest a walltime from the run ledger of the case")
+
     (options, args) = parser.parse_args()
 
+    rootLogger = logging.getLogger('')
+    reportLevel = logging.INFO
+    if options.quiet:
+        reportLevel = logging.WARNING
+    if options.debug:
+        reportLevel = logging.DEBUG
+    rootLogger.setLevel(reportLevel)
+    console = logging.StreamHandler()
+    console.setLevel(reportLevel)
+    formatter = logging.Formatter('%(name)-12s: %(levelname)-8s %(message)s')
+    console.setFormatter(formatter)
+    rootLogger.addHandler(console)
+
     if len(args) != 1:
         parser.error("Incorrect number of arguments")
 
+    executorArgs = {}
+    if options.executor == "local":
+        executorArgs["slots"] = options.slots
+
     cf = ControlFile.ControlFile(fileName=path.abspath(args[0]))
 
     jobname = cf.findString("jobname:", optional=False)
@@ -45,41 +113,78 @@ def main():
     partition = cf.findString("partition:", optional=True)
     batchScript = cf.findString("batchScript:", optional=False)
 
+    shards = int(cf.findScalar("shards:", optional=True, default=1))
+
     if nodes is None and CPUs is None:
         sys.exit("Neither CPUs nor nodes specified in batch resource file")
 
-    execList = ["sbatch", "-J", jobname, "-t", walltime]
-    if nodes is not None:
-        execList.append("-N")
-        execList.append(str(int(nodes)))
-    if CPUs is not None:
-        execList.append("-n")
-        execList.append(str(int(CPUs)))
-    if mem is not None:
-        execList.append("--mem")
-        execList.append(str(int(mem)))
-    if partition is not None:
-        execList.append('-A')
-        execList.append(partition)
-    execList.append(batchScript)
-
-    execList += args
+    wdirs = cf.findScalarList("wdirs:", optional=True, default=[])
+    if shards > len(wdirs) > 0:
+        print "Sweep can not be split in more shards than wind directions"
+        shards = len(wdirs)
 
     if options.case is not None:
-        execList.append("--case")
-        execList.append(options.case)
+        casePath = path.abspath(options.case)
+    else:
+        casePath = os.getcwd()
+    suggestedWalltime = suggestWalltime(
+        cf, casePath, options.runner, shards
+    )
+    if suggestedWalltime is not None:
+        print "Suggested walltime from run ledger: " + suggestedWalltime
+    if walltime == "auto":
+        if suggestedWalltime is None:
+            sys.exit(
+                "walltime is auto, but there are no previous runs " +
+                "of %s in the case to estimate it from" % options.runner
+            )
+        walltime = suggestedWalltime
+
+    command = [batchScript] + args
+    if options.case is not None:
+        command.append("--case")
+        command.append(options.case)
     if options.debug:
-        execList.append("--debug")
+        command.append("--debug")
     if options.logfile:
-        execList.append("--logfile")
-        execList.append(options.logfile)
-
-    runStr = "running: "
-    for x in execList:
-        print(x)
-        runStr += " "+x
-    print runStr
-    subprocess.call(execList)
+        command.append("--logfile")
+        command.append(options.logfile)
+
+    executor = JobExecutor.createExecutor(options.executor, **executorArgs)
+    array = None
+    if shards > 1:
+        # each array task runs the shard given by its task id
+        array = shards
+    job = JobExecutor.Job(
+        jobname, command, script=True, nodes=nodes, CPUs=CPUs,
+        walltime=walltime, mem=mem, account=partition, array=array
+    )
+    try:
+        jobId = executor.submit(job)
+    except OSError, e:
+        sys.exit(str(e))
+    print "Submitted job %s" % jobId
+
+    if shards > 1:
+        mergeCmd = ["mergeShards", "--case", casePath]
+        if options.runner == "speciesRunner":
+            concArchiveDirName = cf.findString(
+                "concArchiveDirName:", optional=True, default="concArchive"
+            )
+            mergeCmd += ["--concArchive", concArchiveDirName]
+        mergeJob = JobExecutor.Job(
+            jobname + "_merge", mergeCmd, CPUs=1, walltime=MERGE_WALLTIME,
+            account=partition, dependencies=[jobId],
+            dependencyType=JobExecutor.AFTER_ANY
+        )
+        try:
+            mergeId = executor.submit(mergeJob)
+        except OSError, e:
+            sys.exit(str(e))
+        print "Submitted job %s merging the shards" % mergeId
+
+    # local jobs are run by this process
+    executor.wait()
 
 if __name__ == "__main__":
     main()
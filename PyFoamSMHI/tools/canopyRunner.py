@@ -9,11 +9,11 @@ from PyFoam.Execution.ConvergenceRunner import ConvergenceRunner
 from PyFoam.Execution.UtilityRunner import UtilityRunner
 from PyFoam.LogAnalysis.StandardLogAnalyzer import StandardLogAnalyzer
 from PyFoam.RunDictionary.SolutionFile import SolutionFile
-from PyFoam.RunDictionary.ParameterFile import ParameterFile
 
 #PyFoamContrib
 from PyFoamSMHI.contrib.ParallelExecutionNSC import LAMMachine
 from PyFoamSMHI.contrib import ConvergenceTable, FoamArchive, ControlFile, CaseHandler
+from PyFoamSMHI.contrib.DictEditor import DictEditor
 from PyFoamSMHI.templates.PyFoamWindRunnerCfTemplate import defaultCf
 
 usage = "usage: %prog controlFile [options] "
@@ -124,6 +124,7 @@ def main():
         nprocesses=8*nodes
     else:
         nprocesses=int(CPUs)
+    decomposeOnce=cf.findBoolean("decomposeOnce:",optional=True,default=False)
     #-----------------------------------
     solver=cf.findString("solver:",default="windFoam")
     softStart=cf.findString("softstart_application:",optional=True)
@@ -150,9 +151,9 @@ def main():
     logger.info("ArchiveToVTK is set to: "+str(archiveVTK))
     logger.info(50*"=")
     
-    controlDict=ParameterFile(ch.controlDict())
-    windDict=ParameterFile(path.join(ch.constantDir(),"windDict"))
-    RASDict=ParameterFile(path.join(ch.constantDir(),"RASProperties"))
+    controlDict=DictEditor(ch.controlDict())
+    windDict=DictEditor(path.join(ch.constantDir(),"windDict"))
+    RASDict=DictEditor(path.join(ch.constantDir(),"RASProperties"))
 
     compression=controlDict.readParameter("writeCompression")
     if compression=="compressed" or compression=="on":
@@ -169,6 +170,7 @@ def main():
         Lam.writeScotch(ch)
     
     controlDict.replaceParameter("stopAt", "nextWrite")
+    controlDict.write()
     
     timeLeft=iterations*nruns*20
     timeSpent=05
@@ -182,6 +184,7 @@ def main():
         for wdir in wdirs:
             timeInit=time.time()        
             controlDict.replaceParameter("writeInterval",str(iterations))
+            controlDict.write()
             logger.info("Running calculations for dir: "+ str(wdir)+ " speed: "+ str(wspeed))
             logger.info("Time left: "+str(timeLeft/60.0)+"min, Time spent: "+str(timeSpent/60.0)+"min")
             logger.info("Estimated time for finish: "+str(timeEstimated[:4]))
@@ -207,6 +210,7 @@ def main():
                 windDict.replaceParameter("U10",str(wspeed))
                 windDict.replaceParameter("windDirection",str(wdir))
                 windDict.replaceParameter("z0",str(inletProfile_z0))
+                windDict.write()
                 for initCmd in initCmds:
                     initUtil=UtilityRunner(argv=[initCmd,"-case",casePath],silent=True,logname=initCmd)
                     initUtil.start()
@@ -219,8 +223,14 @@ def main():
             if nprocesses>1:
                 if Lam.machineOK():
                     decomposeCmd="decomposePar"
-                    decomposeUtil=UtilityRunner(argv=[decomposeCmd,"-case",casePath],silent=True,logname="decomposePar")
-                    logger.info("...Decomposing case to run on"+str(Lam.cpuNr())+str(" of processors"))
+                    if decomposeOnce and ch.isDecomposed(Lam.cpuNr()):
+                        #mesh is already decomposed, only refresh fields
+                        decomposeArgs=["-fields"]
+                        logger.info("...Decomposing fields of case")
+                    else:
+                        decomposeArgs=["-force"]
+                        logger.info("...Decomposing case to run on"+str(Lam.cpuNr())+str(" of processors"))
+                    decomposeUtil=UtilityRunner(argv=[decomposeCmd]+decomposeArgs+["-case",casePath],silent=True,logname="decomposePar")
                     decomposeUtil.start()
                     if decomposeUtil.runOK():
                         logger.info("Case decomposed!")
@@ -238,6 +248,8 @@ def main():
                 RASDict.replaceParameter("RASModel","kEpsilon")
                 controlDict.replaceParameter("stopAt","nextWrite")
                 controlDict.replaceParameter("writeInterval","50")
+                RASDict.write()
+                controlDict.write()
                 logger.info("...Softstarting using "+softStart)
                 windFoamSolver = ConvergenceRunner(StandardLogAnalyzer(),argv=[softStart,"-case",casePath],silent=True,lam=Lam,logname=softStart)
                 windFoamSolver.start()
@@ -248,6 +260,8 @@ def main():
                     sys.exit()
                 RASDict.replaceParameter("RASModel","kEpsilon_canopy")
                 controlDict.replaceParameter("writeInterval",str(iterations))
+                RASDict.write()
+                controlDict.write()
 # The folowing line is to copy the landuse and LAD-files after the first iterations with simpleFoam
                 ch.execute("for file in "+os.path.join(casePath,"processor*/0/[Ll]*") + r'; do for folder in ${file%0*}*; do [ -e ${folder}/`basename ${file}` ] || cp $file ${folder}/`basename ${file}`; done; done')
 
@@ -272,9 +286,13 @@ def main():
                     logger.error("Error while running recontructPar")
                     sys.exit()
     
-                logger.info("Removing decomposed mesh")
-                ch.execute("rm -r "+os.path.join(casePath,"processor*"))
-                logger.info("Removed decomposed mesh!")
+                if decomposeOnce:
+                    ch.clearProcessorResults()
+                    logger.info("Removed results from decomposed case")
+                else:
+                    logger.info("Removing decomposed mesh")
+                    ch.execute("rm -r "+os.path.join(casePath,"processor*"))
+                    logger.info("Removed decomposed mesh!")
             
             convTable.addResidual("wd_"+str(wdir)+"_ws_"+str(wspeed),solver,"linear_Ux",casesRun+1)
             convTable.addResidual("wd_"+str(wdir)+"_ws_"+str(wspeed),solver,"linear_Uy",casesRun+1)
@@ -326,13 +344,13 @@ def main():
             logger.info("Restored initital fields from backup copy")
             
             #restoring windData dictionary to original state
-            windDict.purgeFile()
+            windDict.rollback()
             convTable.writeProbes()
             convTable.writeResiduals()
             logger.info("Residuals and probes from solver windFoam written to case/convergence directory")
             
     #Restoring controlDict to original state
-    controlDict.purgeFile()
+    controlDict.rollback()
     logger.info("Finished batch calculation!")
 
 if __name__ == "__main__":
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+"""Convert fields between OpenFOAM ascii format and field array files."""
+import sys
+import logging
+from os import path
+from optparse import OptionParser
+
+from PyFoamSMHI.contrib import FieldArray
+
+usage = "usage: %prog -i <input> -o <output> [options]"
+version = "%prog 1.0"
+
+
+def main():
+    parser = OptionParser(usage=usage, version=version)
+
+    parser.add_option("-i", "--input",
+                      action="store", dest="input", default=None,
+                      help="Field file, or field array file (" +
+                      FieldArray.SUFFIX + ") to write as a field file")
+
+    parser.add_option("-o", "--output",
+                      action="store", dest="output", default=None,
+                      help="File to write, compressed if ending with .gz")
+
+    parser.add_option("-m", "--mesh",
+                      action="store", dest="mesh", default=None,
+                      help="polyMesh directory of the field, to store the " +
+                      "mesh id in the field array file")
+
+    parser.add_option("--info",
+                      action="store_true", dest="info", default=False,
+                      help="List the arrays of a field array file")
+
+    (options, args) = parser.parse_args()
+
+    rootLogger = logging.getLogger('')
+    logger = logging.getLogger('fieldArray')
+    reportLevel = logging.INFO
+    rootLogger.setLevel(reportLevel)
+
+    console = logging.StreamHandler()
+    console.setLevel(reportLevel)
+    formatter = logging.Formatter('%(name)-12s: %(levelname)-8s %(message)s')
+    console.setFormatter(formatter)
+    rootLogger.addHandler(console)
+
+    if len(args) != 0:
+        parser.error("Incorrect number of arguments")
+
+    if options.input is None:
+        parser.error("Needs to specify input file")
+
+    if not path.exists(options.input):
+        logger.error("Input file does not exist: %s" % options.input)
+        sys.exit(1)
+
+    if options.info:
+        fa = FieldArray.FieldArray(options.input)
+        for key in ("object", "class", "dimensions", "meshId"):
+            logger.info("%-12s %s" % (key, fa.header[key]))
+        for info in fa.header["arrays"]:
+            logger.info("%-40s List<%s> %s" % (
+                info["name"], info["type"],
+                "x".join([str(n) for n in info["shape"]])))
+        return
+
+    if options.output is None:
+        parser.error("Needs to specify output file")
+
+    if FieldArray.isFieldArray(options.input):
+        FieldArray.toFoam(options.input, options.output)
+    else:
+        meshId = None
+        if options.mesh is not None:
+            meshId = FieldArray.meshId(options.mesh)
+        try:
+            FieldArray.fromFoam(options.input, options.output, meshId)
+        except ValueError as e:
+            logger.error("Could not convert %s: %s" % (options.input, e))
+            sys.exit(1)
+    logger.info("Wrote %s" % options.output)
+
+
+if __name__ == "__main__":
+    main()
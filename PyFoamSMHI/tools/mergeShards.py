@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+"""Merge the results of a sweep run in shards into the main case."""
+import sys
+import os
+import logging
+from os import path
+from optparse import OptionParser
+
+from PyFoamSMHI.contrib import (
+    ConvergenceTable, FoamArchive, ExtendedParameterFile, Sharding
+)
+
+usage = "usage: %prog [options]"
+version = "%prog 1.0"
+
+
+def main():
+    parser = OptionParser(usage=usage, version=version)
+
+    parser.add_option("-c", "--case",
+                      action="store", dest="case", default=None,
+                      help="Specifies case directory")
+
+    parser.add_option("--concArchive",
+                      action="store", dest="concArchive", default=None,
+                      help="Name of concentration archive to update the " +
+                      "concFileList of the statisticsDict from")
+
+    (options, args) = parser.parse_args()
+
+    rootLogger = logging.getLogger('')
+    logger = logging.getLogger('mergeShards')
+    reportLevel = logging.INFO
+    rootLogger.setLevel(reportLevel)
+
+    console = logging.StreamHandler()
+    console.setLevel(reportLevel)
+    formatter = logging.Formatter('%(name)-12s: %(levelname)-8s %(message)s')
+    console.setFormatter(formatter)
+    rootLogger.addHandler(console)
+
+    if len(args) != 0:
+        parser.error("Incorrect number of arguments")
+
+    if options.case is not None:
+        casePath = path.abspath(options.case)
+    else:
+        casePath = os.getcwd()
+
+    shardPaths = Sharding.shardPaths(casePath)
+    if len(shardPaths) == 0:
+        logger.error("No shards found for case: %s" % casePath)
+        sys.exit(1)
+
+    # tables of the main case are kept, e.g. from earlier sweeps
+    convTable = ConvergenceTable.ConvergenceTable(casePath)
+    convTable.readTables()
+    for shardPath in shardPaths:
+        resDir = path.join(shardPath, "convergence")
+        if not path.exists(resDir):
+            logger.warning("No convergence tables in %s" % shardPath)
+            continue
+        convTable.readTables(resDir)
+        logger.info("Read convergence tables from %s" % shardPath)
+    convTable.writeProbes()
+    convTable.writeResiduals()
+    convTable.writeStopInfo()
+    logger.info("Wrote merged convergence tables to case/convergence")
+
+    if options.concArchive is not None:
+        concArchive = FoamArchive.FoamArchive(casePath, options.concArchive)
+        statisticsDict = ExtendedParameterFile.ExtendedParameterFile(
+            path.join(casePath, "system", "statisticsDict")
+        )
+        statisticsDict.replaceParameterList(
+            "concFileList", concArchive.listFilesInDirs("spec_")
+        )
+        logger.info("Updated concFileList in statisticsDict")
+
+
+if __name__ == "__main__":
+    main()
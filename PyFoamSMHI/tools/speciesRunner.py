@@ -2,25 +2,37 @@
 
 from os import path
 import os
+import glob
 import time
 import sys
+import shutil
 import logging
 import argparse
+import threading
 
 # PyFoam modules
 from PyFoam.Execution.ConvergenceRunner import ConvergenceRunner
 from PyFoam.Execution.UtilityRunner import UtilityRunner
 from PyFoam.LogAnalysis.StandardLogAnalyzer import StandardLogAnalyzer
-from PyFoam.RunDictionary.ParameterFile import ParameterFile
 
 # PyFoamContrib
-from PyFoamSMHI.contrib.ParallelExecutionNSC import LAMMachine
+from PyFoamSMHI.contrib.SweepExecutor import SweepExecutor
+from PyFoamSMHI.contrib.DictEditor import DictEditor
+from PyFoamSMHI.contrib.PostProcessingPipeline import PostProcessingPipeline
+from PyFoamSMHI.contrib.ConvergenceMonitor import (
+    ConvergenceMonitor, parseCriteria, STOP_ITERATIONS
+)
 from PyFoamSMHI.contrib import (
     ConvergenceTable,
     FoamArchive,
     ControlFile,
     CaseHandler,
-    ExtendedParameterFile
+    ExtendedParameterFile,
+    SweepJournal,
+    RunLedger,
+    Sharding,
+    Execution,
+    ObjectStore
 )
 from PyFoamSMHI.contrib.utilities import (
     generateCf,
@@ -37,6 +49,11 @@ CORES_PER_NODE = 16
 FLOW_FILES = ["U", "p", "k", "epsilon"]
 
 
+def caseDirName(wspeed, wdir):
+    """Name of the archive directory for a case"""
+    return "wspeed_" + str(wspeed) + "_wdir_" + str(wdir)
+
+
 def main():
     parser = argparse.ArgumentParser(description=__doc__)
 
@@ -64,6 +81,13 @@ def main():
         help="Specifies case directory (default is current workdir)",
     )
 
+    parser.add_argument(
+        "-s", "--shard",
+        action="store", dest="shard", type=int, default=None,
+        help="Index of shard to run when the sweep is split in shards " +
+        "(default is the job array task id)"
+    )
+
     parser.add_argument(
         action="store", dest="controlfile",
         help="Controlfile for speciesRunner"
@@ -101,31 +125,81 @@ def main():
         nprocesses = CORES_PER_NODE * nodes
     else:
         nprocesses = int(CPUs)
+    workers = int(cf.findScalar("workers:", optional=True, default=1))
+    decomposeOnce = cf.findBoolean(
+        "decomposeOnce:", optional=True, default=False
+    )
+    postProcessWorkers = int(
+        cf.findScalar("postProcessWorkers:", optional=True, default=0)
+    )
+    convergenceCriteria = parseCriteria(
+        cf.findStringList("convergenceCriteria:", optional=True, default=[])
+    )
+    plateauWindow = cf.findInt(
+        "convergencePlateauWindow:", optional=True, default=None
+    )
+    plateauSlope = cf.findScalar(
+        "convergencePlateauSlope:", optional=True, default=None
+    )
+    compressArchive = cf.findBoolean(
+        "compressArchive:", optional=True, default=False
+    )
+    dedupArchive = cf.findBoolean(
+        "dedupArchive:", optional=True, default=False
+    )
+    archiveCompressionLevel = int(cf.findScalar(
+        "archiveCompressionLevel:", optional=True,
+        default=Execution.GZIP_LEVEL
+    ))
+    shards = int(cf.findScalar("shards:", optional=True, default=1))
+    shard = Sharding.shardIndex(args.shard, shards)
     #-----------------------------------
     solver = cf.findString("solver:", default="speciesFoam")
     initCmds = cf.findStringList("initialize:", default=[], optional=True)
-    flowArchive = FoamArchive.FoamArchive(args.case, flowArchiveDirName)
-    concArchive = FoamArchive.FoamArchive(args.case, concArchiveDirName)
-
-    nwdir = len(wdirs)
-    convTable = ConvergenceTable.ConvergenceTable(args.case)
+    # archives and ledger are shared by all shards of the sweep
+    store = None
+    if dedupArchive:
+        store = ObjectStore.ObjectStore(
+            path.join(args.case, ObjectStore.STORE_DIR)
+        )
+    flowArchive = FoamArchive.FoamArchive(
+        args.case, flowArchiveDirName, store=store
+    )
+    concArchive = FoamArchive.FoamArchive(
+        args.case, concArchiveDirName, compress=compressArchive,
+        level=archiveCompressionLevel, store=store
+    )
+    ledger = RunLedger.RunLedger(args.case)
+    casePath = args.case
+    if shard is not None:
+        # each shard runs in a clone of the case
+        casePath = Sharding.createShard(ch, shard)
+        ch = CaseHandler.CaseHandler(casePath)
+    runWdirs = Sharding.shardDirections(wdirs, shard, shards)
+    Execution.setMetricsFile(path.join(casePath, Execution.METRICS_FILE))
+
+    nwdir = len(runWdirs)
+    convTable = ConvergenceTable.ConvergenceTable(casePath)
     
     log.info("Running speciesFoam")
     log.info("Setup overview:")
     log.info(25 * "-")
     log.info("Case: " + caseName)
     log.info(25 * "-")
-    log.info("Wind directions are: " + str(wdirs))
+    if shard is not None:
+        log.info("Shard %i of %i" % (shard, shards))
+    log.info("Wind directions are: " + str(runWdirs))
     log.info("Wind speeds are: " + str(wspeeds))
     nruns = nwdir * len(wspeeds)
     log.info("Total number of runs: " + str(nruns))
     log.info(25 * "-")
     log.info("Number of iterations are: " + str(iterations))
     log.info("Number of nodes are: " + str(nodes))
+    log.info("Number of concurrent cases are: " + str(workers))
     log.info("Fields to be archived: " + str(fieldsToArchive))
     log.info(50 * "=")
     
-    controlDict = ParameterFile(ch.controlDict())
+    controlDict = DictEditor(ch.controlDict())
     statisticsDict = ExtendedParameterFile.ExtendedParameterFile(
         path.join(ch.systemDir(), "statisticsDict")
     )
@@ -137,229 +211,405 @@ def main():
         filesToArchive = fieldsToArchive
         flowFiles = FLOW_FILES
 
-    # booting lammachine for parallell execution
-    if nprocesses > 1:
-        Lam = LAMMachine(nr=nprocesses)
-        Lam.writeScotch(ch)    
-    controlDict.replaceParameter("stopAt", "nextWrite")
-    
-    timeLeft = iterations * nruns * 20
-    timeSpent = 05
-    timeCase = iterations * 20
-    timeEstimated = time.localtime(time.time() + timeLeft)
-    casesRun = 0
-    casesLeft = nruns
-    
-    log.info("Backing up initial fields")
-    ch.backUpInitialFields()
-    log.info("Backup made of initial fields")
-    for wspeed in wspeeds:
-        for wdir in wdirs:
-            timeInit = time.time()
-            dirName = "wspeed_" + str(wspeed) + "_wdir_" + str(wdir)
-
-
-            if concArchive.inArchive(dirName=dirName) and not restoreArchived:
-                log.info('Results already in concentration archive, moving on...')
-                casesRun += 1
-                casesLeft -= 1
-                timeCase = time.time() - timeInit
-                timeSpent += timeCase
-                timeLeft = casesLeft * timeCase
-                timeEstimated = time.localtime(time.time() + timeLeft)
-                continue
-            
-            if not flowArchive.inArchive(dirName=dirName):
-                log.warning("Missing flow files in dir: %s, moving on..." % dirName)
-                casesRun += 1
-                casesLeft -= 1
-                timeCase = time.time() - timeInit
-                timeSpent += timeCase
-                timeLeft = casesLeft * timeCase
-                timeEstimated = time.localtime(time.time() + timeLeft)
-                continue
-
-            controlDict.replaceParameter("writeInterval", str(iterations))
-            log.info(
-                "Running calculations for dir: " +
-                str(wdir) + " speed: " + str(wspeed)
-            )
-            log.info(
-                "Time left: " + str(timeLeft / 60.0) +
-                "min, Time spent: "+str(timeSpent / 60.0) + "min"
-            )
-            log.info(
-                "Estimated time for finish: " + str(timeEstimated[:4])
-            )
-            log.info(
-                "Cases finished: " + str(casesRun) +
-                " cases left: " + str(casesLeft)
+    journal = SweepJournal.SweepJournal(casePath, "speciesRunner")
+    interrupted = journal.isInterrupted()
+    if interrupted:
+        # dictionaries and fields may be left modified by the last run
+        log.info(
+            "Previous sweep was interrupted, unfinished cases: " +
+            str(journal.unfinishedCases())
+        )
+        journal.restoreDictionaries()
+        ch.clearResults()
+        ch.restoreInitialFields()
+        log.info("Restored dictionaries and initial fields")
+    else:
+        log.info("Backing up initial fields")
+        ch.backUpInitialFields()
+        log.info("Backup made of initial fields")
+    journal.startSweep([path.relpath(ch.controlDict(), casePath)])
+
+    # working copies of the case, each booting its own lammachine
+    # for parallell execution
+    executor = SweepExecutor(ch, nworkers=workers, nprocesses=nprocesses)
+    if interrupted:
+        for worker in executor.workers:
+            if worker.case is not ch:
+                journal.restoreDictionaries(worker.case.name)
+                worker.case.clearResults()
+                worker.case.restoreInitialFields()
+    ledger.startSweep(
+        "speciesRunner", nprocesses, executor.nworkers, iterations, nruns
+    )
+    pipeline = PostProcessingPipeline(nworkers=postProcessWorkers)
+    stagingDir = path.join(casePath, "stagedResults")
+    statisticsLock = threading.Lock()
+
+    def runCase(worker, case):
+        """Run a single species case in the case directory of a worker"""
+        wspeed, wdir, runIndex = case
+        wch = worker.case
+        Lam = worker.lam
+        dirName = caseDirName(wspeed, wdir)
+        timer = RunLedger.StageTimer()
+        timer.start("setup")
+
+        # edited in memory and written once
+        wControlDict = DictEditor(wch.controlDict())
+        wControlDict.replaceParameter("stopAt", "nextWrite")
+        wControlDict.replaceParameter("writeInterval", str(iterations))
+        wControlDict.write()
+        log.info(
+            "Running calculations for dir: " +
+            str(wdir) + " speed: " + str(wspeed) +
+            " in " + path.basename(wch.name)
+        )
+        wch.clearResults()
+        log.info("...Modifying bc:s")
+        for f in flowFiles:
+            Execution.remove(path.join(wch.initialDir(), f))
+        wch.modWindDir(wch.initialDir(), wdir)
+        log.info("bc:s modified!")
+        log.info("Restoring archived flow fields")
+        flowArchive.restore(dirName, wch.initialDir(), flowFiles)
+        log.info("Restored archived flow fields!")
+        journal.record(dirName, SweepJournal.RESTORED)
+
+        for initCmd in initCmds:
+            initUtil = UtilityRunner(
+                argv=[initCmd, "-case", wch.name],
+                silent=True,
+                logname=initCmd
             )
-            log.info(" ")
-            ch.clearResults()
-            log.info("...Modifying bc:s")
-            for f in flowFiles:
-                ch.execute("rm " + path.join(ch.initialDir(), f))
-            ch.modWindDir(ch.initialDir(), wdir)
-            log.info("bc:s modified!")
-            log.info("Restoring archived flow fields")
-            flowArchive.restore(dirName, ch.initialDir(), flowFiles)
-            #                for filename in flowFiles:
-            #                    flowArchive.getFile(
-            #                        outputFile=path.join(ch.initialDir(), filename),
-            #                        fileName=filename, archiveDirName=dirName
-            #                    )
-            log.info("Restored archived flow fields!")
-
-            for initCmd in initCmds:
-                initUtil = UtilityRunner(
-                    argv=[initCmd, "-case", args.case],
-                    silent=True,
-                    logname=initCmd
+            initUtil.start()
+            if initUtil.runOK():
+                log.info(
+                    "Successfully finished: %s" % initCmd
                 )
-                initUtil.start()
-                if initUtil.runOK():
-                    log.info(
-                        "Successfully finished: %s" % initCmd
-                    )
+            else:
+                log.error(
+                    "Error when running: %s" % initCmd
+                )
+                sys.exit(1)
+
+        timer.start("decompose")
+        if Lam is not None:
+            if Lam.machineOK():
+                decomposeCmd = "decomposePar"
+                if decomposeOnce and wch.isDecomposed(Lam.cpuNr()):
+                    # mesh is already decomposed, only refresh fields
+                    decomposeArgs = ["-fields"]
+                    log.info("Decomposing fields of case")
                 else:
-                    log.error(
-                        "Error when running: %s" % initCmd
-                    )
-                    sys.exit(1)
-
-            if nprocesses > 1:
-                if Lam.machineOK():
-                    decomposeCmd = "decomposePar"
-                    decomposeUtil = UtilityRunner(
-                        argv=[decomposeCmd, "-case", args.case],
-                        silent=True, logname="decomposePar"
-                    )
+                    decomposeArgs = ["-force"]
                     log.info(
                         "Decomposing case for %i processors" % Lam.cpuNr()
                     )
-                    decomposeUtil.start()
-                    if decomposeUtil.runOK():
-                        log.info("Case decomposed!")
-                    else:
-                        log.error("Error when running decomposePar")
-                        sys.exit()
+                decomposeUtil = UtilityRunner(
+                    argv=[decomposeCmd] + decomposeArgs +
+                    ["-case", wch.name],
+                    silent=True, logname="decomposePar"
+                )
+                decomposeUtil.start()
+                if decomposeUtil.runOK():
+                    log.info("Case decomposed!")
+                    journal.record(dirName, SweepJournal.DECOMPOSED)
                 else:
-                    log.error("Error: Could not start lam-machine")
+                    log.error("Error when running decomposePar")
                     sys.exit()
             else:
-                Lam = None
-                log.info("Serial Run chosen!")
-
-            log.info("...Running solver for species")
-            FoamSolver = ConvergenceRunner(
-                StandardLogAnalyzer(),
-                argv=[solver, "-case", args.case],
-                silent=True, lam=Lam, logname=solver
+                log.error("Error: Could not start lam-machine")
+                sys.exit()
+        else:
+            log.info("Serial Run chosen!")
+
+        log.info("...Running solver for species")
+        timer.start("solve")
+        analyzer = StandardLogAnalyzer()
+        monitor = None
+        if len(convergenceCriteria) > 0:
+            monitor = ConvergenceMonitor(
+                wch.controlDict(), convergenceCriteria,
+                plateauWindow=plateauWindow, plateauSlope=plateauSlope
+            )
+            analyzer.addAnalyzer("convergenceCriteria", monitor)
+        FoamSolver = ConvergenceRunner(
+            analyzer,
+            argv=[solver, "-case", wch.name],
+            silent=True, lam=Lam, logname=solver
+        )
+        FoamSolver.start()
+        # the solver writes time directories in the case
+        wch.invalidate()
+        if FoamSolver.runOK():
+            log.info("Iterations finished for speciesFoam")
+        else:
+            log.error("Error while running speciesFoam")
+            sys.exit()
+
+        if monitor is not None:
+            stopReason = monitor.reason
+        else:
+            stopReason = STOP_ITERATIONS
+        journal.record(dirName, SweepJournal.SOLVED, stopReason)
+
+        timer.start("postProcess")
+        if pipeline.nworkers > 0:
+            # move results out of the way and continue with next case
+            # while they are reconstructed and archived in background
+            stagingPath = path.join(stagingDir, dirName)
+            wch.stageResults(
+                stagingPath, keepDecomposition=decomposeOnce,
+                extraDirs=[solver + ".analyzed", "probes"]
             )
-            FoamSolver.start()
-            if FoamSolver.runOK():
-                log.info("Iterations finished for speciesFoam")
+            pipeline.submit(
+                dirName, postProcess, stagingPath, case, Lam is not None,
+                stopReason
+            )
+        else:
+            postProcess(wch.name, case, Lam is not None, stopReason)
+            if Lam is not None and decomposeOnce:
+                wch.clearProcessorResults()
+                log.info("Removed results from decomposed case")
+            elif Lam is not None:
+                log.info("Removing decomposed mesh")
+                wch.removeProcessorDirs()
+                log.info("Removed decomposed mesh!")
+
+        timer.start("cleanup")
+        wch.clearResults()
+        wch.restoreInitialFields()
+        log.info("Restored initital fields")
+        # Restoring controlDict to original state
+        wControlDict.rollback()
+        if monitor is not None:
+            iterationsRun = monitor.iterations
+        else:
+            iterationsRun = iterations
+        ledger.addCase(
+            dirName, wspeed, wdir, iterationsRun, stopReason, timer
+        )
+        return dirName
+
+    def postProcess(pcasePath, case, decomposed, stopReason):
+        """Reconstruct and archive a finished case and add its convergence
+        @param pcasePath: case holding the results, this is a staging case
+        when post-processing runs in the background
+        @param decomposed: True if the case was run in parallel
+        @param stopReason: why the solver stopped"""
+        wspeed, wdir, runIndex = case
+        dirName = caseDirName(wspeed, wdir)
+        timeStart = time.time()
+        if decomposed:
+            log.info("Reconstructing decomposed case...")
+            reconstructCmd = "reconstructPar"
+            reconstructUtil = UtilityRunner(
+                argv=[reconstructCmd, "-latestTime", "-case", pcasePath],
+                silent=True, logname="reconstrucPar"
+            )
+            reconstructUtil.start()
+            if reconstructUtil.runOK():
+                log.info("recunstruction ready!")
             else:
-                log.error("Error while running speciesFoam")
+                log.error("Error while running recontructPar")
                 sys.exit()
+            journal.record(dirName, SweepJournal.RECONSTRUCTED, stopReason)
+        pch = CaseHandler.CaseHandler(pcasePath)
+
+        iterationsReady = (
+            int(pch.getLast()) -
+            int(path.basename(ch.initialDir()))
+        )
+        if iterationsReady < iterations and \
+           stopReason == STOP_ITERATIONS:
+            log.warning(
+                "Run was aborted before finalizing" +
+                " the wanted number of iterations"
+            )
+            log.warning(
+                "Guessing that nan:s were present in results. " +
+                "Removing results from current run and moving on"
+            )
 
-            if nprocesses > 1:
-                log.info("Reconstructing decomposed case...")
-                reconstructCmd = "reconstructPar"
-                reconstructUtil = UtilityRunner(
-                    argv=[reconstructCmd, "-case", args.case],
-                    silent=True, logname="reconstrucPar"
-                )
-                reconstructUtil.start()
-                if reconstructUtil.runOK():
-                    log.info("recunstruction ready!")
-                else:
-                    log.error("Error while running recontructPar")
-                    sys.exit()
+        log.info("Archiving results")
+        # save latest concentration result files
+        solFiles = [
+            f for f in os.listdir(pch.latestDir())
+            if f[:4] == "spec" and f[:12] != "spec_default" and
+            ".bak" not in f and "~" not in f and "#" not in f
+        ]
+        runId = "wd_" + str(wdir) + "_ws_" + str(wspeed)
+        convTable.addStopInfo(runId, runIndex, iterationsReady, stopReason)
+        # a case left partially archived is removed when resuming
+        journal.record(dirName, SweepJournal.ARCHIVING, stopReason)
+        concArchive.addFiles(
+            [path.join(pch.latestDir(), f) for f in solFiles],
+            dirName=dirName
+        )
+        for filename in solFiles:
+            convTable.addResidual(
+                runId, "speciesFoam", "linear_" + filename,
+                runIndex, caseDir=pcasePath
+            )
+            convTable.addProbes(
+                runId, filename, runIndex, caseDir=pcasePath
+            )
+        log.info(
+            "Residuals and probes from solver " +
+            "speciesFoam added to convergence table"
+        )
+
+        journal.record(dirName, SweepJournal.ARCHIVED)
+
+        log.info("Finished wdir: %f, wspeed: %f, Last iter: %s" % (
+            wdir, wspeed, pch.getLast())
+        )
+        log.info(" ")
+
+        # Adding the list of names of archived concentration
+        # files to the statisticsDict dictionary
+        with statisticsLock:
+            archivedConcFiles = [
+                path.join(concArchive.path, dirName, f)
+                for f in concArchive.listFilesInDir(dirName) if "spec_" in f
+            ]
+            statisticsDict.appendParameterList(
+                "concFileList", archivedConcFiles
+            )
 
-                log.info("Removing decomposed mesh")
-                ch.execute(
-                    "rm -r " + os.path.join(args.case, "processor*")
-                )
-                log.info("Removed decomposed mesh!")
+        convTable.writeProbes()
+        convTable.writeResiduals()
+        convTable.writeStopInfo()
+        log.info(
+            "Residuals and probes from solver speciesFoam " +
+            "written to case/convergence directory"
+        )
+        if path.dirname(pcasePath) == stagingDir:
+            shutil.rmtree(pcasePath)
+            ledger.addStage(
+                dirName, "backgroundPostProcess", time.time() - timeStart
+            )
 
-            iterationsReady = (
-                int(ch.getLast()) -
-                int(path.basename(ch.initialDir()))
+    progress = {
+        "casesRun": 0,
+        "casesLeft": nruns,
+        "solverRunsLeft": 0,
+        "timeStart": time.time()
+    }
+
+    def caseFinished(case, result=None):
+        """Book-keeping when a case is done, called in the main thread"""
+        progress["casesRun"] += 1
+        progress["casesLeft"] -= 1
+        if result is not None:
+            progress["solverRunsLeft"] -= 1
+        timeSpent = time.time() - progress["timeStart"]
+        timeLeft = ledger.predictRemaining(
+            progress["solverRunsLeft"], iterations
+        )
+        if timeLeft is None:
+            timeLeft = (
+                progress["casesLeft"] * timeSpent / progress["casesRun"]
             )
-            if iterationsReady < iterations:
-                log.warning(
-                    "Run was aborted before finalizing" +
-                    " the wanted number of iterations"
-                )
+        timeEstimated = time.localtime(time.time() + timeLeft)
+        log.info(
+            "Time left: " + str(timeLeft / 60.0) +
+            "min, Time spent: "+str(timeSpent / 60.0) + "min"
+        )
+        log.info(
+            "Estimated time for finish: " +
+            time.strftime("%Y-%m-%d %H:%M", timeEstimated)
+        )
+        log.info(
+            "Cases finished: " + str(progress["casesRun"]) +
+            " cases left: " + str(progress["casesLeft"])
+        )
+
+    cases = []
+    resumedCases = []
+    runIndex = 0
+    for wspeed in wspeeds:
+        for wdir in wdirs:
+            runIndex += 1
+            if wdir not in runWdirs:
+                continue
+            dirName = caseDirName(wspeed, wdir)
+            state = journal.state(dirName)
+            # archives of cases in other states are complete, e.g. from
+            # an earlier sweep when restoreArchived is set
+            if concArchive.inArchive(dirName=dirName) and \
+               state in SweepJournal.PARTIAL_STATES:
                 log.warning(
-                    "Guessing that nan:s were present in results. " +
-                    "Removing results from current run and moving on"
+                    "Removing partially archived case: %s" % dirName
                 )
+                concArchive.removeDir(dirName)
 
-            log.info("Archiving results")
-            # save latest concentration result files
-            solFiles = [
-                f for f in os.listdir(ch.latestDir())
-                if f[:4] == "spec" and f[:12] != "spec_default" and
-                ".bak" not in f and "~" not in f and "#" not in f
-            ]
-            for filename in solFiles:
-                dirName = "wspeed_" + str(wspeed) + "_wdir_" + str(wdir)
-                concArchive.addFile(
-                    path.join(ch.latestDir(), filename), dirName=dirName
+            if concArchive.inArchive(dirName=dirName) and \
+               not restoreArchived:
+                log.info(
+                    'Results for %s already in concentration archive, '
+                    'moving on...' % dirName
                 )
-                convTable.addResidual(
-                    "wd_" + str(wdir) + "_ws_" + str(wspeed),
-                    "speciesFoam", "linear_" + filename,
-                    casesRun+1
+                caseFinished((wspeed, wdir, runIndex))
+                continue
+
+            if not flowArchive.inArchive(dirName=dirName):
+                log.warning(
+                    "Missing flow files in dir: %s, moving on..." % dirName
                 )
-                convTable.addProbes(
-                    "wd_" + str(wdir) + "_ws_" + str(wspeed),
-                    filename,
-                    casesRun + 1
+                caseFinished((wspeed, wdir, runIndex))
+                continue
+            stagingPath = path.join(stagingDir, dirName)
+            if state in (SweepJournal.SOLVED, SweepJournal.RECONSTRUCTED,
+                         SweepJournal.ARCHIVING) \
+               and path.exists(stagingPath):
+                log.info(
+                    "Resuming post-processing of solved case: %s" % dirName
                 )
-            log.info(
-                "Residuals and probes from solver " +
-                "speciesFoam added to convergence table"
-            )
-
-            # Adding the list of names of archived concentration
-            # files to the statisticsDict dictionary
-            archivedConcFiles = concArchive.listFilesInDirs("spec_")
-            statisticsDict.replaceParameterList(
-                "concFileList", archivedConcFiles
-            )
+                resumedCases.append((wspeed, wdir, runIndex))
+                continue
+            journal.record(dirName, SweepJournal.QUEUED)
+            cases.append((wspeed, wdir, runIndex))
 
-            log.info("Finished wdir: %f, wspeed: %f, Last iter: %s" % (
-                wdir, wspeed, ch.getLast())
+    # the list is synced with the archive once, each case then appends
+    # its own files
+    statisticsDict.replaceParameterList(
+        "concFileList", concArchive.listFilesInDirs("spec_")
+    )
+    progress["solverRunsLeft"] = len(cases)
+    timeLeft = ledger.predictRemaining(len(cases), iterations)
+    if timeLeft is None:
+        # nothing run in this case before, rough guess
+        timeLeft = iterations * len(cases) * 20
+    timeEstimated = time.localtime(time.time() + timeLeft)
+    log.info(
+        "Estimated time for finish: " +
+        time.strftime("%Y-%m-%d %H:%M", timeEstimated)
+    )
+    try:
+        for case in resumedCases:
+            dirName = caseDirName(case[0], case[1])
+            stagingPath = path.join(stagingDir, dirName)
+            decomposed = (
+                journal.state(dirName) == SweepJournal.SOLVED and
+                len(glob.glob(path.join(stagingPath, "processor*"))) > 0
             )
-            log.info(" ")
-            casesRun += 1
-            casesLeft -= 1
-            timeCase = time.time() - timeInit
-            timeSpent += timeCase
-            timeLeft = casesLeft * timeCase
-            timeEstimated = time.localtime(time.time() + timeLeft)
-
-            ch.clearResults()
-            ch.restoreInitialFields()
-            log.info("Restored initital fields")
-
-            # restoring windData dictionary to original state
-            convTable.writeProbes()
-            convTable.writeResiduals()
-            log.info(
-                "Residuals and probes from solver windFoam " +
-                "written to case/convergence directory"
+            stopReason = journal.info(dirName) or STOP_ITERATIONS
+            pipeline.submit(
+                dirName, postProcess, stagingPath, case, decomposed,
+                stopReason
             )
-            
-    # Restoring controlDict to original state
-    controlDict.purgeFile()
+            caseFinished(case)
+        executor.runOrExit(cases, runCase, caseFinished)
+    finally:
+        # wait for cases still being post-processed
+        pipeline.closeOrExit()
+    # Restoring dictionaries to original state
+    journal.restoreDictionaries()
+    journal.finishSweep()
+    Execution.logSummary(log)
     log.info("Finished batch calculation!")
 
 
 if __name__ == "__main__":
     main()
-
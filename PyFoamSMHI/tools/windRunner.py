@@ -3,22 +3,29 @@
 """Utility to run wind simulations in batch mode."""
 from os import path
 import os
+import glob
 import time
 import sys
+import shutil
 import logging
-from math import cos, sin
 from optparse import OptionParser
 
 # PyFoam modules
 from PyFoam.Execution.ConvergenceRunner import ConvergenceRunner
 from PyFoam.Execution.UtilityRunner import UtilityRunner
 from PyFoam.LogAnalysis.StandardLogAnalyzer import StandardLogAnalyzer
-from PyFoam.RunDictionary.ParameterFile import ParameterFile
 
 # PyFoamContrib
-from PyFoamSMHI.contrib.ParallelExecutionNSC import LAMMachine
+from PyFoamSMHI.contrib.SweepExecutor import SweepExecutor
+from PyFoamSMHI.contrib.DictEditor import DictEditor
+from PyFoamSMHI.contrib.PostProcessingPipeline import PostProcessingPipeline
+from PyFoamSMHI.contrib.ConvergenceMonitor import (
+    ConvergenceMonitor, parseCriteria, STOP_ITERATIONS
+)
 from PyFoamSMHI.contrib import (
-    ConvergenceTable, FoamArchive, ControlFile, CaseHandler
+    ConvergenceTable, FoamArchive, ControlFile, CaseHandler, WarmStart,
+    SweepJournal, RunLedger, Sharding, MeshBoundary, Execution, ObjectStore,
+    FieldArray
 )
 from PyFoamSMHI.contrib.utilities import generateCf
 from PyFoamSMHI.templates.PyFoamWindRunnerCfTemplate import defaultCf
@@ -28,10 +35,13 @@ usage = "usage: %prog controlFile [options] "
 version = "%prog 1.0"
 
 
+def caseDirName(wspeed, wdir):
+    """Name of the archive directory for a case"""
+    return "wspeed_" + str(wspeed) + "_wdir_" + str(wdir)
+
+
 def dir2vec(wdir):
-    wdir_radians = 3.1415926536 / 180 * (90. - wdir)
-    x = -1 * cos(wdir_radians)
-    y = -1 * sin(wdir_radians)
+    x, y, z = MeshBoundary.flowVector(wdir)
     return '(%f %f 0)' % (x, y)
 
 
@@ -57,6 +67,11 @@ def main():
                       action="store", dest="case", default=None,
                       help="Specifies case directory")
 
+    parser.add_option("-s", "--shard",
+                      action="store", type="int", dest="shard", default=None,
+                      help="Index of shard to run when the sweep is split " +
+                      "in shards (default is the job array task id)")
+
     (options, args) = parser.parse_args()
 
     rootLogger = logging.getLogger('')
@@ -131,17 +146,89 @@ def main():
     restoreArchived = cf.findBoolean(
         "restoreArchived:", optional=True, default=False
     )
+    warmStart = cf.findBoolean(
+        "warmStart:", optional=True, default=False
+    )
+    warmStartMaxDirDiff = cf.findScalar(
+        "warmStartMaxDirDiff:", optional=True, default=45.0
+    )
+    speedScaling = cf.findBoolean(
+        "speedScaling:", optional=True, default=False
+    )
+    referenceSpeed = cf.findScalar(
+        "referenceSpeed:", optional=True, default=wspeeds[0]
+    )
+    validationSpeeds = cf.findScalarList(
+        "validateSpeedScaling:", optional=True, default=[]
+    )
+    if speedScaling and referenceSpeed not in wspeeds:
+        logger.error("referenceSpeed must be one of wspeeds")
+        sys.exit(1)
     nodes = int(cf.findScalar("nodes:", optional=False))
     CPUs = cf.findScalar("CPUs:", optional=True)
     if CPUs is None:
         nprocesses = 16 * nodes
     else:
         nprocesses = int(CPUs)
+    workers = int(cf.findScalar("workers:", optional=True, default=1))
+    decomposeOnce = cf.findBoolean(
+        "decomposeOnce:", optional=True, default=False
+    )
+    postProcessWorkers = int(
+        cf.findScalar("postProcessWorkers:", optional=True, default=0)
+    )
+    convergenceCriteria = parseCriteria(
+        cf.findStringList("convergenceCriteria:", optional=True, default=[])
+    )
+    plateauWindow = cf.findInt(
+        "convergencePlateauWindow:", optional=True, default=None
+    )
+    plateauSlope = cf.findScalar(
+        "convergencePlateauSlope:", optional=True, default=None
+    )
+    compressArchive = cf.findBoolean(
+        "compressArchive:", optional=True, default=False
+    )
+    dedupArchive = cf.findBoolean(
+        "dedupArchive:", optional=True, default=False
+    )
+    archiveFieldArrays = cf.findBoolean(
+        "archiveFieldArrays:", optional=True, default=False
+    )
+    packArchive = cf.findBoolean(
+        "packArchive:", optional=True, default=False
+    )
+    archiveCompressionLevel = int(cf.findScalar(
+        "archiveCompressionLevel:", optional=True,
+        default=Execution.GZIP_LEVEL
+    ))
+    shards = int(cf.findScalar("shards:", optional=True, default=1))
+    shard = Sharding.shardIndex(options.shard, shards)
     # -----------------------------------
     solver = cf.findString("solver:", default="windFoam")
     initCmds = cf.findStringList("initialize:", default=["setLanduse"])
-    flowArchive = FoamArchive.FoamArchive(casePath, archiveDirName)
-    nwdir = len(wdirs)
+    # archive and ledger are shared by all shards of the sweep
+    store = None
+    if dedupArchive:
+        store = ObjectStore.ObjectStore(
+            path.join(casePath, ObjectStore.STORE_DIR)
+        )
+    meshId = None
+    if archiveFieldArrays:
+        meshId = FieldArray.meshId(path.join(ch.constantDir(), "polyMesh"))
+    flowArchive = FoamArchive.FoamArchive(
+        casePath, archiveDirName, compress=compressArchive,
+        level=archiveCompressionLevel, store=store,
+        arrays=archiveFieldArrays, meshId=meshId, pack=packArchive
+    )
+    ledger = RunLedger.RunLedger(casePath)
+    if shard is not None:
+        # each shard runs in a clone of the case
+        casePath = Sharding.createShard(ch, shard)
+        ch = CaseHandler.CaseHandler(casePath)
+    runWdirs = Sharding.shardDirections(wdirs, shard, shards)
+    Execution.setMetricsFile(path.join(casePath, Execution.METRICS_FILE))
+    nwdir = len(runWdirs)
     convTable = ConvergenceTable.ConvergenceTable(casePath)
 
     logger.info("Running windRunner.py")
@@ -149,269 +236,512 @@ def main():
     logger.info(25 * "-")
     logger.info("Case: " + caseName)
     logger.info(25 * "-")
-    logger.info("Wind directions are: " + str(wdirs))
+    if shard is not None:
+        logger.info("Shard %i of %i" % (shard, shards))
+    logger.info("Wind directions are: " + str(runWdirs))
     logger.info("Wind speeds are: " + str(wspeeds))
     nruns = nwdir * len(wspeeds)
     logger.info("Total number of runs: " + str(nruns))
     logger.info(25 * "-")
     logger.info("Number of iterations are: " + str(iterations))
     logger.info("Number of nodes are: " + str(nodes))
+    logger.info("Number of concurrent cases are: " + str(workers))
     logger.info("Fields to be archived: " + str(fieldsToArchive))
     logger.info(50 * "=")
 
-    controlDict = ParameterFile(ch.controlDict())
-    # uses include file from 0/include
-    ABLConditions = ParameterFile(
-        path.join(ch.name, '0', 'include', 'ABLConditions')
-    )
+    controlDict = DictEditor(ch.controlDict())
 
     compression = controlDict.readParameter("writeCompression")
     if compression == "compressed" or compression == "on":
         filesToArchive = [field + ".gz" for field in fieldsToArchive]
     else:
         filesToArchive = fieldsToArchive
+    warmStartFiles = [
+        f for f in filesToArchive
+        if f.replace(".gz", "") in WarmStart.SPEED_EXPONENTS
+    ]
+    unscalable = [
+        f for f in fieldsToArchive if f not in WarmStart.SPEED_EXPONENTS
+    ]
+    if speedScaling and len(unscalable) > 0:
+        logger.error(
+            "Cannot derive cases by speed scaling, unknown scaling of " +
+            "fields: " + " ".join(unscalable)
+        )
+        sys.exit(1)
+
+    journal = SweepJournal.SweepJournal(casePath, "windRunner")
+    interrupted = journal.isInterrupted()
+    if interrupted:
+        # dictionaries and fields may be left modified by the last run
+        logger.info(
+            "Previous sweep was interrupted, unfinished cases: " +
+            str(journal.unfinishedCases())
+        )
+        journal.restoreDictionaries()
+        ch.clearResults()
+        ch.restoreInitialFields()
+        logger.info("Restored dictionaries and initial fields")
+    else:
+        ch.backUpInitialFields()
+        logger.info("Backup made of initial fields")
+    journal.startSweep([
+        path.relpath(ch.controlDict(), casePath),
+        path.join('0', 'include', 'ABLConditions')
+    ])
+
+    # working copies of the case, each booting its own lammachine
+    # for parallell execution
+    executor = SweepExecutor(ch, nworkers=workers, nprocesses=nprocesses)
+    if interrupted:
+        for worker in executor.workers:
+            if worker.case is not ch:
+                journal.restoreDictionaries(worker.case.name)
+                worker.case.clearResults()
+                worker.case.restoreInitialFields()
+    ledger.startSweep(
+        "windRunner", nprocesses, executor.nworkers, iterations, nruns
+    )
+    pipeline = PostProcessingPipeline(nworkers=postProcessWorkers)
+    stagingDir = path.join(casePath, "stagedResults")
+
+    def runCase(worker, case):
+        """Run a single wind case in the case directory of a worker"""
+        wspeed, wdir, runIndex = case
+        wch = worker.case
+        wcasePath = wch.name
+        Lam = worker.lam
+        dirName = caseDirName(wspeed, wdir)
+        timer = RunLedger.StageTimer()
+        timer.start("setup")
+
+        # dictionaries are edited in memory and written once
+        wControlDict = DictEditor(wch.controlDict())
+        # uses include file from 0/include
+        ABLConditions = DictEditor(
+            path.join(wch.name, '0', 'include', 'ABLConditions')
+        )
+        wControlDict.replaceParameter("stopAt", "nextWrite")
+        wControlDict.replaceParameter(
+            "writeInterval",
+            str(iterations)
+        )
+        wControlDict.write()
+        logger.info(
+            "Running calculations for dir: " +
+            str(wdir) + " speed: " + str(wspeed) +
+            " in " + path.basename(wcasePath)
+        )
+        wch.clearResults()
 
-    # booting lammachine for parallell execution
-    if nprocesses > 1:
-        Lam = LAMMachine(nr=nprocesses)
-        Lam.writeScotch(ch)
-    controlDict.replaceParameter("stopAt", "nextWrite")
+        logger.info("...Modifying bc:s")
+        wch.modWindDir(wch.initialDir(), wdir)
+        logger.info("bc:s modified!")
 
-    timeLeft = iterations * nruns * 20
-    timeSpent = 05
-    timeCase = iterations * 20
-    timeEstimated = time.localtime(time.time() + timeLeft)
-    casesRun = 0
-    casesLeft = nruns
-    ch.backUpInitialFields()
-    logger.info("Backup made of initial fields")
-    for wspeed in wspeeds:
-        for wdir in wdirs:
-            timeInit = time.time()
-            controlDict.replaceParameter(
-                "writeInterval",
-                str(iterations)
-            )
-            logger.info(
-                "Running calculations for dir: " +
-                str(wdir) + " speed: " + str(wspeed)
-            )
-            logger.info(
-                "Time left: " + str(timeLeft/60.0) +
-                "min, Time spent: " + str(timeSpent/60.0) + "min"
-            )
-            logger.info(
-                "Estimated time for finish: " +
-                str(timeEstimated[:4])
-            )
-            logger.info(
-                "Cases finished: " + str(casesRun) +
-                " cases left: " + str(casesLeft))
-            logger.info(" ")
-            ch.clearResults()
-
-            dirName = "wspeed_" + str(wspeed) + "_wdir_"+str(wdir)
-            logger.info("restoreArchived = "+str(restoreArchived))
-            if flowArchive.inArchive(dirName=dirName) and not restoreArchived:
-                logger.info('Results already in archive, moving on...')
-                casesRun += 1
-                casesLeft -= 1
-                timeCase = time.time() - timeInit
-                timeSpent += timeCase
-                timeLeft = casesLeft * timeCase
-                timeEstimated = time.localtime(time.time() + timeLeft)
-                continue               
-
-            logger.info("...Modifying bc:s")
-            ch.modWindDir(ch.initialDir(), wdir)
-            logger.info("bc:s modified!")
-
-            ABLConditions.replaceParameter(
-                "Uref", "%f" % wspeed
+        ABLConditions.replaceParameter(
+            "Uref", "%f" % wspeed
+        )
+        ABLConditions.replaceParameter(
+            "flowDir",
+            dir2vec(wdir)
+        )
+        ABLConditions.replaceParameter(
+            "z0",
+            'uniform %f' % z0Dict[wdir]
+        )
+        ABLConditions.write()
+        for initCmd in initCmds:
+            initUtil = UtilityRunner(
+                argv=[initCmd, "-case", wcasePath],
+                silent=True,
+                logname=initCmd
             )
-            ABLConditions.replaceParameter(
-                "flowDir",
-                dir2vec(wdir)
+            initUtil.start()
+            if initUtil.runOK():
+                logger.info(
+                    "Successfully finished: %s" % initCmd
+                )
+            else:
+                logger.error(
+                    "Error when running: %s" % initCmd
+                )
+                sys.exit(1)
+        if restoreArchived and \
+           flowArchive.inArchive(dirName=dirName):
+            logger.info("Restoring archived flow fields")
+            flowArchive.restore(
+                dirName, wch.initialDir(), fieldsToArchive
             )
-            ABLConditions.replaceParameter(
-                "z0",
-                'uniform %f' % z0Dict[wdir]
+            for filename in fieldsToArchive:
+                flowArchive.getFile(
+                    outputFile=path.join(wch.initialDir(), filename),
+                    fileName=filename, archiveDirName=dirName
+                )
+            logger.info("Restored archived flow fields!")
+        elif warmStart:
+            nearest = WarmStart.findNearestCase(
+                flowArchive, wspeed, wdir, warmStartFiles,
+                maxDirDiff=warmStartMaxDirDiff
             )
-            for initCmd in initCmds:
-                initUtil = UtilityRunner(
-                    argv=[initCmd, "-case", casePath],
-                    silent=True,
-                    logname=initCmd
+            if nearest is None:
+                logger.info("No archived case to warm-start from")
+            else:
+                logger.info(
+                    "Warm-starting from archived case: " + nearest[0]
                 )
-                initUtil.start()
-                if initUtil.runOK():
-                    logger.info(
-                        "Successfully finished: %s" % initCmd
-                    )
-                else:
-                    logger.error(
-                        "Error when running: %s" % initCmd
-                    )
-                    sys.exit(1)
-            if restoreArchived and \
-               flowArchive.inArchive(dirName=dirName):
-                logger.info("Restoring archived flow fields")
-                flowArchive.restore(
-                    dirName, ch.initialDir(), fieldsToArchive
+                WarmStart.warmStart(
+                    flowArchive, nearest[0], nearest[1], nearest[2],
+                    wspeed, wdir, wch.initialDir(), warmStartFiles
                 )
-                for filename in fieldsToArchive:
-                    flowArchive.getFile(
-                        outputFile=path.join(ch.initialDir(), filename),
-                        fileName=filename, archiveDirName=dirName
-                    )
-                logger.info("Restored archived flow fields!")
-
-            if nprocesses > 1:
-                if Lam.machineOK():
-                    decomposeCmd = "decomposePar"
-                    decomposeUtil = UtilityRunner(
-                        argv=[decomposeCmd, "-case", casePath],
-                        silent=True,
-                        logname="decomposePar"
-                    )
+                logger.info("Initial fields set from archived case!")
+        journal.record(dirName, SweepJournal.RESTORED)
+
+        timer.start("decompose")
+        if Lam is not None:
+            if Lam.machineOK():
+                decomposeCmd = "decomposePar"
+                if decomposeOnce and wch.isDecomposed(Lam.cpuNr()):
+                    # mesh is already decomposed, only refresh fields
+                    decomposeArgs = ["-fields"]
+                    logger.info("...Decomposing fields of case")
+                else:
+                    decomposeArgs = ["-force"]
                     logger.info(
                         "...Decomposing case to run on" +
                         str(Lam.cpuNr())+str(" of processors")
                     )
-                    decomposeUtil.start()
-                    if decomposeUtil.runOK():
-                        logger.info("Case decomposed!")
-                    else:
-                        logger.error("Error when running decomposePar")
-                        sys.exit()
+                decomposeUtil = UtilityRunner(
+                    argv=[decomposeCmd] + decomposeArgs +
+                    ["-case", wcasePath],
+                    silent=True,
+                    logname="decomposePar"
+                )
+                decomposeUtil.start()
+                if decomposeUtil.runOK():
+                    logger.info("Case decomposed!")
+                    journal.record(dirName, SweepJournal.DECOMPOSED)
                 else:
-                    logger.error("Error: Could not start lam-machine")
+                    logger.error("Error when running decomposePar")
                     sys.exit()
             else:
-                Lam = None
-                logger.info("Serial Run chosen!")
-
-            logger.info("...Running solver for wind field")
-            windFoamSolver = ConvergenceRunner(
-                StandardLogAnalyzer(),
-                argv=[solver, "-case", casePath],
-                silent=True,
-                lam=Lam,
-                logname=solver
-            )
-            windFoamSolver.start()
-            if windFoamSolver.runOK():
-                logger.info("Iterations finished for solver")
-            else:
-                logger.error("Error while running solver")
+                logger.error("Error: Could not start lam-machine")
                 sys.exit()
-
-            if nprocesses > 1:
-                logger.info("Reconstructing decomposed case...")
-                reconstructCmd = "reconstructPar"
-                reconstructUtil = UtilityRunner(
-                    argv=[reconstructCmd, "-latestTime", "-case", casePath],
-                    silent=True,
-                    logname="reconstrucPar")
-                reconstructUtil.start()
-                if reconstructUtil.runOK():
-                    logger.info("recunstruction ready!")
-                else:
-                    logger.error("Error while running recontructPar")
-                    sys.exit(1)
-
-                logger.info("Removing decomposed mesh")
-                ch.execute("rm -r " + os.path.join(casePath, "processor*"))
-                logger.info("Removed decomposed mesh!")
-
-            convTable.addResidual(
-                "wd_" + str(wdir) + "_ws_" + str(wspeed),
-                solver,
-                "linear_Ux",
-                casesRun + 1
+        else:
+            logger.info("Serial Run chosen!")
+
+        logger.info("...Running solver for wind field")
+        timer.start("solve")
+        analyzer = StandardLogAnalyzer()
+        monitor = None
+        if len(convergenceCriteria) > 0:
+            monitor = ConvergenceMonitor(
+                wch.controlDict(), convergenceCriteria,
+                plateauWindow=plateauWindow, plateauSlope=plateauSlope
             )
-            convTable.addResidual(
-                "wd_" + str(wdir) + "_ws_" + str(wspeed),
-                solver,
-                "linear_Uy",
-                casesRun + 1
+            analyzer.addAnalyzer("convergenceCriteria", monitor)
+        windFoamSolver = ConvergenceRunner(
+            analyzer,
+            argv=[solver, "-case", wcasePath],
+            silent=True,
+            lam=Lam,
+            logname=solver
+        )
+        windFoamSolver.start()
+        # the solver writes time directories in the case
+        wch.invalidate()
+        if windFoamSolver.runOK():
+            logger.info("Iterations finished for solver")
+        else:
+            logger.error("Error while running solver")
+            sys.exit()
+
+        if monitor is not None:
+            stopReason = monitor.reason
+        else:
+            stopReason = STOP_ITERATIONS
+        journal.record(dirName, SweepJournal.SOLVED, stopReason)
+
+        timer.start("postProcess")
+        if pipeline.nworkers > 0:
+            # move results out of the way and continue with next case
+            # while they are reconstructed and archived in background
+            stagingPath = path.join(stagingDir, dirName)
+            wch.stageResults(
+                stagingPath, keepDecomposition=decomposeOnce,
+                extraDirs=[solver + ".analyzed", "probes"]
             )
-            convTable.addResidual(
-                "wd_" + str(wdir) + "_ws_" + str(wspeed),
-                solver,
-                "linear_k",
-                casesRun + 1
+            pipeline.submit(
+                dirName, postProcess, stagingPath, case, Lam is not None,
+                stopReason
             )
+        else:
+            postProcess(wcasePath, case, Lam is not None, stopReason)
+            if Lam is not None and decomposeOnce:
+                wch.clearProcessorResults()
+                logger.info("Removed results from decomposed case")
+            elif Lam is not None:
+                logger.info("Removing decomposed mesh")
+                wch.removeProcessorDirs()
+                logger.info("Removed decomposed mesh!")
+
+        timer.start("cleanup")
+        wch.clearResults()
+        logger.info(
+            "Cleared all result directories exept: %s"
+            % (" ".join(wch.getTimes()))
+        )
+        wch.restoreInitialFields()
+        logger.info("Restored initital fields from backup copy")
+        # restoring windData dictionary to original state
+        ABLConditions.rollback()
+        # Restoring controlDict to original state
+        wControlDict.rollback()
+        if monitor is not None:
+            iterationsRun = monitor.iterations
+        else:
+            iterationsRun = iterations
+        ledger.addCase(
+            dirName, wspeed, wdir, iterationsRun, stopReason, timer
+        )
+        return dirName
+
+    def postProcess(pcasePath, case, decomposed, stopReason):
+        """Reconstruct and archive a finished case and add its convergence
+        @param pcasePath: case holding the results, this is a staging case
+        when post-processing runs in the background
+        @param decomposed: True if the case was run in parallel
+        @param stopReason: why the solver stopped"""
+        wspeed, wdir, runIndex = case
+        dirName = caseDirName(wspeed, wdir)
+        timeStart = time.time()
+        if decomposed:
+            logger.info("Reconstructing decomposed case...")
+            reconstructCmd = "reconstructPar"
+            reconstructUtil = UtilityRunner(
+                argv=[reconstructCmd, "-latestTime", "-case", pcasePath],
+                silent=True,
+                logname="reconstrucPar")
+            reconstructUtil.start()
+            if reconstructUtil.runOK():
+                logger.info("recunstruction ready!")
+            else:
+                logger.error("Error while running recontructPar")
+                sys.exit(1)
+            journal.record(dirName, SweepJournal.RECONSTRUCTED, stopReason)
+        pch = CaseHandler.CaseHandler(pcasePath)
+
+        runId = "wd_" + str(wdir) + "_ws_" + str(wspeed)
+        iterationsReady = (
+            int(float(pch.getLast())) -
+            int(float(path.basename(ch.initialDir())))
+        )
+        convTable.addStopInfo(runId, runIndex, iterationsReady, stopReason)
+        for residual in ["linear_Ux", "linear_Uy", "linear_k",
+                         "linear_epsilon"]:
             convTable.addResidual(
-                "wd_" + str(wdir) + "_ws_" + str(wspeed),
-                solver,
-                "linear_epsilon",
-                casesRun + 1
-            )
-            convTable.addProbes(
-                "wd_" + str(wdir) + "_ws_" + str(wspeed),
-                "U",
-                casesRun + 1)
-            convTable.addProbes(
-                "wd_" + str(wdir) + "_ws_" + str(wspeed),
-                "k",
-                casesRun + 1
+                runId, solver, residual, runIndex, caseDir=pcasePath
             )
+        for probeField in ["U", "k", "epsilon", "p"]:
             convTable.addProbes(
-                "wd_" + str(wdir) + "_ws_" + str(wspeed),
-                "epsilon",
-                casesRun + 1
+                runId, probeField, runIndex, caseDir=pcasePath
             )
-            convTable.addProbes(
-                "wd_" + str(wdir) + "_ws_" + str(wspeed),
-                "p",
-                casesRun + 1
+
+        logger.info(
+            "Archiving results from directory: %s" % pch.latestDir()
+        )
+        # save latest concentration result files
+        solFiles = [file for file in os.listdir(pch.latestDir())
+                    if file in filesToArchive]
+        # a case left partially archived is removed when resuming
+        journal.record(dirName, SweepJournal.ARCHIVING, stopReason)
+        flowArchive.addFiles(
+            [path.join(pch.latestDir(), f) for f in solFiles],
+            dirName=dirName
+        )
+        flowArchive.setCaseKey(dirName, wspeed, wdir, z0Dict[wdir])
+
+        journal.record(dirName, SweepJournal.ARCHIVED)
+
+        logger.info(
+            "Finished wdir: " + str(wdir) + " wspeed: " +
+            str(wspeed) + "Last iter = " + pch.getLast()
+        )
+        logger.info(" ")
+        convTable.writeProbes()
+        convTable.writeResiduals()
+        convTable.writeStopInfo()
+        logger.info(
+            "Residuals and probes from solver " +
+            "written to case/convergence directory"
+        )
+        if path.dirname(pcasePath) == stagingDir:
+            shutil.rmtree(pcasePath)
+            ledger.addStage(
+                dirName, "backgroundPostProcess", time.time() - timeStart
             )
 
-            logger.info(
-                "Archiving results from directory: %s" % ch.latestDir()
+    progress = {
+        "casesRun": 0,
+        "casesLeft": nruns,
+        "solverRunsLeft": 0,
+        "timeStart": time.time()
+    }
+
+    def caseFinished(case, result=None):
+        """Book-keeping when a case is done, called in the main thread"""
+        progress["casesRun"] += 1
+        progress["casesLeft"] -= 1
+        if result is not None:
+            progress["solverRunsLeft"] -= 1
+        timeSpent = time.time() - progress["timeStart"]
+        timeLeft = ledger.predictRemaining(
+            progress["solverRunsLeft"], iterations
+        )
+        if timeLeft is None:
+            timeLeft = (
+                progress["casesLeft"] * timeSpent / progress["casesRun"]
             )
-            # save latest concentration result files
-            solFiles = [file for file in os.listdir(ch.latestDir())
-                        if file in filesToArchive]
-            for filename in solFiles:
-                dirName = "wspeed_" + str(wspeed) + "_wdir_" + str(wdir)
-                flowArchive.addFile(
-                    path.join(ch.latestDir(), filename),
-                    dirName=dirName
+        timeEstimated = time.localtime(time.time() + timeLeft)
+        logger.info(
+            "Time left: " + str(timeLeft/60.0) +
+            "min, Time spent: " + str(timeSpent/60.0) + "min"
+        )
+        logger.info(
+            "Estimated time for finish: " +
+            time.strftime("%Y-%m-%d %H:%M", timeEstimated)
+        )
+        logger.info(
+            "Cases finished: " + str(progress["casesRun"]) +
+            " cases left: " + str(progress["casesLeft"]))
+
+    logger.info("restoreArchived = "+str(restoreArchived))
+    cases = []
+    scaledCases = []
+    resumedCases = []
+    runIndex = 0
+    for wspeed in wspeeds:
+        for wdir in wdirs:
+            runIndex += 1
+            if wdir not in runWdirs:
+                continue
+            dirName = caseDirName(wspeed, wdir)
+            state = journal.state(dirName)
+            # archives of cases in other states are complete, e.g. from
+            # an earlier sweep when restoreArchived is set
+            if flowArchive.inArchive(dirName=dirName) and \
+               state in SweepJournal.PARTIAL_STATES:
+                logger.warning(
+                    "Removing partially archived case: %s" % dirName
                 )
-
-            logger.info(
-                "Finished wdir: " + str(wdir) + " wspeed: " +
-                str(wspeed) + "Last iter = " + ch.getLast()
+                flowArchive.removeDir(dirName)
+            if flowArchive.inArchive(dirName=dirName) and \
+               not restoreArchived:
+                logger.info(
+                    'Results for %s already in archive, moving on...' %
+                    dirName
+                )
+                caseFinished((wspeed, wdir, runIndex))
+                continue
+            stagingPath = path.join(stagingDir, dirName)
+            if state in (SweepJournal.SOLVED, SweepJournal.RECONSTRUCTED,
+                         SweepJournal.ARCHIVING) \
+               and path.exists(stagingPath):
+                logger.info(
+                    "Resuming post-processing of solved case: %s" % dirName
+                )
+                resumedCases.append((wspeed, wdir, runIndex))
+                continue
+            journal.record(dirName, SweepJournal.QUEUED)
+            if speedScaling and wspeed != referenceSpeed and \
+               wspeed not in validationSpeeds:
+                scaledCases.append((wspeed, wdir, runIndex))
+                continue
+            cases.append((wspeed, wdir, runIndex))
+
+    progress["solverRunsLeft"] = len(cases)
+    timeLeft = ledger.predictRemaining(len(cases), iterations)
+    if timeLeft is None:
+        # nothing run in this case before, rough guess
+        timeLeft = iterations * len(cases) * 20
+    timeEstimated = time.localtime(time.time() + timeLeft)
+    logger.info(
+        "Estimated time for finish: " +
+        time.strftime("%Y-%m-%d %H:%M", timeEstimated)
+    )
+    try:
+        for case in resumedCases:
+            dirName = caseDirName(case[0], case[1])
+            stagingPath = path.join(stagingDir, dirName)
+            decomposed = (
+                journal.state(dirName) == SweepJournal.SOLVED and
+                len(glob.glob(path.join(stagingPath, "processor*"))) > 0
             )
-            logger.info(" ")
-            casesRun += 1
-            casesLeft -= 1
-            timeCase = time.time() - timeInit
-            timeSpent += timeCase
-            timeLeft = casesLeft * timeCase
-            timeEstimated = time.localtime(time.time() + timeLeft)
-
-            ch.clearResults()
-            logger.info(
-                "Cleared all result directories exept: %s"
-                % (" ".join(ch.getTimes()))
+            stopReason = journal.info(dirName) or STOP_ITERATIONS
+            pipeline.submit(
+                dirName, postProcess, stagingPath, case, decomposed,
+                stopReason
             )
-            ch.restoreInitialFields()
-            logger.info("Restored initital fields from backup copy")
-            # restoring windData dictionary to original state
-            ABLConditions.purgeFile()
-            convTable.writeProbes()
-            convTable.writeResiduals()
+            caseFinished(case)
+        executor.runOrExit(cases, runCase, caseFinished)
+    finally:
+        # wait for cases still being post-processed
+        pipeline.closeOrExit()
+
+    if speedScaling:
+        scalingDir = path.join(stagingDir, "speedScaling")
+        if not path.exists(scalingDir):
+            os.makedirs(scalingDir)
+        for case in scaledCases:
+            wspeed, wdir, runIndex = case
+            dirName = caseDirName(wspeed, wdir)
+            refDirName = caseDirName(referenceSpeed, wdir)
+            if not flowArchive.filesInArchive(refDirName, filesToArchive):
+                logger.error(
+                    "Cannot derive %s, reference case %s not archived" % (
+                        dirName, refDirName)
+                )
+                sys.exit(1)
             logger.info(
-                "Residuals and probes from solver " +
-                "written to case/convergence directory"
+                "Deriving %s by scaling %s" % (dirName, refDirName)
+            )
+            # a case left partially scaled is removed when resuming
+            journal.record(dirName, SweepJournal.SCALING)
+            WarmStart.scaleCase(
+                flowArchive, refDirName, referenceSpeed,
+                dirName, wspeed, filesToArchive, scalingDir
             )
-    # Restoring controlDict to original state
-    controlDict.purgeFile()
+            flowArchive.setCaseKey(dirName, wspeed, wdir, z0Dict[wdir])
+            journal.record(dirName, SweepJournal.ARCHIVED)
+            caseFinished(case)
+
+        for wspeed in validationSpeeds:
+            for wdir in runWdirs:
+                dirName = caseDirName(wspeed, wdir)
+                refDirName = caseDirName(referenceSpeed, wdir)
+                if not flowArchive.filesInArchive(dirName, warmStartFiles) \
+                   or not flowArchive.filesInArchive(
+                       refDirName, warmStartFiles):
+                    logger.warning(
+                        "Cannot validate speed scaling for %s" % dirName
+                    )
+                    continue
+                metadata = flowArchive.getMetadata(dirName)
+                for fileName in warmStartFiles:
+                    error = WarmStart.scalingError(
+                        flowArchive, refDirName, referenceSpeed,
+                        dirName, wspeed, fileName
+                    )
+                    logger.info(
+                        "Speed scaling error for %s in %s: %f" % (
+                            fileName, dirName, error)
+                    )
+                    metadata["scalingError_" + fileName] = error
+                flowArchive.setMetadata(dirName, metadata)
+    # Restoring dictionaries to original state
+    journal.restoreDictionaries()
+    journal.finishSweep()
+    Execution.logSummary(logger)
     logger.info("Finished batch calculation!")
 
 if __name__ == "__main__":
     main()
-
@@ -32,10 +32,15 @@ setup(
             'setWdir = PyFoamSMHI.tools.setWdir:main',
             'archiveToRuntime = PyFoamSMHI.tools.archiveToRuntime:main',
             'batchRun = PyFoamSMHI.tools.batchRun:main',
+            'mergeShards = PyFoamSMHI.tools.mergeShards:main',
+            'archiveIndex = PyFoamSMHI.tools.archiveIndex:main',
+            'fieldArray = PyFoamSMHI.tools.fieldArray:main',
         ],
     },
     setup_requires=['setuptools_git'],
     install_requires=install_requires,
+    # memory-mapped readback of field arrays, see FieldArray
+    extras_require={'arrays': ['numpy']},
 
     tests_require=tests_require,
     test_suite='PyFoamSMHI.tests',